@@ -1,7 +1,7 @@
-from flask import Flask, send_from_directory
+from flask import Flask
 from config import Config
 from flask_cors import CORS
-from extensions import db, migrate, jwt
+from extensions import db, migrate, jwt, audit_writer, notification_bus, settings_cache, image_pipeline, mpesa_outbox
 from flask_jwt_extended import JWTManager
 from models import User
 
@@ -19,6 +19,24 @@ CORS(app,
 db.init_app(app)
 migrate.init_app(app, db)
 jwt.init_app(app)
+audit_writer.init_app(app)
+notification_bus.init_app(app)
+notification_bus.register_session_events(db.session)
+settings_cache.init_app(app)
+image_pipeline.init_app(app)
+mpesa_outbox.init_app(app)
+
+# Record changes to audited models (see AUDITED_MODELS) on every flush
+from utils.audit_capture import init_audit_capture
+init_audit_capture(db.session)
+
+# Raise one low-stock notification per threshold crossing, evaluated at commit
+from utils.stock_alerts import init_stock_alerts
+init_stock_alerts(db.session)
+
+# Drop cached category product counts when products are added, moved or (de)activated
+from utils.category_counts import init_category_counts
+init_category_counts(db.session)
 
 # Import and register routes
 from routes.users_route import users_bp
@@ -33,6 +51,7 @@ from routes.notifications_route import notifications_bp
 from routes.settings_route import settings_bp
 from routes.suppliers_route import suppliers_bp
 from routes.audit_route import audit_bp
+from routes.purchase_orders_route import purchase_orders_bp
 
 app.register_blueprint(users_bp, url_prefix='/api')
 app.register_blueprint(product_image_bp, url_prefix='/api/product-images')
@@ -46,21 +65,24 @@ app.register_blueprint(notifications_bp, url_prefix='/api')
 app.register_blueprint(settings_bp, url_prefix='/api')
 app.register_blueprint(suppliers_bp, url_prefix='/api')
 app.register_blueprint(audit_bp, url_prefix='/api')
+app.register_blueprint(purchase_orders_bp, url_prefix='/api')
 
 @app.route('/')
 def home():
     return "Hello, World!"
 
 
-# Serve static files (uploads)
+from utils.upload_serving import send_upload
+
+# Serve static files (uploads); see UPLOAD_SERVE_MODE to let the front web server send them
 @app.route('/static/uploads/<path:filename>')
 def serve_upload(filename):
-    return send_from_directory('static/uploads', filename)
+    return send_upload(filename)
 
 # Also serve uploads at /uploads/ path for frontend compatibility
 @app.route('/uploads/<path:filename>')
 def serve_upload_alt(filename):
-    return send_from_directory('static/uploads', filename)
+    return send_upload(filename)
 
 
 
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Archive and delete audit logs older than the retention period.
+
+Rows are written to gzip-compressed monthly JSONL files under
+AUDIT_ARCHIVE_FOLDER (with index.jsonl describing each batch) and then
+deleted in bounded batches. Intended to be scheduled (e.g. nightly cron):
+
+  python archive_audit_logs.py --days 90
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+from app import app
+from utils.audit_retention import purge_audit_logs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive and purge old audit logs")
+    parser.add_argument("--days", type=int, default=90, help="keep logs newer than this many days")
+    parser.add_argument("--batch-size", type=int, default=None, help="rows archived and deleted per transaction")
+    parser.add_argument("--no-archive", action="store_true", help="delete without writing archive files")
+    args = parser.parse_args()
+
+    cutoff = datetime.now() - timedelta(days=args.days)
+    with app.app_context():
+        result = purge_audit_logs(cutoff, archive=not args.no_archive, batch_size=args.batch_size)
+
+    print(f"Deleted {result['deleted_count']} audit logs older than {cutoff.isoformat()} in {result['batches']} batches")
+    for filename in result["archive_files"]:
+        print(f"- archived to {filename}")
+
+
+if __name__ == "__main__":
+    main()
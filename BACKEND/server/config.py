@@ -25,3 +25,101 @@ class Config:
 
     # Ensure upload folder exists
     os.makedirs(UPLOAD_FOLDER, exist_ok=True) 
+
+    # Bulk image upload (zip archive of images named by barcode or product id)
+    BULK_IMAGE_MAX_ARCHIVE_SIZE = int(os.getenv('BULK_IMAGE_MAX_ARCHIVE_SIZE', 500 * 1024 * 1024))
+    BULK_IMAGE_MAX_FILES = int(os.getenv('BULK_IMAGE_MAX_FILES', 2000))
+    BULK_IMAGE_MAX_FILE_SIZE = int(os.getenv('BULK_IMAGE_MAX_FILE_SIZE', 10 * 1024 * 1024))
+    BULK_IMAGE_WORKERS = int(os.getenv('BULK_IMAGE_WORKERS', 4))
+
+    # Unreferenced image files younger than this (seconds) are kept: an identical upload may not have committed yet.
+    # sweep_image_files.py deletes them once they are older
+    IMAGE_RELEASE_GRACE = int(os.getenv('IMAGE_RELEASE_GRACE', 300))
+
+    # Upload serving: 'flask', 'x-accel' (nginx X-Accel-Redirect) or 'x-sendfile' (Apache/lighttpd)
+    UPLOAD_SERVE_MODE = os.getenv('UPLOAD_SERVE_MODE', 'flask')
+    # nginx internal location aliased to UPLOAD_FOLDER, e.g.
+    #   location /protected-uploads/ { internal; alias /srv/pos/static/uploads/; }
+    UPLOAD_ACCEL_PREFIX = os.getenv('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+    # Browser cache lifetime for files that can change (content-addressed files are immutable)
+    UPLOAD_CACHE_MAX_AGE = int(os.getenv('UPLOAD_CACHE_MAX_AGE', 3600))
+
+    # Thumbnail/WebP renditions generated in the background after upload (needs Pillow)
+    IMAGE_PIPELINE_ENABLED = os.getenv('IMAGE_PIPELINE_ENABLED', 'true').lower() == 'true'
+    IMAGE_PIPELINE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', 2))
+    IMAGE_THUMBNAIL_SIZE = int(os.getenv('IMAGE_THUMBNAIL_SIZE', 300))
+    IMAGE_WEBP_MAX_SIZE = int(os.getenv('IMAGE_WEBP_MAX_SIZE', 1200))
+    IMAGE_WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', 80))
+
+    # M-Pesa (Daraja) access tokens are cached until this many seconds before they expire
+    MPESA_TOKEN_REFRESH_MARGIN = int(os.getenv('MPESA_TOKEN_REFRESH_MARGIN', 300))
+    # Share the token between worker processes through this file (unset: per process)
+    MPESA_TOKEN_CACHE_FILE = os.getenv('MPESA_TOKEN_CACHE_FILE')
+    # Daraja HTTP: pooled keep-alive connections, (connect, read) timeouts in seconds and
+    # retries with exponential backoff for calls that are safe to repeat
+    MPESA_POOL_MAXSIZE = int(os.getenv('MPESA_POOL_MAXSIZE', 10))
+    MPESA_CONNECT_TIMEOUT = float(os.getenv('MPESA_CONNECT_TIMEOUT', 5))
+    MPESA_READ_TIMEOUT = float(os.getenv('MPESA_READ_TIMEOUT', 30))
+    MPESA_MAX_RETRIES = int(os.getenv('MPESA_MAX_RETRIES', 2))
+    MPESA_RETRY_BACKOFF = float(os.getenv('MPESA_RETRY_BACKOFF', 0.5))
+    # STK pushes for M-Pesa sales are sent by a background dispatcher from the mpesa_outbox table
+    MPESA_OUTBOX_ENABLED = os.getenv('MPESA_OUTBOX_ENABLED', 'true').lower() == 'true'
+    MPESA_OUTBOX_POLL_INTERVAL = float(os.getenv('MPESA_OUTBOX_POLL_INTERVAL', 5))
+    MPESA_OUTBOX_BATCH_SIZE = int(os.getenv('MPESA_OUTBOX_BATCH_SIZE', 10))
+    MPESA_OUTBOX_MAX_ATTEMPTS = int(os.getenv('MPESA_OUTBOX_MAX_ATTEMPTS', 3))
+    MPESA_OUTBOX_RETRY_BACKOFF = float(os.getenv('MPESA_OUTBOX_RETRY_BACKOFF', 5))
+    # A row still being sent after this many seconds is treated as abandoned (outcome unknown, never resent);
+    # keep it above one send: MPESA_CONNECT_TIMEOUT * (MPESA_MAX_RETRIES + 1) + MPESA_READ_TIMEOUT
+    MPESA_OUTBOX_LEASE = int(os.getenv('MPESA_OUTBOX_LEASE', 120))
+    # Pushes with an unknown outcome wait this long for their callback before being queried or expired
+    MPESA_OUTBOX_SETTLE_AFTER = int(os.getenv('MPESA_OUTBOX_SETTLE_AFTER', 300))
+
+    # Customer segmentation (RFM) thresholds
+    CUSTOMER_VIP_MIN_SPEND = float(os.getenv('CUSTOMER_VIP_MIN_SPEND', 50000))
+    CUSTOMER_VIP_MIN_ORDERS = int(os.getenv('CUSTOMER_VIP_MIN_ORDERS', 5))
+    CUSTOMER_VIP_MAX_RECENCY_DAYS = int(os.getenv('CUSTOMER_VIP_MAX_RECENCY_DAYS', 60))
+    CUSTOMER_REGULAR_MIN_ORDERS = int(os.getenv('CUSTOMER_REGULAR_MIN_ORDERS', 2))
+    CUSTOMER_SEGMENT_CHUNK_SIZE = int(os.getenv('CUSTOMER_SEGMENT_CHUNK_SIZE', 1000))
+
+    # Audit log writer (buffered, written in batches by a background thread)
+    AUDIT_ASYNC_ENABLED = os.getenv('AUDIT_ASYNC_ENABLED', 'true').lower() == 'true'
+    AUDIT_QUEUE_MAX_SIZE = int(os.getenv('AUDIT_QUEUE_MAX_SIZE', 10000))
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 200))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 1.0))
+    AUDIT_OVERFLOW_POLICY = os.getenv('AUDIT_OVERFLOW_POLICY', 'drop_oldest')
+
+    # Audit retention: old rows are archived to gzip JSONL files, then deleted in batches
+    AUDIT_ARCHIVE_FOLDER = os.getenv('AUDIT_ARCHIVE_FOLDER', os.path.join(BASE_DIR, 'archive/audit'))
+    AUDIT_RETENTION_BATCH_SIZE = int(os.getenv('AUDIT_RETENTION_BATCH_SIZE', 5000))
+
+    # ORM-level audit capture: table name -> audited attributes (None = all columns)
+    AUDITED_MODELS = {
+        # Stock movements are already recorded in inventory_transactions
+        'products': ['name', 'category', 'category_id', 'barcode', 'price', 'cost', 'min_stock_level',
+                     'max_stock_level', 'description', 'brand', 'size', 'alcohol_content',
+                     'country_of_origin', 'supplier', 'supplier_id', 'is_active'],
+        # Purchase totals change on every sale and are recomputed by reconciliation
+        'customers': ['name', 'email', 'phone', 'category', 'address', 'date_of_birth', 'is_active'],
+        'system_settings': None,
+        'suppliers': None
+    }
+    AUDIT_IGNORED_COLUMNS = ['created_at', 'updated_at']
+
+    # Notification streaming (SSE). Use 'postgres' (LISTEN/NOTIFY) when running several workers
+    NOTIFICATION_BUS_BACKEND = os.getenv('NOTIFICATION_BUS_BACKEND', 'memory')
+    NOTIFICATION_BUS_CHANNEL = os.getenv('NOTIFICATION_BUS_CHANNEL', 'notifications')
+    NOTIFICATION_STREAM_HEARTBEAT = int(os.getenv('NOTIFICATION_STREAM_HEARTBEAT', 15))
+    # Every open stream holds a worker thread: serve with gthread or gevent workers, not sync ones.
+    # Streams close after this many seconds (or at token expiry) and the browser reconnects
+    NOTIFICATION_STREAM_MAX_AGE = int(os.getenv('NOTIFICATION_STREAM_MAX_AGE', 300))
+    # Open streams allowed per process (0: unlimited); keep it below the worker's thread count
+    NOTIFICATION_STREAM_MAX_CLIENTS = int(os.getenv('NOTIFICATION_STREAM_MAX_CLIENTS', 20))
+
+    # Low stock alerts (evaluated when a transaction that changed stock commits)
+    LOW_STOCK_ALERTS_ENABLED = os.getenv('LOW_STOCK_ALERTS_ENABLED', 'true').lower() == 'true'
+
+    # Settings cache: seconds between checks of the settings version stamp
+    SETTINGS_CACHE_CHECK_INTERVAL = float(os.getenv('SETTINGS_CACHE_CHECK_INTERVAL', 5))
+
+    # Per-category product counts cache lifetime in seconds (0 disables the cache)
+    CATEGORY_COUNTS_CACHE_TTL = float(os.getenv('CATEGORY_COUNTS_CACHE_TTL', 60))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Report customers that look like duplicates and optionally merge them.
+
+Candidates are found with blocking keys (normalized phone, email, name
+Soundex). By default the groups are only printed; pass --merge to merge each
+group into its suggested primary (the oldest record):
+
+  python dedupe_customers.py
+  python dedupe_customers.py --merge --only phone
+"""
+
+import argparse
+
+from app import app
+from extensions import db
+from utils.customer_dedupe import find_duplicate_candidates, merge_customers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find and merge duplicate customers")
+    parser.add_argument("--merge", action="store_true", help="merge each group into its suggested primary")
+    parser.add_argument("--only", choices=["phone", "email", "name"], default=None,
+                        help="only act on groups matched on this key")
+    parser.add_argument("--max-block-size", type=int, default=50, help="skip name blocks larger than this")
+    parser.add_argument("--similarity", type=float, default=0.85, help="minimum name similarity (0-1)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        groups = find_duplicate_candidates(args.max_block_size, args.similarity)
+        if args.only:
+            groups = [group for group in groups if args.only in group["matched_on"]]
+
+        print(f"Found {len(groups)} duplicate groups")
+        for group in groups:
+            print(f"- primary #{group['suggested_primary_id']} matched on {', '.join(group['matched_on'])}")
+            for customer in group["customers"]:
+                print(f"    #{customer['id']} {customer['name']} | {customer['phone']} | {customer['email']}")
+
+            if args.merge:
+                duplicate_ids = [c["id"] for c in group["customers"] if c["id"] != group["suggested_primary_id"]]
+                try:
+                    result = merge_customers(group["suggested_primary_id"], duplicate_ids)
+                    db.session.commit()
+                    print(f"    merged {result['merged_ids']} ({result['sales_reassigned']} sales reassigned)")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"    merge failed: {e}")
+
+
+if __name__ == "__main__":
+    main()
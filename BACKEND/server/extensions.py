@@ -1,9 +1,19 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
+from utils.audit_writer import AuditWriter
+from utils.notification_bus import NotificationBus
+from utils.settings_service import SettingsCache
+from utils.image_pipeline import ImagePipeline
+from utils.mpesa_outbox import MpesaOutboxDispatcher
 
 
 db = SQLAlchemy()
 
 migrate = Migrate()
-jwt = JWTManager()
\ No newline at end of file
+jwt = JWTManager()
+audit_writer = AuditWriter()
+notification_bus = NotificationBus()
+settings_cache = SettingsCache()
+image_pipeline = ImagePipeline()
+mpesa_outbox = MpesaOutboxDispatcher()
\ No newline at end of file
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Generate thumbnail and WebP renditions for product images that lack them.
+
+New uploads are processed in the background automatically; this backfills
+images uploaded before the pipeline existed (or whose rendition failed).
+Requires Pillow.
+
+  python generate_image_renditions.py --workers 4
+"""
+
+import argparse
+
+from app import app
+from extensions import db, image_pipeline
+from models import ProductImage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill product image renditions")
+    parser.add_argument("--all", action="store_true", help="regenerate renditions for every image")
+    parser.add_argument("--workers", type=int, default=None, help="worker threads (default IMAGE_PIPELINE_WORKERS)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.workers:
+            app.config["IMAGE_PIPELINE_WORKERS"] = args.workers
+
+        query = db.session.query(ProductImage.image_id)
+        if not args.all:
+            query = query.filter(db.or_(ProductImage.thumbnail_url.is_(None), ProductImage.webp_url.is_(None)))
+        image_ids = [image_id for (image_id,) in query.order_by(ProductImage.image_id).all()]
+
+    if not image_pipeline.stats()["pillow_available"]:
+        raise SystemExit("Pillow is not installed (pip install pillow)")
+
+    futures = [image_pipeline.submit(image_id) for image_id in image_ids]
+    processed = sum(1 for future in futures if future is not None and future.result())
+    image_pipeline.shutdown()
+
+    print("Renditions complete:")
+    print(f"- images: {len(image_ids)}")
+    print(f"- processed: {processed}")
+    print(f"- failed: {len(image_ids) - processed}")
+
+
+if __name__ == "__main__":
+    main()
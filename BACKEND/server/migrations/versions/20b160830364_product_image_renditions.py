@@ -0,0 +1,28 @@
+"""Product image thumbnail and WebP renditions
+
+Revision ID: 20b160830364
+Revises: 30899235821a
+Create Date: 2026-10-19 21:48:10.273554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20b160830364'
+down_revision = '30899235821a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_images', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('thumbnail_url', sa.String(length=500), nullable=True))
+        batch_op.add_column(sa.Column('webp_url', sa.String(length=500), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('product_images', schema=None) as batch_op:
+        batch_op.drop_column('webp_url')
+        batch_op.drop_column('thumbnail_url')
@@ -0,0 +1,29 @@
+"""Settings version stamp
+
+Revision ID: 2e6ac94502b7
+Revises: e5f7df8dd8ed
+Create Date: 2026-10-19 18:21:05.117630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e6ac94502b7'
+down_revision = 'e5f7df8dd8ed'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    settings_version = op.create_table('settings_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(settings_version, [{'id': 1, 'version': 1}])
+
+
+def downgrade():
+    op.drop_table('settings_version')
@@ -0,0 +1,26 @@
+"""Index products by category and active flag
+
+Revision ID: 30899235821a
+Revises: be71399d71bc
+Create Date: 2026-10-19 21:03:36.482190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '30899235821a'
+down_revision = 'be71399d71bc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.create_index('idx_products_category_active', ['category_id', 'is_active'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index('idx_products_category_active')
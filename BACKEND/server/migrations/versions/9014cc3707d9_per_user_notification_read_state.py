@@ -0,0 +1,47 @@
+"""Per-user notification read state
+
+Revision ID: 9014cc3707d9
+Revises: d8701e050b83
+Create Date: 2026-10-19 14:03:27.551902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9014cc3707d9'
+down_revision = 'd8701e050b83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notification_reads',
+    sa.Column('notification_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('read_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+    sa.ForeignKeyConstraint(['notification_id'], ['notifications.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('notification_id', 'user_id')
+    )
+    op.create_table('user_notification_states',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('unread_count', sa.Integer(), nullable=False),
+    sa.Column('last_read_notification_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.create_index('idx_notifications_user_read', ['user_id', 'is_read'], unique=False)
+
+    # States are created lazily (with a computed count) the first time a user asks
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index('idx_notifications_user_read')
+
+    op.drop_table('user_notification_states')
+    op.drop_table('notification_reads')
@@ -0,0 +1,43 @@
+"""M-Pesa outbox for STK pushes sent after the sale commits
+
+Revision ID: 90b9eac7ac67
+Revises: 9793206392a9
+Create Date: 2026-10-19 23:41:08.227415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '90b9eac7ac67'
+down_revision = '9793206392a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('mpesa_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('mpesa_transaction_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('PENDING', 'SENDING', 'SENT', 'UNKNOWN', 'FAILED', name='mpesaoutboxstatus'), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('available_at', sa.DateTime(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+    sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['mpesa_transaction_id'], ['mpesa_transactions.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('mpesa_outbox', schema=None) as batch_op:
+        batch_op.create_index('idx_mpesa_outbox_status_available', ['status', 'available_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_mpesa_outbox_mpesa_transaction_id'), ['mpesa_transaction_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('mpesa_outbox', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_mpesa_outbox_mpesa_transaction_id'))
+        batch_op.drop_index('idx_mpesa_outbox_status_available')
+
+    op.drop_table('mpesa_outbox')
+    sa.Enum(name='mpesaoutboxstatus').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,87 @@
+"""Link products to suppliers by id
+
+Revision ID: 968fb2476846
+Revises: 2e6ac94502b7
+Create Date: 2026-10-19 19:02:17.540913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '968fb2476846'
+down_revision = '2e6ac94502b7'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+products = sa.table(
+    'products',
+    sa.column('id', sa.Integer),
+    sa.column('supplier', sa.String),
+    sa.column('supplier_id', sa.Integer),
+)
+
+suppliers = sa.table(
+    'suppliers',
+    sa.column('id', sa.Integer),
+    sa.column('name', sa.String),
+)
+
+
+def supplier_match_key(name):
+    return ' '.join(name.split()).lower() if name else None
+
+
+def backfill_supplier_id(connection):
+    """Set supplier_id from the free-text supplier name in id-ordered batches.
+
+    Names are compared ignoring case and extra whitespace; when several
+    suppliers share a name the oldest one wins. Products whose name matches
+    no supplier keep supplier_id NULL.
+    """
+    supplier_ids = {}
+    for row in connection.execute(sa.select(suppliers.c.id, suppliers.c.name).order_by(suppliers.c.id)):
+        supplier_ids.setdefault(supplier_match_key(row.name), row.id)
+
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(products.c.id, products.c.supplier)
+            .where(products.c.id > last_id, products.c.supplier.isnot(None))
+            .order_by(products.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = [
+            {'product_id': row.id, 'matched_supplier_id': supplier_ids[supplier_match_key(row.supplier)]}
+            for row in rows if supplier_match_key(row.supplier) in supplier_ids
+        ]
+        if updates:
+            connection.execute(
+                products.update()
+                .where(products.c.id == sa.bindparam('product_id'))
+                .values(supplier_id=sa.bindparam('matched_supplier_id')),
+                updates
+            )
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('supplier_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_products_supplier_id'), ['supplier_id'], unique=False)
+        batch_op.create_foreign_key('fk_products_supplier_id_suppliers', 'suppliers', ['supplier_id'], ['id'])
+
+    backfill_supplier_id(op.get_bind())
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_products_supplier_id_suppliers', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_products_supplier_id'))
+        batch_op.drop_column('supplier_id')
@@ -0,0 +1,28 @@
+"""Content hash for product images
+
+Revision ID: 9793206392a9
+Revises: 20b160830364
+Create Date: 2026-10-19 22:31:44.918207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9793206392a9'
+down_revision = '20b160830364'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_images', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_product_images_content_hash'), ['content_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product_images', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_images_content_hash'))
+        batch_op.drop_column('content_hash')
@@ -0,0 +1,99 @@
+"""Add normalized customer phone lookup key
+
+Revision ID: d8701e050b83
+Revises: 64647797c939
+Create Date: 2026-10-19 09:12:41.208315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8701e050b83'
+down_revision = '64647797c939'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+customers = sa.table(
+    'customers',
+    sa.column('id', sa.Integer),
+    sa.column('phone', sa.String),
+    sa.column('phone_normalized', sa.String),
+)
+
+
+def normalize_phone_number(phone):
+    """E.164 form (+2547XXXXXXXX) of a stored phone number, or None.
+
+    Frozen copy of utils.daraja_client.normalize_phone_number as it was when
+    this revision was written, so the backfill does not change (or pull in
+    the app) when the application code does.
+    """
+    if not phone:
+        return None
+
+    digits = ''.join(c for c in str(phone) if c.isdigit())
+    if digits.startswith('0') and len(digits) == 10:  # 0712345678
+        return '+254' + digits[1:]
+    if digits.startswith('254') and len(digits) == 12:  # 254712345678 / +254712345678
+        return '+' + digits
+    if len(digits) == 9:  # 712345678
+        return '+254' + digits
+    if len(digits) == 10 and not digits.startswith('0'):
+        return '+254' + digits
+    return None
+
+
+def backfill_phone_normalized(connection):
+    """Populate phone_normalized in id-ordered batches.
+
+    When several customers share a number only the oldest record gets the
+    normalized value, so the unique index can be created; the others keep
+    phone_normalized NULL until they are merged or corrected.
+    """
+    seen = set()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(customers.c.id, customers.c.phone)
+            .where(customers.c.id > last_id, customers.c.phone.isnot(None))
+            .order_by(customers.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for row in rows:
+            normalized = normalize_phone_number(row.phone)
+            if normalized and normalized not in seen:
+                seen.add(normalized)
+                updates.append({'customer_id': row.id, 'normalized': normalized})
+
+        if updates:
+            connection.execute(
+                customers.update()
+                .where(customers.c.id == sa.bindparam('customer_id'))
+                .values(phone_normalized=sa.bindparam('normalized')),
+                updates
+            )
+
+
+def upgrade():
+    with op.batch_alter_table('customers', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('phone_normalized', sa.String(length=16), nullable=True))
+
+    backfill_phone_normalized(op.get_bind())
+
+    with op.batch_alter_table('customers', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_customers_phone_normalized'), ['phone_normalized'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('customers', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_customers_phone_normalized'))
+        batch_op.drop_column('phone_normalized')
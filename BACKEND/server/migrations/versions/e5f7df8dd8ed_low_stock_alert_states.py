@@ -0,0 +1,32 @@
+"""Low stock alert state
+
+Revision ID: e5f7df8dd8ed
+Revises: 9014cc3707d9
+Create Date: 2026-10-19 16:40:12.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f7df8dd8ed'
+down_revision = '9014cc3707d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('low_stock_alert_states',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('level', sa.String(length=10), nullable=False),
+    sa.Column('notification_id', sa.Integer(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+    sa.ForeignKeyConstraint(['notification_id'], ['notifications.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+
+
+def downgrade():
+    op.drop_table('low_stock_alert_states')
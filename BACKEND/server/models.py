@@ -1,4 +1,6 @@
 from extensions import db
+from sqlalchemy.orm import validates
+from utils.daraja_client import normalize_phone_number
 from enum import Enum
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -37,6 +39,13 @@ class ProductStatus(Enum):
     LOW_STOCK = 'Low Stock'
     OUT_OF_STOCK = 'Out of Stock'
 
+class PurchaseOrderStatus(Enum):
+    DRAFT = 'draft'
+    ORDERED = 'ordered'
+    PARTIALLY_RECEIVED = 'partially_received'
+    RECEIVED = 'received'
+    CANCELLED = 'cancelled'
+
 class MpesaTransactionStatus(Enum):
     PENDING = 'pending'
     COMPLETED = 'completed'
@@ -49,6 +58,13 @@ class MpesaTransactionType(Enum):
     B2C = 'b2c'  # Business to Customer
     STK_PUSH = 'stk_push'  # STK Push (Lipa na M-Pesa Online)
 
+class MpesaOutboxStatus(Enum):
+    PENDING = 'pending'  # Waiting for (another attempt by) the dispatcher
+    SENDING = 'sending'  # Claimed by a dispatcher; the request may be in flight
+    SENT = 'sent'  # Accepted by Daraja; the callback settles the transaction
+    UNKNOWN = 'unknown'  # Daraja may have received it; never resent, settled by callback, query or expiry
+    FAILED = 'failed'  # Rejected, or gave up after MPESA_OUTBOX_MAX_ATTEMPTS
+
 # User Model
 class User(db.Model):
     __tablename__ = 'users'
@@ -114,16 +130,23 @@ class Product(db.Model):
     stock = db.Column(db.Integer, default=0, nullable=False)
     min_stock_level = db.Column(db.Integer, default=10, nullable=False)
     max_stock_level = db.Column(db.Integer, default=100, nullable=False)
+    open_po_quantity = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # Ordered on open purchase orders, not yet received
     description = db.Column(db.Text, nullable=True)
     brand = db.Column(db.String(100), nullable=True)
     size = db.Column(db.String(50), nullable=True)  # e.g., "750ml", "1L"
     alcohol_content = db.Column(db.Numeric(5, 2), nullable=True)  # e.g., 40.0 for 40%
     country_of_origin = db.Column(db.String(100), nullable=True)
-    supplier = db.Column(db.String(100), nullable=True)
+    supplier = db.Column(db.String(100), nullable=True)  # Supplier name, kept in sync with supplier_id
+    supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id'), nullable=True, index=True)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.current_timestamp(), nullable=False)
     updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
     
+    # Covers the grouped per-category product counts
+    __table_args__ = (
+        db.Index('idx_products_category_active', 'category_id', 'is_active'),
+    )
+    
     # Relationships - backrefs defined in related models to avoid conflicts
     
     @property
@@ -153,6 +176,9 @@ class ProductImage(db.Model):
     image_id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
     image_url = db.Column(db.String(500), nullable=False)
+    thumbnail_url = db.Column(db.String(500), nullable=True)  # Square WebP thumbnail, set by the image pipeline
+    webp_url = db.Column(db.String(500), nullable=True)  # Size-bounded WebP rendition of the original
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 of the file; rows sharing it share the file
     is_primary = db.Column(db.Boolean, default=False, nullable=False)
     alt_text = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), nullable=False)
@@ -171,6 +197,7 @@ class Customer(db.Model):
     name = db.Column(db.String(100), nullable=False, index=True)
     email = db.Column(db.String(120), unique=True, nullable=True, index=True)
     phone = db.Column(db.String(20), nullable=True, index=True)
+    phone_normalized = db.Column(db.String(16), unique=True, nullable=True, index=True)  # E.164, e.g. +254712345678
     category = db.Column(db.Enum(CustomerCategory), default=CustomerCategory.NEW, nullable=False)
     total_purchases = db.Column(db.Numeric(12, 2), default=0, nullable=False)
     last_purchase_date = db.Column(db.DateTime(timezone=True), nullable=True)
@@ -183,6 +210,12 @@ class Customer(db.Model):
     # Relationships
     sales = db.relationship('Sale', backref='customer', lazy=True)
     
+    @validates('phone')
+    def validate_phone(self, key, phone):
+        """Keep the normalized lookup key in sync with the display phone"""
+        self.phone_normalized = normalize_phone_number(phone)
+        return phone
+    
     def __repr__(self):
         return f'<Customer {self.name}>'
 
@@ -275,9 +308,51 @@ class Notification(db.Model):
     action_url = db.Column(db.String(500), nullable=True)  # URL for action button
     created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), nullable=False)
     
+    # is_read is only meaningful for user-targeted notifications; read state of
+    # system-wide notifications is kept per user in notification_reads
+    __table_args__ = (
+        db.Index('idx_notifications_user_read', 'user_id', 'is_read'),
+    )
+    
     def __repr__(self):
         return f'<Notification {self.id}>'
 
+# Per-user read receipt for system-wide notifications
+class NotificationRead(db.Model):
+    __tablename__ = 'notification_reads'
+    
+    notification_id = db.Column(db.Integer, db.ForeignKey('notifications.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    read_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), nullable=False)
+    
+    def __repr__(self):
+        return f'<NotificationRead {self.notification_id}:{self.user_id}>'
+
+# Maintained unread counter and read watermark per user
+class UserNotificationState(db.Model):
+    __tablename__ = 'user_notification_states'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    # Every notification with id <= watermark counts as read ("mark all read")
+    last_read_notification_id = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+    
+    def __repr__(self):
+        return f'<UserNotificationState {self.user_id}>'
+
+# Last alerted stock level per product, used to send one low-stock alert per crossing
+class LowStockAlertState(db.Model):
+    __tablename__ = 'low_stock_alert_states'
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    level = db.Column(db.String(10), default='ok', nullable=False)  # ok, low, out
+    notification_id = db.Column(db.Integer, db.ForeignKey('notifications.id', ondelete='SET NULL'), nullable=True)
+    updated_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+    
+    def __repr__(self):
+        return f'<LowStockAlertState {self.product_id} {self.level}>'
+
 # System Settings Model
 class SystemSettings(db.Model):
     __tablename__ = 'system_settings'
@@ -293,6 +368,17 @@ class SystemSettings(db.Model):
     def __repr__(self):
         return f'<SystemSettings {self.key}>'
 
+# Single-row counter bumped on every settings change so each worker can tell
+# when its settings cache is stale
+class SettingsVersion(db.Model):
+    __tablename__ = 'settings_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=1, nullable=False)
+    
+    def __repr__(self):
+        return f'<SettingsVersion {self.version}>'
+
 # Supplier Model
 class Supplier(db.Model):
     __tablename__ = 'suppliers'
@@ -308,9 +394,66 @@ class Supplier(db.Model):
     created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.current_timestamp(), nullable=False)
     updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
     
+    # Relationships
+    products = db.relationship('Product', backref='supplier_obj', lazy=True)
+    
     def __repr__(self):
         return f'<Supplier {self.name}>'
 
+# Purchase Order Model
+class PurchaseOrder(db.Model):
+    __tablename__ = 'purchase_orders'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_number = db.Column(db.String(50), unique=True, nullable=True, index=True)
+    supplier_id = db.Column(db.Integer, db.ForeignKey('suppliers.id', ondelete='RESTRICT'), nullable=False)
+    status = db.Column(db.Enum(PurchaseOrderStatus), default=PurchaseOrderStatus.DRAFT, nullable=False)
+    total_cost = db.Column(db.Numeric(12, 2), default=0, nullable=False)
+    expected_date = db.Column(db.Date, nullable=True)
+    notes = db.Column(db.Text, nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    ordered_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    received_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.current_timestamp(), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+    
+    __table_args__ = (
+        db.Index('idx_purchase_orders_supplier_status', 'supplier_id', 'status'),
+    )
+    
+    # Relationships
+    supplier = db.relationship('Supplier', backref='purchase_orders')
+    created_by_user = db.relationship('User', backref='purchase_orders', lazy=True)
+    lines = db.relationship('PurchaseOrderLine', backref='purchase_order', lazy=True, cascade='all, delete-orphan')
+    
+    def __repr__(self):
+        return f'<PurchaseOrder {self.order_number}>'
+
+# Purchase Order Line Model
+class PurchaseOrderLine(db.Model):
+    __tablename__ = 'purchase_order_lines'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    purchase_order_id = db.Column(db.Integer, db.ForeignKey('purchase_orders.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='RESTRICT'), nullable=False, index=True)
+    quantity_ordered = db.Column(db.Integer, nullable=False)
+    quantity_received = db.Column(db.Integer, default=0, nullable=False)
+    unit_cost = db.Column(db.Numeric(10, 2), nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('purchase_order_id', 'product_id', name='uq_purchase_order_lines_order_product'),
+    )
+    
+    # Relationships
+    product = db.relationship('Product', backref='purchase_order_lines')
+    
+    @property
+    def quantity_outstanding(self):
+        return max(self.quantity_ordered - self.quantity_received, 0)
+    
+    def __repr__(self):
+        return f'<PurchaseOrderLine {self.id}>'
+
 # Audit Log Model
 class AuditLog(db.Model):
     __tablename__ = 'audit_logs'
@@ -398,6 +541,29 @@ class MpesaTransaction(db.Model):
             'user_id': self.user_id
         }
 
+# M-Pesa Outbox Model (STK pushes committed with their sale, sent by a background dispatcher)
+class MpesaOutbox(db.Model):
+    __tablename__ = 'mpesa_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    mpesa_transaction_id = db.Column(db.Integer, db.ForeignKey('mpesa_transactions.id', ondelete='CASCADE'), nullable=False, index=True)
+    status = db.Column(db.Enum(MpesaOutboxStatus), default=MpesaOutboxStatus.PENDING, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    available_at = db.Column(db.DateTime(timezone=True), server_default=db.func.current_timestamp(), nullable=False)  # Not picked up before this (retry backoff, send lease, settle time)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.current_timestamp(), nullable=False)
+    processed_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        db.Index('idx_mpesa_outbox_status_available', 'status', 'available_at'),
+    )
+    
+    # Relationships
+    mpesa_transaction = db.relationship('MpesaTransaction', backref=db.backref('outbox_entries', lazy=True, passive_deletes=True))
+    
+    def __repr__(self):
+        return f'<MpesaOutbox {self.id}>'
+
 # M-Pesa C2B Transaction Model (for direct payments to paybill/till)
 class MpesaC2BTransaction(db.Model):
     __tablename__ = 'mpesa_c2b_transactions'
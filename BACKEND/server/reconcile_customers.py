@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Recompute Customer.total_purchases and last_purchase_date from sales.
+
+Sales whose M-Pesa payment failed, was cancelled or expired are not counted.
+Runs a dry run by default and prints the drift; pass --apply to write the
+corrected values. Intended to be scheduled (e.g. nightly cron):
+
+  python reconcile_customers.py --apply
+"""
+
+import argparse
+
+from app import app
+from utils.customer_stats import reconcile_customer_totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile customer purchase totals with sales")
+    parser.add_argument("--apply", action="store_true", help="write changes (default is a dry run)")
+    parser.add_argument("--sample", type=int, default=20, help="number of drifted customers to print")
+    args = parser.parse_args()
+
+    with app.app_context():
+        result = reconcile_customer_totals(dry_run=not args.apply, sample_size=args.sample)
+
+    print("Reconciliation complete:" if args.apply else "Reconciliation dry run:")
+    print(f"- customers_drifted: {result['customers_drifted']}")
+    print(f"- customers_with_amount_drift: {result['customers_with_amount_drift']}")
+    print(f"- customers_with_date_drift_only: {result['customers_with_date_drift_only']}")
+    print(f"- total_amount_drift: {result['total_amount_drift']:.2f}")
+    print(f"- customers_updated: {result['customers_updated']}")
+    for drift in result["drift"]:
+        print(
+            f"  #{drift['customer_id']} {drift['name']}: {drift['stored_total']:.2f} -> {drift['expected_total']:.2f}"
+            f" (last purchase {drift['stored_last_purchase_date']} -> {drift['expected_last_purchase_date']})"
+        )
+
+
+if __name__ == "__main__":
+    main()
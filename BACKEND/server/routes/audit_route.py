@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from extensions import db
+from extensions import db, audit_writer
 from models import AuditLog, User
+from utils.audit_retention import MAX_PURGE_BATCH_SIZE, purge_audit_logs, read_archive_index, search_audit_archive
 from datetime import datetime, timedelta
 
 audit_bp = Blueprint('audit', __name__)
@@ -14,23 +15,17 @@ def get_current_user():
     return current_identity
 
 def log_audit_event(user_id, action, table_name=None, record_id=None, old_values=None, new_values=None, ip_address=None, user_agent=None):
-    """Helper function to log audit events"""
-    try:
-        audit_log = AuditLog(
-            user_id=user_id,
-            action=action,
-            table_name=table_name,
-            record_id=record_id,
-            old_values=old_values,
-            new_values=new_values,
-            ip_address=ip_address,
-            user_agent=user_agent
-        )
-        db.session.add(audit_log)
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        print(f"Failed to log audit event: {str(e)}")
+    """Queue an audit event; it is written in a batch by the background audit writer"""
+    audit_writer.enqueue(
+        user_id=user_id,
+        action=action,
+        table_name=table_name,
+        record_id=record_id,
+        old_values=old_values,
+        new_values=new_values,
+        ip_address=ip_address,
+        user_agent=user_agent
+    )
 
 @audit_bp.route('/audit/logs', methods=['GET'])
 @jwt_required()
@@ -239,7 +234,8 @@ def get_audit_stats():
             'action_distribution': action_data,
             'table_distribution': table_data,
             'most_active_users': user_data,
-            'recent_activity': recent_data
+            'recent_activity': recent_data,
+            'writer': audit_writer.stats()
         }), 200
         
     except Exception as e:
@@ -321,25 +317,118 @@ def cleanup_audit_logs():
         days = data.get('days', 90)
         cutoff_date = datetime.now() - timedelta(days=days)
         
-        # Delete old logs
-        deleted_count = AuditLog.query.filter(
-            AuditLog.created_at < cutoff_date
-        ).delete()
-        
-        db.session.commit()
+        batch_size = data.get('batch_size')
+        if batch_size is not None:
+            try:
+                if isinstance(batch_size, bool):
+                    raise ValueError
+                batch_size = int(batch_size)
+            except (TypeError, ValueError):
+                batch_size = 0
+            if not 1 <= batch_size <= MAX_PURGE_BATCH_SIZE:
+                return jsonify({'error': f'batch_size must be a whole number from 1 to {MAX_PURGE_BATCH_SIZE}'}), 400
+        
+        # Archive (unless disabled) and delete old logs in bounded batches
+        result = purge_audit_logs(
+            cutoff_date,
+            archive=data.get('archive', True),
+            batch_size=batch_size
+        )
+        deleted_count = result['deleted_count']
         
         # Log the cleanup action
         log_audit_event(
             user_id=current_user_id,
             action='CLEANUP_AUDIT_LOGS',
             table_name='audit_logs',
-            new_values={'deleted_count': deleted_count, 'cutoff_date': cutoff_date.isoformat()}
+            new_values={'deleted_count': deleted_count, 'cutoff_date': cutoff_date.isoformat(), 'archive_files': result['archive_files']}
         )
         
         return jsonify({
-            'message': f'Cleaned up {deleted_count} audit logs older than {days} days'
+            'message': f'Cleaned up {deleted_count} audit logs older than {days} days',
+            'deleted_count': deleted_count,
+            'batches': result['batches'],
+            'archived': result['archived'],
+            'archive_files': result['archive_files']
         }), 200
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+
+@audit_bp.route('/audit/archive', methods=['GET'])
+@jwt_required()
+def get_audit_archive_index():
+    """List archived audit log batches (admin only)"""
+    try:
+        # Check if user has permission (admin only)
+        current_user_id = get_current_user()
+        
+        entries = read_archive_index()
+        
+        files = {}
+        for entry in entries:
+            summary = files.setdefault(entry['file'], {
+                'file': entry['file'],
+                'month': entry['month'],
+                'count': 0,
+                'min_created_at': entry['min_created_at'],
+                'max_created_at': entry['max_created_at']
+            })
+            summary['count'] += entry['count']
+            summary['min_created_at'] = min(summary['min_created_at'], entry['min_created_at'])
+            summary['max_created_at'] = max(summary['max_created_at'], entry['max_created_at'])
+        
+        return jsonify({
+            'files': sorted(files.values(), key=lambda f: f['month']),
+            'total_archived': sum(entry['count'] for entry in entries)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@audit_bp.route('/audit/archive/search', methods=['GET'])
+@jwt_required()
+def search_archived_audit_logs():
+    """Search audit logs that were archived by the cleanup (admin only)"""
+    try:
+        # Check if user has permission (admin only)
+        current_user_id = get_current_user()
+        
+        # Get query parameters
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        user_id = request.args.get('user_id', type=int)
+        record_id = request.args.get('record_id', type=int)
+        action = request.args.get('action', '')
+        table_name = request.args.get('table_name', '')
+        start_date = request.args.get('start_date', '')
+        end_date = request.args.get('end_date', '')
+        
+        start_date_obj = None
+        end_date_obj = None
+        if start_date:
+            try:
+                start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'error': 'Invalid start_date format. Use YYYY-MM-DD'}), 400
+        
+        if end_date:
+            try:
+                end_date_obj = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+            except ValueError:
+                return jsonify({'error': 'Invalid end_date format. Use YYYY-MM-DD'}), 400
+        
+        result = search_audit_archive(
+            start_date=start_date_obj,
+            end_date=end_date_obj,
+            user_id=user_id,
+            action=action,
+            table_name=table_name,
+            record_id=record_id,
+            limit=limit
+        )
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from extensions import db
-from models import Category
+from models import Category, Product
+from utils.category_counts import get_category_product_counts
 from datetime import datetime
 
 categories_bp = Blueprint('categories', __name__)
@@ -48,15 +49,20 @@ def get_categories():
             error_out=False
         )
         
+        # Product counts come from one cached grouped query instead of loading products
+        product_counts = get_category_product_counts([category.id for category in pagination.items])
+        
         categories = []
         for category in pagination.items:
+            counts = product_counts.get(category.id, {'total': 0, 'active': 0})
             categories.append({
                 'id': category.id,
                 'name': category.name,
                 'description': category.description,
                 'image_url': category.image_url,
                 'is_active': category.is_active,
-                'product_count': len(category.products) if category.products else 0,
+                'product_count': counts['total'],
+                'active_product_count': counts['active'],
                 'created_at': category.created_at.isoformat() if category.created_at else None,
                 'updated_at': category.updated_at.isoformat() if category.updated_at else None
             })
@@ -219,7 +225,7 @@ def delete_category(category_id):
         category = Category.query.get_or_404(category_id)
         
         # Check if category has products
-        if category.products:
+        if db.session.query(Product.query.filter(Product.category_id == category.id).exists()).scalar():
             return jsonify({
                 'error': 'Cannot delete category with existing products. Please reassign or delete products first.'
             }), 400
@@ -278,27 +284,24 @@ def get_category_stats():
         active_categories = Category.query.filter(Category.is_active == True).count()
         inactive_categories = total_categories - active_categories
         
+        product_counts = get_category_product_counts()
+        
         # Categories with products
-        categories_with_products = db.session.query(Category).join(Category.products).distinct().count()
+        categories_with_products = sum(1 for counts in product_counts.values() if counts['total'] > 0)
         
         # Top categories by product count
-        top_categories = db.session.query(
-            Category.id,
-            Category.name,
-            db.func.count(Category.products).label('product_count')
-        ).outerjoin(Category.products).group_by(
-            Category.id, Category.name
-        ).order_by(
-            db.func.count(Category.products).desc()
-        ).limit(5).all()
-        
-        top_categories_data = [
-            {
-                'id': cat.id,
-                'name': cat.name,
-                'product_count': cat.product_count
-            } for cat in top_categories
-        ]
+        categories = db.session.query(Category.id, Category.name).all()
+        top_categories = sorted(
+            (
+                {
+                    'id': cat.id,
+                    'name': cat.name,
+                    'product_count': product_counts.get(cat.id, {'total': 0})['total'],
+                    'active_product_count': product_counts.get(cat.id, {'active': 0})['active']
+                } for cat in categories
+            ),
+            key=lambda cat: (-cat['product_count'], cat['id'])
+        )[:5]
         
         return jsonify({
             'total_categories': total_categories,
@@ -306,7 +309,7 @@ def get_category_stats():
             'inactive_categories': inactive_categories,
             'categories_with_products': categories_with_products,
             'categories_without_products': total_categories - categories_with_products,
-            'top_categories': top_categories_data
+            'top_categories': top_categories
         }), 200
         
     except Exception as e:
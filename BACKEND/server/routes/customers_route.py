@@ -1,12 +1,21 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from extensions import db
-from models import Customer, Sale, CustomerCategory
+from models import Customer, Sale, SaleItem, CustomerCategory
+from utils.daraja_client import normalize_phone_number
+from utils.customer_segmentation import segment_customers
+from utils.customer_dedupe import find_duplicate_candidates, merge_customers
+from utils.customer_stats import reconcile_customer_totals
 from decimal import Decimal
 from datetime import datetime, date
+import base64
 
 customers_bp = Blueprint('customers', __name__)
 
+# Number of most recent sales embedded in GET /customers/<id>
+RECENT_SALES_LIMIT = 10
+MAX_HISTORY_PAGE_SIZE = 100
+
 def get_current_user():
     """Helper function to get current user from JWT"""
     current_identity = get_jwt_identity()
@@ -31,11 +40,16 @@ def get_customers():
         
         # Add search filter
         if search:
-            query = query.filter(
+            search_filter = (
                 Customer.name.contains(search) | 
                 Customer.email.contains(search) |
                 Customer.phone.contains(search)
             )
+            # Also match phone numbers typed in any format
+            normalized_phone = normalize_phone_number(search) if any(c.isdigit() for c in search) else None
+            if normalized_phone:
+                search_filter = search_filter | (Customer.phone_normalized == normalized_phone)
+            query = query.filter(search_filter)
         
         # Add category filter
         if category:
@@ -96,6 +110,70 @@ def get_customers():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def get_items_counts(sale_ids):
+    """Return {sale_id: items_count} for the given sales using one grouped query"""
+    if not sale_ids:
+        return {}
+    rows = db.session.query(
+        SaleItem.sale_id,
+        db.func.count(SaleItem.id)
+    ).filter(SaleItem.sale_id.in_(sale_ids)).group_by(SaleItem.sale_id).all()
+    return {sale_id: count for sale_id, count in rows}
+
+def serialize_sale_summary(sale, items_counts):
+    """Compact sale representation used by customer purchase history"""
+    return {
+        'id': sale.id,
+        'total_amount': float(sale.total_amount),
+        'payment_method': sale.payment_method.value if sale.payment_method else None,
+        'sale_date': sale.sale_date.isoformat(),
+        'receipt_number': sale.receipt_number,
+        'items_count': items_counts.get(sale.id, 0)
+    }
+
+def encode_history_cursor(sale):
+    """Opaque keyset cursor pointing just past the given sale"""
+    raw = f"{sale.sale_date.isoformat()}|{sale.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(cursor):
+    """Decode a cursor produced by encode_history_cursor into (sale_date, sale_id)"""
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    sale_date, sale_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(sale_date), int(sale_id)
+
+@customers_bp.route('/customers/lookup', methods=['GET'])
+@jwt_required()
+def lookup_customer():
+    """Find a customer by phone number typed in any format (07..., +2547..., 2547...)"""
+    try:
+        phone = request.args.get('phone', '')
+        if not phone:
+            return jsonify({'error': 'phone is required'}), 400
+        
+        normalized_phone = normalize_phone_number(phone)
+        if not normalized_phone:
+            return jsonify({'error': 'Invalid phone number format'}), 400
+        
+        # Single probe on the unique phone_normalized index
+        customer = Customer.query.filter_by(phone_normalized=normalized_phone).first()
+        if not customer:
+            return jsonify({'error': 'Customer not found'}), 404
+        
+        return jsonify({
+            'id': customer.id,
+            'name': customer.name,
+            'email': customer.email,
+            'phone': customer.phone,
+            'category': customer.category.value if customer.category else None,
+            'total_purchases': float(customer.total_purchases),
+            'last_purchase_date': customer.last_purchase_date.isoformat() if customer.last_purchase_date else None,
+            'is_active': customer.is_active
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @customers_bp.route('/customers/<int:customer_id>', methods=['GET'])
 @jwt_required()
 def get_customer(customer_id):
@@ -103,18 +181,25 @@ def get_customer(customer_id):
     try:
         customer = Customer.query.get_or_404(customer_id)
         
-        # Get customer's sales history
-        sales_data = []
-        if customer.sales:
-            for sale in customer.sales:
-                sales_data.append({
-                    'id': sale.id,
-                    'total_amount': float(sale.total_amount),
-                    'payment_method': sale.payment_method.value if sale.payment_method else None,
-                    'sale_date': sale.sale_date.isoformat(),
-                    'receipt_number': sale.receipt_number,
-                    'items_count': len(sale.items) if sale.items else 0
-                })
+        # Lifetime statistics computed in the database
+        lifetime = db.session.query(
+            db.func.count(Sale.id).label('total_sales'),
+            db.func.coalesce(db.func.sum(Sale.total_amount), 0).label('total_amount'),
+            db.func.avg(Sale.total_amount).label('average_sale'),
+            db.func.min(Sale.sale_date).label('first_sale_date'),
+            db.func.max(Sale.sale_date).label('last_sale_date')
+        ).filter(Sale.customer_id == customer_id).one()
+        
+        # Only the most recent sales are embedded; the full history is served
+        # by GET /customers/<id>/sales/history
+        recent_sales = Sale.query.filter(
+            Sale.customer_id == customer_id
+        ).order_by(
+            Sale.sale_date.desc(), Sale.id.desc()
+        ).limit(RECENT_SALES_LIMIT).all()
+        
+        items_counts = get_items_counts([sale.id for sale in recent_sales])
+        sales_data = [serialize_sale_summary(sale, items_counts) for sale in recent_sales]
         
         return jsonify({
             'id': customer.id,
@@ -130,8 +215,58 @@ def get_customer(customer_id):
             'created_at': customer.created_at.isoformat() if customer.created_at else None,
             'updated_at': customer.updated_at.isoformat() if customer.updated_at else None,
             'sales_history': sales_data,
-            'total_sales': len(sales_data),
-            'average_sale': float(customer.total_purchases / len(sales_data)) if sales_data else 0
+            'sales_history_truncated': lifetime.total_sales > len(sales_data),
+            'next_cursor': encode_history_cursor(recent_sales[-1]) if lifetime.total_sales > len(sales_data) else None,
+            'total_sales': lifetime.total_sales,
+            'lifetime_sales_amount': float(lifetime.total_amount),
+            'average_sale': float(lifetime.average_sale) if lifetime.average_sale is not None else 0,
+            'first_sale_date': lifetime.first_sale_date.isoformat() if lifetime.first_sale_date else None,
+            'last_sale_date': lifetime.last_sale_date.isoformat() if lifetime.last_sale_date else None
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@customers_bp.route('/customers/<int:customer_id>/sales/history', methods=['GET'])
+@jwt_required()
+def get_customer_sales_history(customer_id):
+    """Get a customer's full purchase history using keyset (cursor) pagination"""
+    try:
+        customer = Customer.query.get_or_404(customer_id)
+        
+        limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_HISTORY_PAGE_SIZE)
+        cursor = request.args.get('cursor', '')
+        
+        # Walks idx_sales_customer_date newest first
+        query = Sale.query.filter(Sale.customer_id == customer_id)
+        
+        if cursor:
+            try:
+                cursor_date, cursor_id = decode_history_cursor(cursor)
+            except (ValueError, UnicodeDecodeError):
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query = query.filter(
+                db.or_(
+                    Sale.sale_date < cursor_date,
+                    db.and_(Sale.sale_date == cursor_date, Sale.id < cursor_id)
+                )
+            )
+        
+        # Fetch one extra row to know whether another page exists
+        sales = query.order_by(Sale.sale_date.desc(), Sale.id.desc()).limit(limit + 1).all()
+        has_more = len(sales) > limit
+        sales = sales[:limit]
+        
+        items_counts = get_items_counts([sale.id for sale in sales])
+        
+        return jsonify({
+            'customer': {
+                'id': customer.id,
+                'name': customer.name
+            },
+            'sales': [serialize_sale_summary(sale, items_counts) for sale in sales],
+            'next_cursor': encode_history_cursor(sales[-1]) if has_more else None,
+            'has_more': has_more
         }), 200
         
     except Exception as e:
@@ -159,6 +294,12 @@ def create_customer():
             if existing_customer:
                 return jsonify({'error': 'Customer with this email already exists'}), 400
         
+        # Check if phone number already exists (if provided)
+        if data.get('phone'):
+            normalized_phone = normalize_phone_number(data['phone'])
+            if normalized_phone and Customer.query.filter_by(phone_normalized=normalized_phone).first():
+                return jsonify({'error': 'Customer with this phone number already exists'}), 400
+        
         # Parse date of birth if provided
         date_of_birth = None
         if data.get('date_of_birth'):
@@ -227,6 +368,14 @@ def update_customer(customer_id):
             customer.email = data['email']
         
         if 'phone' in data:
+            normalized_phone = normalize_phone_number(data['phone'])
+            if normalized_phone:
+                existing_customer = Customer.query.filter(
+                    Customer.phone_normalized == normalized_phone,
+                    Customer.id != customer_id
+                ).first()
+                if existing_customer:
+                    return jsonify({'error': 'Customer with this phone number already exists'}), 400
             customer.phone = data['phone']
         
         if 'category' in data:
@@ -434,6 +583,111 @@ def get_customer_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@customers_bp.route('/customers/segmentation', methods=['POST'])
+@jwt_required()
+def run_customer_segmentation():
+    """Recompute customer categories from RFM values (admin/manager only)"""
+    try:
+        # Check if user has permission (admin/manager only)
+        current_user_id = get_current_user()
+        
+        data = request.get_json(silent=True) or {}
+        
+        # Default to a dry run so the diff can be reviewed before applying
+        dry_run = data.get('dry_run', True)
+        
+        result = segment_customers(dry_run=dry_run)
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@customers_bp.route('/customers/reconcile', methods=['POST'])
+@jwt_required()
+def reconcile_customers():
+    """Recompute customer purchase totals from sales and report drift (admin only)"""
+    try:
+        # Check if user has permission (admin only)
+        current_user_id = get_current_user()
+        
+        data = request.get_json(silent=True) or {}
+        
+        # Default to a dry run so the drift can be reviewed before applying
+        dry_run = data.get('dry_run', True)
+        
+        result = reconcile_customer_totals(dry_run=dry_run)
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@customers_bp.route('/customers/duplicates', methods=['GET'])
+@jwt_required()
+def get_duplicate_customers():
+    """Get groups of customers that look like duplicates (admin/manager only)"""
+    try:
+        # Check if user has permission (admin/manager only)
+        current_user_id = get_current_user()
+        
+        limit = request.args.get('limit', 100, type=int)
+        
+        candidates = find_duplicate_candidates()
+        
+        return jsonify({
+            'total_groups': len(candidates),
+            'groups': candidates[:limit]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@customers_bp.route('/customers/merge', methods=['POST'])
+@jwt_required()
+def merge_duplicate_customers():
+    """Merge duplicate customers into a primary customer (admin/manager only)"""
+    try:
+        # Check if user has permission (admin/manager only)
+        current_user_id = get_current_user()
+        
+        data = request.get_json()
+        
+        if not data or not data.get('primary_id') or not data.get('duplicate_ids'):
+            return jsonify({'error': 'primary_id and duplicate_ids are required'}), 400
+        
+        if not isinstance(data['duplicate_ids'], list):
+            return jsonify({'error': 'duplicate_ids must be a list'}), 400
+        
+        try:
+            result = merge_customers(int(data['primary_id']), [int(i) for i in data['duplicate_ids']])
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        
+        db.session.commit()
+        
+        primary = Customer.query.get(result['primary_id'])
+        result['customer'] = {
+            'id': primary.id,
+            'name': primary.name,
+            'email': primary.email,
+            'phone': primary.phone,
+            'total_purchases': float(primary.total_purchases),
+            'last_purchase_date': primary.last_purchase_date.isoformat() if primary.last_purchase_date else None
+        }
+        
+        return jsonify({
+            'message': 'Customers merged successfully',
+            'merge': result
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @customers_bp.route('/customers/<int:customer_id>/activate', methods=['PUT'])
 @jwt_required()
 def activate_customer(customer_id):
@@ -1,8 +1,12 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from extensions import db
+from extensions import db, notification_bus, mpesa_outbox
 from models import MpesaTransaction, MpesaC2BTransaction, Sale, MpesaTransactionStatus, MpesaTransactionType
-from utils.daraja_client import initiate_stk_push, simulate_c2b_payment, query_transaction_status, register_c2b_urls
+from utils.daraja_client import (
+    initiate_stk_push, simulate_c2b_payment, query_transaction_status, register_c2b_urls,
+    http_stats, access_token_cache
+)
+from utils.mpesa_outbox import mpesa_status_payload, match_unknown_stk_push
 from decimal import Decimal
 from datetime import datetime
 import logging
@@ -128,6 +132,10 @@ def stk_push_callback():
             checkout_request_id=checkout_request_id
         ).first()
         
+        # A push whose reply never arrived has no CheckoutRequestID on record yet
+        if not transaction:
+            transaction = match_unknown_stk_push(stk_callback)
+        
         if not transaction:
             logger.error(f"Transaction not found for CheckoutRequestID: {checkout_request_id}")
             return jsonify({'ResultCode': 1, 'ResultDesc': 'Transaction not found'}), 404
@@ -158,6 +166,10 @@ def stk_push_callback():
             transaction.status = MpesaTransactionStatus.FAILED
             logger.info(f"STK Push payment failed: {result_desc}")
         
+        # Tells the till waiting on this sale without it having to poll
+        notification_bus.publish_after_commit(
+            db.session, 'mpesa_status', mpesa_status_payload(transaction), user_id=transaction.user_id
+        )
         db.session.commit()
         
         return jsonify({'ResultCode': 0, 'ResultDesc': 'Success'}), 200
@@ -433,3 +445,21 @@ def register_urls():
     except Exception as e:
         logger.error(f"Error registering C2B URLs: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
+
+@mpesa_bp.route('/mpesa/metrics', methods=['GET'])
+@jwt_required()
+def get_mpesa_metrics():
+    """
+    Daraja client metrics for this worker: requests, retries, latency,
+    connection reuse, access token cache and STK push outbox state (admin only)
+    """
+    try:
+        return jsonify({
+            'http': http_stats(),
+            'access_token': access_token_cache.stats(),
+            'outbox': mpesa_outbox.stats()
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error fetching M-Pesa metrics: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
@@ -1,8 +1,15 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from extensions import db
-from models import Notification, User, NotificationType
+from flask import Blueprint, request, jsonify, Response, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from extensions import db, notification_bus
+from models import Notification, User, NotificationType, UserRole
+from utils.notification_state import (
+    visible_to, unread_filter, get_state, get_unread_count, get_read_ids,
+    record_notification_created, record_notifications_created_for, record_notification_deleted,
+    mark_read, mark_all_read
+)
 from datetime import datetime
+import json
+import time
 
 notifications_bp = Blueprint('notifications', __name__)
 
@@ -10,8 +17,89 @@ def get_current_user():
     """Helper function to get current user from JWT"""
     current_identity = get_jwt_identity()
     if isinstance(current_identity, dict):
-        return current_identity.get('id')
-    return current_identity
+        current_identity = current_identity.get('id')
+    # Identities may be encoded as strings; read state is keyed by integer user id
+    return int(current_identity) if current_identity is not None else None
+
+def notification_event_payload(notification):
+    """Notification as pushed to the SSE stream"""
+    return {
+        'id': notification.id,
+        'user_id': notification.user_id,
+        'title': notification.title,
+        'message': notification.message,
+        'notification_type': notification.notification_type.value if notification.notification_type else None,
+        'action_url': notification.action_url,
+        'created_at': notification.created_at.isoformat() if notification.created_at else None
+    }
+
+def format_sse(event_name, data):
+    """Encode one Server-Sent Event"""
+    return f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+
+@notifications_bp.route('/notifications/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_notifications():
+    """
+    Server-Sent Events stream of new notifications and unread-count changes.
+
+    EventSource cannot send headers, so the access token may also be passed
+    as ?jwt=<token>. The unread count is sent once on connect; afterwards the
+    stream only wakes up for published events or heartbeats, so an idle
+    client costs no database queries.
+
+    Each open stream holds a worker thread, so serve the app with threaded
+    or async workers (e.g. gunicorn --worker-class gthread --threads 32, or
+    gevent), never plain sync workers. A stream ends after
+    NOTIFICATION_STREAM_MAX_AGE seconds or when its token expires, whichever
+    is first, and EventSource reconnects (re-checking the token) after the
+    retry delay. Past NOTIFICATION_STREAM_MAX_CLIENTS open streams in a
+    process new ones get 503.
+    """
+    try:
+        current_user_id = get_current_user()
+        config = current_app.config
+        heartbeat = config['NOTIFICATION_STREAM_HEARTBEAT']
+        
+        max_clients = config['NOTIFICATION_STREAM_MAX_CLIENTS']
+        if max_clients and notification_bus.stats()['subscribers'] >= max_clients:
+            return jsonify({'error': 'Too many open notification streams, retry later'}), 503, {'Retry-After': '30'}
+        
+        # The stream must not outlive the token it was opened with
+        closes_at = time.time() + config['NOTIFICATION_STREAM_MAX_AGE']
+        token_expires = get_jwt().get('exp')
+        if token_expires:
+            closes_at = min(closes_at, token_expires)
+        
+        unread_count = get_unread_count(current_user_id)
+        db.session.commit()
+        
+        # Release the DB connection before the long-lived stream starts
+        db.session.close()
+        
+        subscription = notification_bus.subscribe(current_user_id)
+        
+        def generate():
+            with subscription:
+                yield f"retry: 5000\n\n"
+                yield format_sse('unread_count', {'unread_count': unread_count})
+                while True:
+                    remaining = closes_at - time.time()
+                    if remaining <= 0:
+                        return
+                    message = subscription.get(timeout=min(heartbeat, remaining))
+                    if message is None:
+                        yield ": keepalive\n\n"
+                        continue
+                    yield format_sse(message['event'], message['data'])
+        
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @notifications_bp.route('/notifications', methods=['GET'])
 @jwt_required()
@@ -27,16 +115,12 @@ def get_notifications():
         notification_type = request.args.get('type', '')
         
         # Build query for user's notifications and system-wide notifications
-        query = Notification.query.filter(
-            db.or_(
-                Notification.user_id == current_user_id,
-                Notification.user_id.is_(None)  # System-wide notifications
-            )
-        )
+        query = Notification.query.filter(visible_to(current_user_id))
         
         # Add filters
         if unread_only:
-            query = query.filter(Notification.is_read == False)
+            state = get_state(current_user_id)
+            query = query.filter(unread_filter(current_user_id, state.last_read_notification_id))
         
         if notification_type:
             try:
@@ -54,6 +138,9 @@ def get_notifications():
             error_out=False
         )
         
+        # Read state is per user (system-wide notifications have per-user receipts)
+        read_ids = get_read_ids(current_user_id, pagination.items)
+        
         notifications = []
         for notification in pagination.items:
             notifications.append({
@@ -62,19 +149,16 @@ def get_notifications():
                 'title': notification.title,
                 'message': notification.message,
                 'notification_type': notification.notification_type.value if notification.notification_type else None,
-                'is_read': notification.is_read,
+                'is_read': notification.id in read_ids,
                 'action_url': notification.action_url,
                 'created_at': notification.created_at.isoformat()
             })
         
-        # Get unread count
-        unread_count = Notification.query.filter(
-            db.or_(
-                Notification.user_id == current_user_id,
-                Notification.user_id.is_(None)
-            ),
-            Notification.is_read == False
-        ).count()
+        # Get unread count from the maintained per-user counter
+        unread_count = get_unread_count(current_user_id)
+        
+        # Persist the state row if this was the user's first request
+        db.session.commit()
         
         return jsonify({
             'notifications': notifications,
@@ -105,13 +189,16 @@ def get_notification(notification_id):
         if notification.user_id and notification.user_id != current_user_id:
             return jsonify({'error': 'Access denied'}), 403
         
+        is_read = notification.id in get_read_ids(current_user_id, [notification])
+        db.session.commit()
+        
         return jsonify({
             'id': notification.id,
             'user_id': notification.user_id,
             'title': notification.title,
             'message': notification.message,
             'notification_type': notification.notification_type.value if notification.notification_type else None,
-            'is_read': notification.is_read,
+            'is_read': is_read,
             'action_url': notification.action_url,
             'created_at': notification.created_at.isoformat()
         }), 200
@@ -162,6 +249,15 @@ def create_notification():
         )
         
         db.session.add(notification)
+        db.session.flush()
+        
+        # Bump the unread counters of the recipients in the same transaction
+        record_notification_created(notification)
+        
+        # Push to connected clients once the notification is committed
+        notification_bus.publish_after_commit(
+            db.session, 'notification', notification_event_payload(notification), user_id=notification.user_id
+        )
         db.session.commit()
         
         return jsonify({
@@ -180,6 +276,101 @@ def create_notification():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@notifications_bp.route('/notifications/bulk', methods=['POST'])
+@jwt_required()
+def create_bulk_notifications():
+    """Send a notification to every user matching a role and/or id filter (admin/manager only)"""
+    try:
+        claims = get_jwt()
+        role_claim = claims.get('role', '')
+        if not claims.get('is_admin', False) and str(role_claim).upper() not in ['ADMIN', 'MANAGER']:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        # Validate required fields
+        required_fields = ['title', 'message']
+        for field in required_fields:
+            if not data.get(field):
+                return jsonify({'error': f'{field} is required'}), 400
+        
+        notification_type = NotificationType.INFO  # Default
+        if data.get('notification_type'):
+            try:
+                notification_type = NotificationType(data['notification_type'])
+            except ValueError:
+                return jsonify({'error': 'Invalid notification_type'}), 400
+        
+        # Accept 'role' or 'roles' (e.g. "manager" or ["manager", "staff"])
+        role_names = data.get('roles') or ([data['role']] if data.get('role') else [])
+        user_ids = data.get('user_ids') or []
+        if not role_names and not user_ids:
+            return jsonify({'error': 'role, roles or user_ids is required'}), 400
+        
+        try:
+            roles = [UserRole(str(name).lower()) for name in role_names]
+        except ValueError:
+            return jsonify({'error': f'Invalid role. Use one of: {", ".join(r.value for r in UserRole)}'}), 400
+        
+        try:
+            if not isinstance(user_ids, list):
+                raise TypeError
+            user_ids = [int(i) for i in user_ids]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'user_ids must be a list of user ids'}), 400
+        
+        # Recipients are selected in the database; no user rows are loaded
+        recipients = db.select(
+            User.id,
+            db.literal(data['title'], db.String),
+            db.literal(data['message'], db.Text),
+            db.literal(notification_type, Notification.__table__.c.notification_type.type),
+            db.literal(False, db.Boolean),
+            db.literal(data.get('action_url'), db.String)
+        )
+        if data.get('active_only', True):
+            recipients = recipients.where(User.is_active == True)
+        if roles:
+            recipients = recipients.where(User.role.in_(roles))
+        if user_ids:
+            recipients = recipients.where(User.id.in_(user_ids))
+        
+        inserted = db.session.execute(
+            db.insert(Notification).from_select(
+                ['user_id', 'title', 'message', 'notification_type', 'is_read', 'action_url'],
+                recipients
+            ).returning(Notification.id, Notification.user_id, Notification.created_at)
+        ).all()
+        
+        recipient_ids = [row.user_id for row in inserted]
+        record_notifications_created_for(recipient_ids)
+        
+        # One small event per recipient: nobody sees other users' ids and each
+        # payload stays well under pg_notify's 8000-byte limit
+        for row in inserted:
+            notification_bus.publish_after_commit(db.session, 'notification', {
+                'id': row.id,
+                'user_id': row.user_id,
+                'title': data['title'],
+                'message': data['message'],
+                'notification_type': notification_type.value,
+                'action_url': data.get('action_url'),
+                'created_at': row.created_at.isoformat() if row.created_at else None
+            }, user_id=row.user_id)
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': f'Notification sent to {len(inserted)} users',
+            'inserted_count': len(inserted)
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @notifications_bp.route('/notifications/<int:notification_id>/read', methods=['PUT'])
 @jwt_required()
 def mark_notification_read(notification_id):
@@ -193,14 +384,18 @@ def mark_notification_read(notification_id):
         if notification.user_id and notification.user_id != current_user_id:
             return jsonify({'error': 'Access denied'}), 403
         
-        notification.is_read = True
+        # Targeted notifications keep their flag, system-wide ones get a per-user receipt
+        changed = mark_read(current_user_id, notification)
         db.session.commit()
         
+        if changed:
+            notification_bus.publish('unread_count', {'unread_count': get_unread_count(current_user_id)}, user_id=current_user_id)
+        
         return jsonify({
             'message': 'Notification marked as read',
             'notification': {
                 'id': notification.id,
-                'is_read': notification.is_read
+                'is_read': True
             }
         }), 200
         
@@ -215,17 +410,13 @@ def mark_all_notifications_read():
     try:
         current_user_id = get_current_user()
         
-        # Mark user's notifications and system-wide notifications as read
-        updated_count = Notification.query.filter(
-            db.or_(
-                Notification.user_id == current_user_id,
-                Notification.user_id.is_(None)
-            ),
-            Notification.is_read == False
-        ).update({'is_read': True})
+        # Move the user's read watermark past every existing notification
+        updated_count = mark_all_read(current_user_id)
         
         db.session.commit()
         
+        notification_bus.publish('unread_count', {'unread_count': 0}, user_id=current_user_id)
+        
         return jsonify({
             'message': f'{updated_count} notifications marked as read'
         }), 200
@@ -248,6 +439,7 @@ def delete_notification(notification_id):
         if notification.user_id and notification.user_id != current_user_id:
             return jsonify({'error': 'Access denied'}), 403
         
+        record_notification_deleted(notification)
         db.session.delete(notification)
         db.session.commit()
         
@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify, url_for,current_app
 from models import ProductImage, Product
-from utils.images import save_product_image, delete_image_file, allowed_file
-from extensions import db
+from utils.images import save_product_image, release_image_files, allowed_file, HASH_CHUNK_SIZE
+from utils.bulk_images import import_image_archive
+from extensions import db, image_pipeline
 import os
+import tempfile
 from flask_jwt_extended import jwt_required
 
 # Blueprint Configuration
@@ -33,6 +35,8 @@ def get_product_image_url(image_id):
         'image_id': image.image_id,
         'product_id': image.product_id,
         'image_url': url_for('static', filename=image.image_url, _external=True),
+        'thumbnail_url': url_for('static', filename=image.thumbnail_url, _external=True) if image.thumbnail_url else None,
+        'webp_url': url_for('static', filename=image.webp_url, _external=True) if image.webp_url else None,
         'is_primary': image.is_primary,
     }), 200
 
@@ -59,9 +63,17 @@ def upload_product_image(product_id):
         return jsonify({'error': 'File type not allowed'}), 400
     
     # """Save the image to filesystem"""
-    image_path = save_product_image(file, product_id)
+    image_path, content_hash = save_product_image(file, product_id)
     if not image_path:
         return jsonify({'error': 'Image upload failed'}), 500
+
+    # The same bytes are stored once; attaching them twice to one product is pointless
+    existing = ProductImage.query.filter_by(product_id=product_id, content_hash=content_hash).first()
+    if existing:
+        return jsonify({
+            'error': 'This image is already attached to the product',
+            'image_id': existing.image_id
+        }), 409
     
     is_primary = request.form.get('is_primary', 'false').lower() == 'true'
 
@@ -76,26 +88,141 @@ def upload_product_image(product_id):
     
         new_image = ProductImage(
             image_url=image_path,
+            content_hash=content_hash,
             is_primary=is_primary,
             product_id=product_id
         )
         db.session.add(new_image)
         db.session.commit()
+
+        # Thumbnail and WebP renditions are generated in the background
+        image_pipeline.submit(new_image.image_id)
     
         return jsonify({
             'message': 'Product image uploaded successfully', 
             'image_id': new_image.image_id,
     'image_url': url_for('static', filename=image_path,  _external=True),
+            'thumbnail_url': None,
+            'webp_url': None,
             'is_primary': is_primary,
             'image_count': current_count + 1
         }), 201
 
     except Exception as e:
-            # Clean up if DB operation fails
-            delete_image_file(image_path)
+            # Clean up if DB operation fails (unless another image shares the file)
+            db.session.rollback()
+            release_image_files(image_path, content_hash)
             current_app.logger.error(f"Failed to save image: {str(e)}")
             return jsonify({'error': 'Database operation failed'}), 500
 
+
+def spool_archive(stream, max_bytes):
+    """Copy an upload stream to a temporary file in chunks; returns its path"""
+    size = 0
+    archive = tempfile.NamedTemporaryFile(prefix='product-images-', suffix='.zip', delete=False)
+    try:
+        with archive:
+            for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f'Archive is larger than {max_bytes} bytes')
+                archive.write(chunk)
+        return archive.name
+    except BaseException:
+        os.unlink(archive.name)
+        raise
+
+
+@product_image_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+def bulk_upload_product_images():
+    """Attach the images in a zip archive to products by file name.
+    ---
+    tags:
+    - Product Images
+    consumes:
+    - multipart/form-data
+    - application/zip
+    parameters:
+    - name: archive
+        in: formData
+        type: file
+        description: Zip of images named <barcode or product id>[_anything].<ext>
+            (or send the zip as the raw request body)
+    responses:
+    200:
+        description: Per-file report (created, duplicate, skipped or error)
+    400:
+        description: Missing, oversized or invalid archive
+    """
+    config = current_app.config
+    max_archive_size = config['BULK_IMAGE_MAX_ARCHIVE_SIZE']
+    if request.content_length and request.content_length > max_archive_size:
+        return jsonify({'error': f'Archive is larger than {max_archive_size} bytes'}), 400
+
+    if request.mimetype == 'multipart/form-data':
+        if 'archive' not in request.files or request.files['archive'].filename == '':
+            return jsonify({'error': 'No archive file provided'}), 400
+        stream = request.files['archive'].stream
+    elif request.mimetype in ('application/zip', 'application/x-zip-compressed', 'application/octet-stream'):
+        stream = request.stream
+    else:
+        return jsonify({'error': 'Send a zip archive as multipart field "archive" or as application/zip'}), 400
+
+    archive_path = None
+    stored = []
+    try:
+        archive_path = spool_archive(stream, max_archive_size)
+        results, image_ids = import_image_archive(
+            archive_path,
+            config['UPLOAD_FOLDER'],
+            config['ALLOWED_EXTENSIONS'],
+            MAX_IMAGES_PER_PRODUCT,
+            max_files=config['BULK_IMAGE_MAX_FILES'],
+            max_file_size=config['BULK_IMAGE_MAX_FILE_SIZE'],
+            workers=config['BULK_IMAGE_WORKERS'],
+            stored_files=stored
+        )
+        db.session.commit()
+
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+    except Exception as e:
+        # Clean up files stored for rows that were never committed (unless shared)
+        db.session.rollback()
+        for image_url, content_hash in stored:
+            release_image_files(image_url, content_hash)
+        current_app.logger.error(f"Failed to import image archive: {str(e)}")
+        return jsonify({'error': 'Database operation failed'}), 500
+
+    finally:
+        if archive_path:
+            os.unlink(archive_path)
+
+    # Rejected files (over the limit, already attached) stay only if other rows use them
+    created_urls = {result['image_url'] for result in results if result['status'] == 'created'}
+    for image_url, content_hash in stored:
+        if image_url not in created_urls:
+            release_image_files(image_url, content_hash)
+
+    # Thumbnail and WebP renditions are generated in the background
+    for image_id in image_ids:
+        image_pipeline.submit(image_id)
+
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+        if result.get('image_url'):
+            result['image_url'] = url_for('static', filename=result['image_url'], _external=True)
+
+    return jsonify({
+        'message': f"Created {len(image_ids)} of {len(results)} images",
+        'summary': summary,
+        'results': results
+    }), 200
+
 # Update a product image
 
 @product_image_bp.route('/<int:image_id>', methods=['PUT'])
@@ -198,24 +325,16 @@ def delete_product_image(image_id):
     was_primary = image.is_primary
     product_id = image.product_id
     image_url = image.image_url
-
-
-    # Delete the image file
-    if not delete_image_file(image.image_url):
-        current_app.logger.error(f"Failed to delete image file: {image.image_url}")
+    content_hash = image.content_hash
     
     try:
-
-        # Delete the image file
-        if not delete_image_file(image.image_url):
-            current_app.logger.error(f"Failed to delete image file: {image.image_url}")
-    
     # Delete from database
         db.session.delete(image)
         db.session.commit()
 
-        
-    
+    # Files are shared by identical uploads; they go only when the last reference does
+        if not release_image_files(image_url, content_hash):
+            current_app.logger.info(f"Image file still referenced, kept: {image_url}")
     
     # If we deleted the primary image, assign a new one
         if was_primary:
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from extensions import db
-from models import Product, Category, ProductStatus
+from models import Product, Category, ProductStatus, Supplier
 from decimal import Decimal
 from datetime import datetime
 
@@ -14,6 +14,33 @@ def get_current_user():
         return current_identity.get('id')
     return current_identity
 
+def resolve_supplier(data):
+    """
+    Supplier link for a product payload as (supplier_id, supplier name).
+    
+    supplier_id takes precedence; a bare supplier name is matched against
+    Supplier records ignoring case and is kept as free text if none matches.
+    
+    Raises:
+        ValueError: If supplier_id does not exist
+    """
+    if data.get('supplier_id'):
+        supplier = db.session.get(Supplier, data['supplier_id'])
+        if not supplier:
+            raise ValueError('Invalid supplier_id')
+        return supplier.id, supplier.name
+    
+    name = (data.get('supplier') or '').strip()
+    if not name:
+        return None, None
+    
+    supplier = Supplier.query.filter(
+        db.func.lower(Supplier.name) == name.lower()
+    ).order_by(Supplier.id).first()
+    if supplier:
+        return supplier.id, supplier.name
+    return None, name
+
 @products_bp.route('/products', methods=['GET'])
 @jwt_required()
 def get_products():
@@ -100,6 +127,7 @@ def get_products():
                 'alcohol_content': float(product.alcohol_content) if product.alcohol_content else None,
                 'country_of_origin': product.country_of_origin,
                 'supplier': product.supplier,
+                'supplier_id': product.supplier_id,
                 'is_active': product.is_active,
                 'created_at': product.created_at.isoformat() if product.created_at else None,
                 'updated_at': product.updated_at.isoformat() if product.updated_at else None,
@@ -107,6 +135,8 @@ def get_products():
                     {
                         'image_id': img.image_id,
                         'image_url': url_for('static', filename=img.image_url, _external=True),
+                        'thumbnail_url': url_for('static', filename=img.thumbnail_url, _external=True) if img.thumbnail_url else None,
+                        'webp_url': url_for('static', filename=img.webp_url, _external=True) if img.webp_url else None,
                         'is_primary': img.is_primary,
                         'alt_text': img.alt_text
                     } for img in product.images
@@ -154,6 +184,7 @@ def get_product(product_id):
             'alcohol_content': float(product.alcohol_content) if product.alcohol_content else None,
             'country_of_origin': product.country_of_origin,
             'supplier': product.supplier,
+            'supplier_id': product.supplier_id,
             'is_active': product.is_active,
             'created_at': product.created_at.isoformat() if product.created_at else None,
             'updated_at': product.updated_at.isoformat() if product.updated_at else None,
@@ -161,6 +192,8 @@ def get_product(product_id):
                 {
                     'image_id': img.image_id,
                     'image_url': img.image_url,
+                    'thumbnail_url': img.thumbnail_url,
+                    'webp_url': img.webp_url,
                     'is_primary': img.is_primary,
                     'alt_text': img.alt_text
                 } for img in product.images
@@ -200,6 +233,12 @@ def create_product():
             if not category:
                 return jsonify({'error': 'Invalid category_id'}), 400
         
+        # Link the supplier record (by id or by name)
+        try:
+            supplier_id, supplier_name = resolve_supplier(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Create new product
         product = Product(
             name=data['name'],
@@ -216,7 +255,8 @@ def create_product():
             size=data.get('size'),
             alcohol_content=Decimal(str(data['alcohol_content'])) if data.get('alcohol_content') else None,
             country_of_origin=data.get('country_of_origin'),
-            supplier=data.get('supplier'),
+            supplier=supplier_name,
+            supplier_id=supplier_id,
             is_active=data.get('is_active', True)
         )
         
@@ -244,6 +284,7 @@ def create_product():
                 'alcohol_content': float(product.alcohol_content) if product.alcohol_content else None,
                 'country_of_origin': product.country_of_origin,
                 'supplier': product.supplier,
+                'supplier_id': product.supplier_id,
                 'is_active': product.is_active,
                 'created_at': product.created_at.isoformat() if product.created_at else None,
                 'updated_at': product.updated_at.isoformat() if product.updated_at else None,
@@ -342,8 +383,11 @@ def update_product(product_id):
         if 'country_of_origin' in data:
             product.country_of_origin = data['country_of_origin'] if data['country_of_origin'] else None
         
-        if 'supplier' in data:
-            product.supplier = data['supplier'] if data['supplier'] else None
+        if 'supplier' in data or 'supplier_id' in data:
+            try:
+                product.supplier_id, product.supplier = resolve_supplier(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
         if 'is_active' in data:
             product.is_active = data['is_active']
@@ -373,6 +417,7 @@ def update_product(product_id):
                 'alcohol_content': float(product.alcohol_content) if product.alcohol_content else None,
                 'country_of_origin': product.country_of_origin,
                 'supplier': product.supplier,
+                'supplier_id': product.supplier_id,
                 'is_active': product.is_active,
                 'created_at': product.created_at.isoformat() if product.created_at else None,
                 'updated_at': product.updated_at.isoformat() if product.updated_at else None,
@@ -380,6 +425,8 @@ def update_product(product_id):
                     {
                         'image_id': img.image_id,
                         'image_url': url_for('static', filename=img.image_url, _external=True),
+                        'thumbnail_url': url_for('static', filename=img.thumbnail_url, _external=True) if img.thumbnail_url else None,
+                        'webp_url': url_for('static', filename=img.webp_url, _external=True) if img.webp_url else None,
                         'is_primary': img.is_primary,
                         'alt_text': img.alt_text
                     } for img in product.images
@@ -567,10 +614,16 @@ def get_low_stock_products():
                 'status': product.status,
                 'price': float(product.price),
                 'supplier': product.supplier,
+                'supplier_id': product.supplier_id,
+                'open_po_quantity': product.open_po_quantity,
+                # Top up to max_stock_level, counting what is already on order
+                'suggested_order_quantity': max(product.max_stock_level - product.stock - product.open_po_quantity, 0),
                 'images': [
                     {
                         'image_id': img.image_id,
                         'image_url': url_for('static', filename=img.image_url, _external=True),
+                        'thumbnail_url': url_for('static', filename=img.thumbnail_url, _external=True) if img.thumbnail_url else None,
+                        'webp_url': url_for('static', filename=img.webp_url, _external=True) if img.webp_url else None,
                         'is_primary': img.is_primary,
                         'alt_text': img.alt_text
                     } for img in product.images
@@ -0,0 +1,302 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from extensions import db
+from models import PurchaseOrder, PurchaseOrderLine, PurchaseOrderStatus, Product
+from utils.purchase_orders import (
+    create_purchase_order, submit_purchase_order, receive_purchase_order,
+    cancel_purchase_order, lock_purchase_order
+)
+from datetime import datetime
+
+purchase_orders_bp = Blueprint('purchase_orders', __name__)
+
+def get_current_user():
+    """Helper function to get current user from JWT"""
+    current_identity = get_jwt_identity()
+    if isinstance(current_identity, dict):
+        return current_identity.get('id')
+    return current_identity
+
+def purchase_order_payload(purchase_order, include_lines=True):
+    """API representation of a purchase order"""
+    payload = {
+        'id': purchase_order.id,
+        'order_number': purchase_order.order_number,
+        'supplier_id': purchase_order.supplier_id,
+        'supplier_name': purchase_order.supplier.name if purchase_order.supplier else None,
+        'status': purchase_order.status.value,
+        'total_cost': float(purchase_order.total_cost),
+        'expected_date': purchase_order.expected_date.isoformat() if purchase_order.expected_date else None,
+        'notes': purchase_order.notes,
+        'created_by': purchase_order.created_by,
+        'ordered_at': purchase_order.ordered_at.isoformat() if purchase_order.ordered_at else None,
+        'received_at': purchase_order.received_at.isoformat() if purchase_order.received_at else None,
+        'created_at': purchase_order.created_at.isoformat() if purchase_order.created_at else None,
+        'updated_at': purchase_order.updated_at.isoformat() if purchase_order.updated_at else None
+    }
+    if include_lines:
+        payload['lines'] = [
+            {
+                'id': line.id,
+                'product_id': line.product_id,
+                'product_name': line.product.name if line.product else None,
+                'quantity_ordered': line.quantity_ordered,
+                'quantity_received': line.quantity_received,
+                'quantity_outstanding': line.quantity_outstanding,
+                'unit_cost': float(line.unit_cost),
+                'line_total': float(line.unit_cost * line.quantity_ordered)
+            } for line in purchase_order.lines
+        ]
+    return payload
+
+@purchase_orders_bp.route('/purchase-orders', methods=['GET'])
+@jwt_required()
+def get_purchase_orders():
+    """Get purchase orders with pagination and filtering"""
+    try:
+        # Check if user has permission (admin/manager only)
+        current_user_id = get_current_user()
+        
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 20, type=int)
+        status = request.args.get('status')
+        supplier_id = request.args.get('supplier_id', type=int)
+        product_id = request.args.get('product_id', type=int)
+        
+        query = PurchaseOrder.query.options(db.joinedload(PurchaseOrder.supplier))
+        
+        if status:
+            try:
+                query = query.filter(PurchaseOrder.status == PurchaseOrderStatus(status))
+            except ValueError:
+                return jsonify({'error': 'Invalid status'}), 400
+        
+        if supplier_id:
+            query = query.filter(PurchaseOrder.supplier_id == supplier_id)
+        
+        if product_id:
+            query = query.filter(PurchaseOrder.lines.any(PurchaseOrderLine.product_id == product_id))
+        
+        query = query.order_by(PurchaseOrder.created_at.desc(), PurchaseOrder.id.desc())
+        
+        pagination = query.paginate(
+            page=page,
+            per_page=per_page,
+            error_out=False
+        )
+        
+        return jsonify({
+            'purchase_orders': [purchase_order_payload(po, include_lines=False) for po in pagination.items],
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total': pagination.total,
+                'pages': pagination.pages,
+                'has_next': pagination.has_next,
+                'has_prev': pagination.has_prev
+            }
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@purchase_orders_bp.route('/purchase-orders/<int:purchase_order_id>', methods=['GET'])
+@jwt_required()
+def get_purchase_order(purchase_order_id):
+    """Get a purchase order with its lines"""
+    try:
+        purchase_order = PurchaseOrder.query.options(
+            db.selectinload(PurchaseOrder.lines).joinedload(PurchaseOrderLine.product)
+        ).get_or_404(purchase_order_id)
+        
+        return jsonify(purchase_order_payload(purchase_order)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@purchase_orders_bp.route('/purchase-orders', methods=['POST'])
+@jwt_required()
+def create_purchase_order_route():
+    """Create a purchase order (admin/manager only); pass submit=true to place it right away"""
+    try:
+        # Check if user has permission (admin/manager only)
+        current_user_id = get_current_user()
+        
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        if not data.get('supplier_id'):
+            return jsonify({'error': 'supplier_id is required'}), 400
+        
+        if not isinstance(data.get('lines'), list) or not data['lines']:
+            return jsonify({'error': 'lines are required'}), 400
+        
+        expected_date = None
+        if data.get('expected_date'):
+            try:
+                expected_date = datetime.strptime(data['expected_date'], '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({'error': 'expected_date must be YYYY-MM-DD'}), 400
+        
+        try:
+            purchase_order = create_purchase_order(
+                data['supplier_id'],
+                data['lines'],
+                created_by=current_user_id,
+                expected_date=expected_date,
+                notes=data.get('notes'),
+                submit=bool(data.get('submit', False))
+            )
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Purchase order created successfully',
+            'purchase_order': purchase_order_payload(purchase_order)
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@purchase_orders_bp.route('/purchase-orders/<int:purchase_order_id>/submit', methods=['POST'])
+@jwt_required()
+def submit_purchase_order_route(purchase_order_id):
+    """Place a draft purchase order with the supplier (admin/manager only)"""
+    try:
+        # Check if user has permission (admin/manager only)
+        current_user_id = get_current_user()
+        
+        purchase_order = lock_purchase_order(purchase_order_id)
+        if not purchase_order:
+            return jsonify({'error': 'Purchase order not found'}), 404
+        
+        try:
+            submit_purchase_order(purchase_order)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Purchase order submitted successfully',
+            'purchase_order': purchase_order_payload(purchase_order)
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@purchase_orders_bp.route('/purchase-orders/<int:purchase_order_id>/receive', methods=['POST'])
+@jwt_required()
+def receive_purchase_order_route(purchase_order_id):
+    """
+    Receive goods against a purchase order (admin/manager only).
+    
+    Body: {"lines": [{"line_id" or "product_id", "quantity"}], "notes"}; omit
+    lines to receive everything outstanding. All lines post in one transaction.
+    """
+    try:
+        # Check if user has permission (admin/manager only)
+        current_user_id = get_current_user()
+        
+        data = request.get_json(silent=True) or {}
+        received = data.get('lines')
+        if received is not None and (not isinstance(received, list) or not received):
+            return jsonify({'error': 'lines must be a non-empty list'}), 400
+        
+        purchase_order = lock_purchase_order(purchase_order_id)
+        if not purchase_order:
+            return jsonify({'error': 'Purchase order not found'}), 404
+        
+        try:
+            receipts = receive_purchase_order(
+                purchase_order,
+                received=received,
+                received_by=current_user_id,
+                notes=data.get('notes')
+            )
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': f'Received {sum(r["quantity"] for r in receipts)} units on {len(receipts)} lines',
+            'receipts': receipts,
+            'purchase_order': purchase_order_payload(purchase_order)
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@purchase_orders_bp.route('/purchase-orders/<int:purchase_order_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_purchase_order_route(purchase_order_id):
+    """Cancel a purchase order; received quantities stay in stock (admin/manager only)"""
+    try:
+        # Check if user has permission (admin/manager only)
+        current_user_id = get_current_user()
+        
+        purchase_order = lock_purchase_order(purchase_order_id)
+        if not purchase_order:
+            return jsonify({'error': 'Purchase order not found'}), 404
+        
+        try:
+            cancel_purchase_order(purchase_order)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Purchase order cancelled successfully',
+            'purchase_order': purchase_order_payload(purchase_order)
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@purchase_orders_bp.route('/products/<int:product_id>/open-purchase-orders', methods=['GET'])
+@jwt_required()
+def get_product_open_purchase_orders(product_id):
+    """Open purchase order lines for a product, with the maintained on-order total"""
+    try:
+        product = Product.query.get_or_404(product_id)
+        
+        lines = PurchaseOrderLine.query.join(PurchaseOrder).options(
+            db.contains_eager(PurchaseOrderLine.purchase_order)
+        ).filter(
+            PurchaseOrderLine.product_id == product_id,
+            PurchaseOrder.status.in_([PurchaseOrderStatus.ORDERED, PurchaseOrderStatus.PARTIALLY_RECEIVED])
+        ).order_by(PurchaseOrder.expected_date.asc(), PurchaseOrder.id.asc()).all()
+        
+        return jsonify({
+            'product_id': product.id,
+            'product_name': product.name,
+            'stock': product.stock,
+            'open_po_quantity': product.open_po_quantity,
+            'lines': [
+                {
+                    'purchase_order_id': line.purchase_order_id,
+                    'order_number': line.purchase_order.order_number,
+                    'status': line.purchase_order.status.value,
+                    'expected_date': line.purchase_order.expected_date.isoformat() if line.purchase_order.expected_date else None,
+                    'quantity_ordered': line.quantity_ordered,
+                    'quantity_received': line.quantity_received,
+                    'quantity_outstanding': line.quantity_outstanding
+                } for line in lines
+            ]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
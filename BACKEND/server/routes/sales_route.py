@@ -1,8 +1,9 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from extensions import db
+from extensions import db, mpesa_outbox
 from models import Sale, SaleItem, Product, Customer, User, PaymentMethod, MpesaTransaction, MpesaTransactionStatus, MpesaTransactionType
-from utils.daraja_client import initiate_stk_push
+from utils.daraja_client import sanitize_phone_number
+from utils.mpesa_outbox import enqueue_stk_push, mpesa_status_payload
 from decimal import Decimal
 from datetime import datetime, timedelta
 import logging
@@ -583,6 +584,10 @@ def create_sale_with_mpesa():
         if not employee:
             return jsonify({'error': 'Invalid employee_id'}), 400
         
+        # Reject numbers Daraja would refuse before anything is written
+        if not sanitize_phone_number(data['mpesa_phone_number']):
+            return jsonify({'error': 'Invalid phone number format. Use formats like: 0712345678, +254712345678, or 254712345678'}), 400
+        
         # Validate items
         items = data.get('items', [])
         if not items:
@@ -680,70 +685,66 @@ def create_sale_with_mpesa():
         transaction_id = f"TXN{mpesa_transaction.id}{datetime.now().strftime('%Y%m%d%H%M%S')}"
         mpesa_transaction.transaction_id = transaction_id
         
-        # Initiate STK Push
-        response_data, status_code = initiate_stk_push(
-            phone_number=data['mpesa_phone_number'],
-            amount=float(sale.total_amount),
-            order_id=mpesa_transaction.id,
-            description=f"Payment for sale {receipt_number}"
-        )
+        # Add sale items to session (but don't update stock yet)
+        for item_info in sale_items:
+            db.session.add(item_info['sale_item'])
         
-        if status_code == 200:
-            # Update M-Pesa transaction with response
-            mpesa_transaction.checkout_request_id = response_data.get('CheckoutRequestID')
-            mpesa_transaction.merchant_request_id = response_data.get('MerchantRequestID')
-            mpesa_transaction.mpesa_data = response_data
-            
-            # Add sale items to session (but don't update stock yet)
-            for item_info in sale_items:
-                db.session.add(item_info['sale_item'])
-            
-            # Update customer's total purchases if customer exists
-            if customer:
-                customer.total_purchases += sale.total_amount
-                customer.last_purchase_date = datetime.utcnow()
-            
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': 'Sale created and M-Pesa payment initiated',
-                'sale': {
-                    'id': sale.id,
-                    'receipt_number': sale.receipt_number,
-                    'total_amount': float(sale.total_amount),
-                    'customer_name': customer.name if customer else None,
-                    'employee_name': employee.name,
-                    'payment_method': sale.payment_method.value,
-                    'sale_date': sale.sale_date.isoformat(),
-                    'items_count': len(items)
-                },
-                'mpesa': {
-                    'transaction_id': transaction_id,
-                    'checkout_request_id': response_data.get('CheckoutRequestID'),
-                    'merchant_request_id': response_data.get('MerchantRequestID'),
-                    'customer_message': response_data.get('CustomerMessage')
-                }
-            }), 201
-        else:
-            # M-Pesa payment initiation failed
-            mpesa_transaction.status = MpesaTransactionStatus.FAILED
-            mpesa_transaction.result_desc = response_data.get('error', 'STK Push failed')
-            mpesa_transaction.mpesa_data = response_data
-            
-            db.session.commit()
-            
-            return jsonify({
-                'success': False,
-                'error': response_data.get('error', 'Failed to initiate M-Pesa payment'),
-                'sale_id': sale.id  # Sale is created but payment failed
-            }), 400
+        # Update customer's total purchases if customer exists
+        if customer:
+            customer.total_purchases += sale.total_amount
+            customer.last_purchase_date = datetime.utcnow()
+        
+        # The STK push is sent by the outbox dispatcher once this commits
+        enqueue_stk_push(mpesa_transaction)
+        db.session.commit()
+        mpesa_outbox.wake()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Sale created; M-Pesa payment request queued',
+            'sale': {
+                'id': sale.id,
+                'receipt_number': sale.receipt_number,
+                'total_amount': float(sale.total_amount),
+                'customer_name': customer.name if customer else None,
+                'employee_name': employee.name,
+                'payment_method': sale.payment_method.value,
+                'sale_date': sale.sale_date.isoformat(),
+                'items_count': len(items)
+            },
+            'mpesa': {
+                'transaction_id': transaction_id,
+                'mpesa_transaction_id': mpesa_transaction.id,
+                'status': mpesa_transaction.status.value,
+                # Poll this, or listen for 'mpesa_status' events on the notification stream
+                'status_url': url_for('sales.get_sale_mpesa_status', sale_id=sale.id)
+            }
+        }), 202
             
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error creating sale with M-Pesa: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@sales_bp.route('/sales/<int:sale_id>/mpesa-status', methods=['GET'])
+@jwt_required()
+def get_sale_mpesa_status(sale_id):
+    """Payment state of the latest M-Pesa STK push for a sale (for the till to poll)"""
+    try:
+        mpesa_transaction = MpesaTransaction.query.filter_by(
+            sale_id=sale_id,
+            transaction_type=MpesaTransactionType.STK_PUSH
+        ).order_by(MpesaTransaction.id.desc()).first()
+        
+        if not mpesa_transaction:
+            return jsonify({'error': 'No M-Pesa payment found for this sale'}), 404
+        
+        return jsonify(mpesa_status_payload(mpesa_transaction)), 200
+        
+    except Exception as e:
+        logger.error(f"Error fetching M-Pesa status: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @sales_bp.route('/sales/<int:sale_id>/complete-mpesa', methods=['POST'])
 @jwt_required()
 def complete_mpesa_sale(sale_id):
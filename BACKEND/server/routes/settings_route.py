@@ -1,9 +1,11 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from extensions import db
+from extensions import db, settings_cache
 from models import SystemSettings
+from utils.settings_service import (
+    bump_settings_version, serialize_setting, serialize_setting_value
+)
 from datetime import datetime
-import json
 
 settings_bp = Blueprint('settings', __name__)
 
@@ -22,41 +24,8 @@ def get_settings():
         # Get query parameters
         public_only = request.args.get('public_only', 'false').lower() == 'true'
         
-        # Build query
-        query = SystemSettings.query
-        
-        if public_only:
-            query = query.filter(SystemSettings.is_public == True)
-        
-        # Order by key
-        query = query.order_by(SystemSettings.key)
-        
-        settings = []
-        for setting in query.all():
-            # Parse value based on data type
-            value = setting.value
-            if setting.data_type == 'json':
-                try:
-                    value = json.loads(setting.value)
-                except json.JSONDecodeError:
-                    value = setting.value
-            elif setting.data_type == 'number':
-                try:
-                    value = float(setting.value)
-                except ValueError:
-                    value = setting.value
-            elif setting.data_type == 'boolean':
-                value = setting.value.lower() in ('true', '1', 'yes', 'on')
-            
-            settings.append({
-                'id': setting.id,
-                'key': setting.key,
-                'value': value,
-                'description': setting.description,
-                'data_type': setting.data_type,
-                'is_public': setting.is_public,
-                'updated_at': setting.updated_at.isoformat() if setting.updated_at else None
-            })
+        # Served from the in-process cache, no query unless settings changed
+        settings = settings_cache.all(public_only=public_only)
         
         return jsonify({
             'settings': settings
@@ -70,34 +39,11 @@ def get_settings():
 def get_setting(key):
     """Get a specific setting by key"""
     try:
-        setting = SystemSettings.query.filter_by(key=key).first()
+        setting = settings_cache.get_setting(key)
         if not setting:
             return jsonify({'error': 'Setting not found'}), 404
         
-        # Parse value based on data type
-        value = setting.value
-        if setting.data_type == 'json':
-            try:
-                value = json.loads(setting.value)
-            except json.JSONDecodeError:
-                value = setting.value
-        elif setting.data_type == 'number':
-            try:
-                value = float(setting.value)
-            except ValueError:
-                value = setting.value
-        elif setting.data_type == 'boolean':
-            value = setting.value.lower() in ('true', '1', 'yes', 'on')
-        
-        return jsonify({
-            'id': setting.id,
-            'key': setting.key,
-            'value': value,
-            'description': setting.description,
-            'data_type': setting.data_type,
-            'is_public': setting.is_public,
-            'updated_at': setting.updated_at.isoformat() if setting.updated_at else None
-        }), 200
+        return jsonify(setting), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -130,19 +76,10 @@ def create_setting():
         value = data['value']
         
         # Convert value to string for storage
-        if data_type == 'json':
-            if not isinstance(value, (dict, list)):
-                return jsonify({'error': 'Value must be a valid JSON object or array'}), 400
-            value = json.dumps(value)
-        elif data_type == 'boolean':
-            value = str(bool(value)).lower()
-        elif data_type == 'number':
-            try:
-                value = str(float(value))
-            except (ValueError, TypeError):
-                return jsonify({'error': 'Value must be a valid number'}), 400
-        else:
-            value = str(value)
+        try:
+            value = serialize_setting_value(value, data_type)
+        except ValueError as e:
+            return jsonify({'error': f'Value {e}'}), 400
         
         # Create setting
         setting = SystemSettings(
@@ -154,7 +91,9 @@ def create_setting():
         )
         
         db.session.add(setting)
+        bump_settings_version()
         db.session.commit()
+        settings_cache.invalidate()
         
         return jsonify({
             'message': 'Setting created successfully',
@@ -194,19 +133,10 @@ def update_setting(key):
             value = data['value']
             
             # Convert value to string for storage
-            if data_type == 'json':
-                if not isinstance(value, (dict, list)):
-                    return jsonify({'error': 'Value must be a valid JSON object or array'}), 400
-                value = json.dumps(value)
-            elif data_type == 'boolean':
-                value = str(bool(value)).lower()
-            elif data_type == 'number':
-                try:
-                    value = str(float(value))
-                except (ValueError, TypeError):
-                    return jsonify({'error': 'Value must be a valid number'}), 400
-            else:
-                value = str(value)
+            try:
+                value = serialize_setting_value(value, data_type)
+            except ValueError as e:
+                return jsonify({'error': f'Value {e}'}), 400
             
             setting.value = value
         
@@ -221,34 +151,13 @@ def update_setting(key):
         
         setting.updated_at = datetime.utcnow()
         
+        bump_settings_version()
         db.session.commit()
-        
-        # Parse value for response
-        response_value = setting.value
-        if setting.data_type == 'json':
-            try:
-                response_value = json.loads(setting.value)
-            except json.JSONDecodeError:
-                response_value = setting.value
-        elif setting.data_type == 'number':
-            try:
-                response_value = float(setting.value)
-            except ValueError:
-                response_value = setting.value
-        elif setting.data_type == 'boolean':
-            response_value = setting.value.lower() in ('true', '1', 'yes', 'on')
+        settings_cache.invalidate()
         
         return jsonify({
             'message': 'Setting updated successfully',
-            'setting': {
-                'id': setting.id,
-                'key': setting.key,
-                'value': response_value,
-                'description': setting.description,
-                'data_type': setting.data_type,
-                'is_public': setting.is_public,
-                'updated_at': setting.updated_at.isoformat()
-            }
+            'setting': serialize_setting(setting)
         }), 200
         
     except Exception as e:
@@ -268,7 +177,9 @@ def delete_setting(key):
             return jsonify({'error': 'Setting not found'}), 404
         
         db.session.delete(setting)
+        bump_settings_version()
         db.session.commit()
+        settings_cache.invalidate()
         
         return jsonify({
             'message': 'Setting deleted successfully'
@@ -290,70 +201,90 @@ def bulk_update_settings():
         if not data or 'settings' not in data:
             return jsonify({'error': 'Settings data is required'}), 400
         
+        items = data['settings']
+        if not isinstance(items, list):
+            return jsonify({'error': 'Settings must be a list'}), 400
+        
+        # Load every requested setting with one query
+        keys = [item['key'] for item in items if isinstance(item, dict) and item.get('key')]
+        settings_by_key = {
+            setting.key: setting
+            for setting in SystemSettings.query.filter(SystemSettings.key.in_(keys)).all()
+        } if keys else {}
+        
         updated_settings = []
         errors = []
-        
-        for setting_data in data['settings']:
-            if 'key' not in setting_data:
+        results = []
+        seen_keys = set()
+        now = datetime.utcnow()
+        
+        # Validate everything in memory before touching any row
+        changes = []
+        for setting_data in items:
+            if not isinstance(setting_data, dict) or not setting_data.get('key'):
                 errors.append('Key is required for each setting')
+                results.append({'key': None, 'status': 'error', 'error': 'Key is required'})
                 continue
             
             key = setting_data['key']
-            setting = SystemSettings.query.filter_by(key=key).first()
+            if key in seen_keys:
+                errors.append(f'Setting "{key}" is listed more than once')
+                results.append({'key': key, 'status': 'error', 'error': 'Duplicate key'})
+                continue
+            seen_keys.add(key)
             
+            setting = settings_by_key.get(key)
             if not setting:
                 errors.append(f'Setting with key "{key}" not found')
+                results.append({'key': key, 'status': 'error', 'error': 'Not found'})
                 continue
             
-            try:
-                # Update fields
-                if 'value' in setting_data:
-                    data_type = setting_data.get('data_type', setting.data_type)
-                    value = setting_data['value']
-                    
-                    # Convert value to string for storage
-                    if data_type == 'json':
-                        if not isinstance(value, (dict, list)):
-                            errors.append(f'Value for "{key}" must be a valid JSON object or array')
-                            continue
-                        value = json.dumps(value)
-                    elif data_type == 'boolean':
-                        value = str(bool(value)).lower()
-                    elif data_type == 'number':
-                        try:
-                            value = str(float(value))
-                        except (ValueError, TypeError):
-                            errors.append(f'Value for "{key}" must be a valid number')
-                            continue
-                    else:
-                        value = str(value)
-                    
-                    setting.value = value
-                
-                if 'data_type' in setting_data:
-                    setting.data_type = setting_data['data_type']
-                
-                if 'description' in setting_data:
-                    setting.description = setting_data['description']
-                
-                if 'is_public' in setting_data:
-                    setting.is_public = setting_data['is_public']
+            fields = {}
+            if 'value' in setting_data:
+                data_type = setting_data.get('data_type', setting.data_type)
                 
-                setting.updated_at = datetime.utcnow()
-                updated_settings.append(key)
-                
-            except Exception as e:
-                errors.append(f'Error updating "{key}": {str(e)}')
+                # Convert value to string for storage
+                try:
+                    fields['value'] = serialize_setting_value(setting_data['value'], data_type)
+                except ValueError as e:
+                    errors.append(f'Value for "{key}" {e}')
+                    results.append({'key': key, 'status': 'error', 'error': f'Value {e}'})
+                    continue
+            
+            for field in ('data_type', 'description', 'is_public'):
+                if field in setting_data:
+                    fields[field] = setting_data[field]
+            
+            changes.append((setting, fields))
+            results.append({'key': key, 'status': 'updated'})
         
         if errors:
+            # All or nothing: valid entries are not applied either
+            for result in results:
+                if result['status'] == 'updated':
+                    result['status'] = 'skipped'
             db.session.rollback()
-            return jsonify({'error': 'Some settings failed to update', 'details': errors}), 400
-        
+            return jsonify({
+                'error': 'Some settings failed to update',
+                'details': errors,
+                'results': results
+            }), 400
+        
+        # Rows updating the same columns are flushed as one executemany
+        for setting, fields in changes:
+            for field, value in fields.items():
+                setattr(setting, field, value)
+            setting.updated_at = now
+            updated_settings.append(setting.key)
+        
+        bump_settings_version()
         db.session.commit()
+        settings_cache.invalidate()
         
         return jsonify({
             'message': f'{len(updated_settings)} settings updated successfully',
-            'updated_settings': updated_settings
+            'updated_settings': updated_settings,
+            'results': results
         }), 200
         
     except Exception as e:
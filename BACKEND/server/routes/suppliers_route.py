@@ -49,10 +49,16 @@ def get_suppliers():
             error_out=False
         )
         
+        # Product counts for the whole page in one grouped query
+        supplier_ids = [supplier.id for supplier in pagination.items]
+        product_counts = dict(db.session.query(
+            Product.supplier_id,
+            db.func.count(Product.id)
+        ).filter(Product.supplier_id.in_(supplier_ids)).group_by(Product.supplier_id).all()) if supplier_ids else {}
+        
         suppliers = []
         for supplier in pagination.items:
-            # Get supplier's products count
-            products_count = Product.query.filter_by(supplier=supplier.name).count()
+            products_count = product_counts.get(supplier.id, 0)
             
             suppliers.append({
                 'id': supplier.id,
@@ -91,7 +97,7 @@ def get_supplier(supplier_id):
         supplier = Supplier.query.get_or_404(supplier_id)
         
         # Get supplier's products
-        products = Product.query.filter_by(supplier=supplier.name).all()
+        products = Product.query.filter_by(supplier_id=supplier.id).all()
         products_data = [
             {
                 'id': product.id,
@@ -199,6 +205,11 @@ def update_supplier(supplier_id):
             ).first()
             if existing_supplier:
                 return jsonify({'error': 'Supplier with this name already exists'}), 400
+            if data['name'] != supplier.name:
+                # Keep the denormalized name on linked products in step
+                Product.query.filter(Product.supplier_id == supplier.id).update(
+                    {Product.supplier: data['name']}, synchronize_session=False
+                )
             supplier.name = data['name']
         
         if 'contact_person' in data:
@@ -253,7 +264,7 @@ def delete_supplier(supplier_id):
         supplier = Supplier.query.get_or_404(supplier_id)
         
         # Check if supplier has products
-        products_count = Product.query.filter_by(supplier=supplier.name).count()
+        products_count = Product.query.filter_by(supplier_id=supplier.id).count()
         if products_count > 0:
             return jsonify({
                 'error': f'Cannot delete supplier with {products_count} products. Please reassign or delete products first.'
@@ -285,7 +296,7 @@ def get_supplier_products(supplier_id):
         active_only = request.args.get('active_only', 'false').lower() == 'true'
         
         # Query supplier's products
-        query = Product.query.filter_by(supplier=supplier.name)
+        query = Product.query.filter_by(supplier_id=supplier.id)
         
         if active_only:
             query = query.filter(Product.is_active == True)
@@ -346,14 +357,16 @@ def get_supplier_stats():
         
         # Suppliers with products
         suppliers_with_products = db.session.query(
+            Supplier.id,
             Supplier.name,
             db.func.count(Product.id).label('product_count')
-        ).outerjoin(Product, Supplier.name == Product.supplier).group_by(
-            Supplier.name
-        ).having(db.func.count(Product.id) > 0).all()
+        ).join(Product, Product.supplier_id == Supplier.id).group_by(
+            Supplier.id, Supplier.name
+        ).all()
         
         suppliers_data = [
             {
+                'id': stat.id,
                 'name': stat.name,
                 'product_count': stat.product_count
             } for stat in suppliers_with_products
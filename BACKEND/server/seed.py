@@ -115,8 +115,9 @@ def seed_database():
     
     db.session.commit()
     
-    # Get categories for foreign key references
+    # Get categories and suppliers for foreign key references
     categories = {cat.name: cat for cat in Category.query.all()}
+    suppliers = {supplier.name: supplier for supplier in Supplier.query.all()}
     
     # Create products
     print("Creating products...")
@@ -748,10 +749,11 @@ def seed_database():
         }
     ]
     
-    # Process products to add category_id
+    # Process products to add category_id and supplier_id
     products_data = []
     for product_data in products_data_raw:
         product_data['category_id'] = categories[product_data['category']].id
+        product_data['supplier_id'] = suppliers[product_data['supplier']].id
         products_data.append(product_data)
     
     for product_data in products_data:
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Recompute customer categories (VIP / Regular / New) from RFM values.
+
+Runs a dry run by default and prints the diff; pass --apply to write the
+changes. Intended to be scheduled (e.g. nightly cron):
+
+  python segment_customers.py --apply
+"""
+
+import argparse
+
+from app import app
+from utils.customer_segmentation import segment_customers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute customer categories from RFM values")
+    parser.add_argument("--apply", action="store_true", help="write changes (default is a dry run)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="rows per bulk update")
+    args = parser.parse_args()
+
+    with app.app_context():
+        result = segment_customers(dry_run=not args.apply, chunk_size=args.chunk_size)
+
+    print("Segmentation complete:" if args.apply else "Segmentation dry run:")
+    print(f"- customers_scanned: {result['customers_scanned']}")
+    print(f"- customers_changed: {result['customers_changed']}")
+    for transition, count in sorted(result["transitions"].items()):
+        print(f"  {transition}: {count}")
+    for change in result["changes"]:
+        print(
+            f"  #{change['customer_id']} {change['name']}: {change['old_category']} -> {change['new_category']}"
+            f" (R={change['recency_days']}d F={change['frequency']} M={change['monetary']:.2f})"
+        )
+
+
+if __name__ == "__main__":
+    main()
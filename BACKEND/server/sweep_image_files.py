@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Delete uploaded image files that no product image references.
+
+Deleting or replacing an image keeps a file that was written in the last
+IMAGE_RELEASE_GRACE seconds (an identical upload may not have committed its
+row yet). Run this periodically, e.g. hourly from cron, to remove those
+files once they are old enough, along with files from failed uploads:
+
+  python sweep_image_files.py --dry-run
+"""
+
+import argparse
+
+from app import app
+from utils.images import sweep_unreferenced_images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete unreferenced content-addressed image files")
+    parser.add_argument("--older-than", type=int, default=None,
+                        help="only files older than this many seconds (default IMAGE_RELEASE_GRACE)")
+    parser.add_argument("--dry-run", action="store_true", help="list the files without deleting them")
+    args = parser.parse_args()
+
+    with app.app_context():
+        swept = sweep_unreferenced_images(older_than=args.older_than, dry_run=args.dry_run)
+
+    for image_url in swept:
+        print(image_url)
+    print(f"{'Would delete' if args.dry_run else 'Deleted'} {len(swept)} unreferenced image(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,98 +8,220 @@ It expects filenames like:
 And stores image_url in DB as:
   uploads/<filename>
 Which matches Flask static: /static/uploads/<filename>
+
+The directory is scanned once, existing products and images are loaded with
+a few set queries and missing rows are written with one bulk insert.
+--checksum additionally validates every file on a thread pool and records
+its SHA-256 as content_hash (informational for these legacy names: deleting
+an image only shares files by hash when they are stored under their hash):
+
+  python sync_product_images.py --checksum --workers 8
 """
 
+import argparse
+import hashlib
 import os
 import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from app import app
 from extensions import db
 from models import Product, ProductImage
+from utils.images import HASH_CHUNK_SIZE, is_content_addressed, validate_image_file
 
 
 UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "uploads")
 FILENAME_RE = re.compile(r"^product_(\d+)_", re.IGNORECASE)
-
-
-def sync_images() -> dict:
+IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
+
+# Keeps IN lists well under database parameter limits
+QUERY_CHUNK_SIZE = 500
+PROGRESS_EVERY = 1000
+
+
+def chunked(items, size=QUERY_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def progress(stage, done, total):
+    if done == total or done % PROGRESS_EVERY == 0:
+        print(f"  {stage}: {done}/{total}", file=sys.stderr, flush=True)
+
+
+def scan_uploads(uploads_dir):
+    """
+    One pass over the uploads directory.
+
+    Returns:
+        tuple: ({filename: product_id} for candidate images, skip counters)
+    """
+    candidates = {}
+    skipped = {"skipped_no_match": 0, "skipped_renditions": 0, "skipped_content_addressed": 0}
+
+    with os.scandir(uploads_dir) as entries:
+        for entry in entries:
+            # Temporary upload files start with a dot
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+
+            extension = entry.name.rsplit(".", 1)[-1].lower()
+            # Thumbnail/WebP renditions live next to the originals but are not images of their own
+            if extension == "webp":
+                skipped["skipped_renditions"] += 1
+                continue
+            # Uploads stored by hash are always created together with their rows
+            if is_content_addressed(entry.name):
+                skipped["skipped_content_addressed"] += 1
+                continue
+
+            m = FILENAME_RE.match(entry.name)
+            if not m or extension not in IMAGE_EXTENSIONS:
+                skipped["skipped_no_match"] += 1
+                continue
+            candidates[entry.name] = int(m.group(1))
+
+    return candidates, skipped
+
+
+def checksum_file(path):
+    """
+    SHA-256 of an image file, or None if it is not a readable image.
+    """
+    if not validate_image_file(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checksum_files(filenames, workers):
+    """
+    {filename: sha256 or None} for files under UPLOADS_DIR, computed on a thread pool.
+    """
+    filenames = sorted(filenames)
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        paths = (os.path.join(UPLOADS_DIR, filename) for filename in filenames)
+        for done, (filename, content_hash) in enumerate(zip(filenames, executor.map(checksum_file, paths)), 1):
+            results[filename] = content_hash
+            progress("checksum", done, len(filenames))
+    return results
+
+
+def sync_images(checksum=False, workers=4) -> dict:
     if not os.path.isdir(UPLOADS_DIR):
         raise RuntimeError(f"Uploads directory not found: {UPLOADS_DIR}")
 
-    created = 0
-    skipped_no_match = 0
-    skipped_missing_product = 0
-    already_present = 0
-    primary_set = 0
-
-    # Track if product already has any images (to set primary on first)
-    existing_primary_by_product = {
-        pid for (pid,) in db.session.query(ProductImage.product_id).filter(ProductImage.is_primary.is_(True)).all()
-    }
-
-    for filename in sorted(os.listdir(UPLOADS_DIR)):
-        m = FILENAME_RE.match(filename)
-        if not m:
-            skipped_no_match += 1
-            continue
-
-        product_id = int(m.group(1))
-
-        product = db.session.get(Product, product_id)
-        if not product:
-            skipped_missing_product += 1
-            continue
-
-        image_url = f"uploads/{filename}"
-
-        existing = ProductImage.query.filter_by(product_id=product_id, image_url=image_url).first()
-        if existing:
-            already_present += 1
-            continue
-
-        is_primary = product_id not in existing_primary_by_product and (
-            ProductImage.query.filter_by(product_id=product_id).count() == 0
-        )
-        if is_primary:
-            existing_primary_by_product.add(product_id)
-            primary_set += 1
-
-        db.session.add(
-            ProductImage(
-                product_id=product_id,
-                image_url=image_url,
-                is_primary=is_primary,
-                alt_text=getattr(product, "name", None) or getattr(product, "product_name", None),
+    candidates, result = scan_uploads(UPLOADS_DIR)
+    print(f"  scanned: {len(candidates)} candidate files", file=sys.stderr, flush=True)
+
+    product_names = {}
+    for ids in chunked(set(candidates.values())):
+        product_names.update(db.session.query(Product.id, Product.name).filter(Product.id.in_(ids)).all())
+
+    existing_urls = set()
+    products_with_images = set()
+    for ids in chunked(product_names):
+        for product_id, image_url in db.session.query(ProductImage.product_id, ProductImage.image_url).filter(
+            ProductImage.product_id.in_(ids)
+        ):
+            existing_urls.add(image_url)
+            products_with_images.add(product_id)
+
+    missing = {}
+    result["skipped_missing_product"] = 0
+    result["already_present"] = 0
+    for filename, product_id in candidates.items():
+        if product_id not in product_names:
+            result["skipped_missing_product"] += 1
+        elif f"uploads/{filename}" in existing_urls:
+            result["already_present"] += 1
+        else:
+            missing[filename] = product_id
+
+    hashes = {}
+    result["invalid"] = 0
+    result["hashes_recorded"] = 0
+    if checksum:
+        # Rows already present but never hashed are filled in too
+        unhashed = {
+            image_url[len("uploads/"):]: image_id
+            for image_id, image_url in db.session.query(ProductImage.image_id, ProductImage.image_url).filter(
+                ProductImage.content_hash.is_(None),
+                ProductImage.image_url.like("uploads/%")
             )
-        )
-        created += 1
-
-    db.session.commit()
+            if os.path.isfile(os.path.join(UPLOADS_DIR, image_url[len("uploads/"):]))
+        }
+        hashes = checksum_files(set(missing) | set(unhashed), workers)
+
+        for filename in [filename for filename in missing if hashes[filename] is None]:
+            del missing[filename]
+            result["invalid"] += 1
+
+        updates = [
+            {"b_image_id": image_id, "b_content_hash": hashes[filename]}
+            for filename, image_id in unhashed.items() if hashes[filename]
+        ]
+        if updates:
+            images = ProductImage.__table__
+            db.session.execute(
+                images.update()
+                .where(images.c.image_id == db.bindparam("b_image_id"))
+                .values(content_hash=db.bindparam("b_content_hash")),
+                updates
+            )
+        result["hashes_recorded"] = len(updates)
+
+    # Sorted so a product's first new image (by name) becomes its primary
+    rows = []
+    for filename in sorted(missing):
+        product_id = missing[filename]
+        rows.append({
+            "product_id": product_id,
+            "image_url": f"uploads/{filename}",
+            "content_hash": hashes.get(filename),
+            "is_primary": product_id not in products_with_images,
+            "alt_text": product_names[product_id],
+        })
+        products_with_images.add(product_id)
+
+    if rows:
+        db.session.execute(ProductImage.__table__.insert(), rows)
+    result["created"] = len(rows)
+    result["primary_set"] = sum(1 for row in rows if row["is_primary"])
 
     # Ensure every product with images has exactly one primary (best-effort)
-    products_with_images = db.session.query(ProductImage.product_id).distinct().all()
-    for (pid,) in products_with_images:
-        has_primary = ProductImage.query.filter_by(product_id=pid, is_primary=True).first()
-        if not has_primary:
-            first = ProductImage.query.filter_by(product_id=pid).order_by(ProductImage.image_id.asc()).first()
-            if first:
-                first.is_primary = True
-                primary_set += 1
+    has_primary = db.session.query(ProductImage.product_id).filter(ProductImage.is_primary.is_(True))
+    first_images = [
+        image_id for (image_id,) in db.session.query(db.func.min(ProductImage.image_id))
+        .filter(ProductImage.product_id.notin_(has_primary))
+        .group_by(ProductImage.product_id)
+    ]
+    for image_ids in chunked(first_images):
+        db.session.query(ProductImage).filter(ProductImage.image_id.in_(image_ids)).update(
+            {ProductImage.is_primary: True}, synchronize_session=False
+        )
+    result["primary_set"] += len(first_images)
+
     db.session.commit()
 
-    return {
-        "created": created,
-        "already_present": already_present,
-        "skipped_no_match": skipped_no_match,
-        "skipped_missing_product": skipped_missing_product,
-        "primary_set": primary_set,
-        "uploads_dir": UPLOADS_DIR,
-    }
+    result["uploads_dir"] = UPLOADS_DIR
+    return result
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Sync product images from static/uploads into the database")
+    parser.add_argument("--checksum", action="store_true", help="validate files and record their SHA-256")
+    parser.add_argument("--workers", type=int, default=4, help="checksum worker threads (default 4)")
+    args = parser.parse_args()
+
     with app.app_context():
-        result = sync_images()
+        result = sync_images(checksum=args.checksum, workers=args.workers)
         print("Sync complete:")
         for k, v in result.items():
             print(f"- {k}: {v}")
@@ -107,4 +229,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,147 @@
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event, inspect
+import logging
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'audit_capture_pending'
+
+
+def to_audit_value(value):
+    """Convert a column value into something JSON serializable"""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def get_audited_columns(obj):
+    """
+    Column attributes of obj that should be captured, or None if its model is not audited.
+
+    AUDITED_MODELS maps table names to a list of attribute names, or None for
+    every column; AUDIT_IGNORED_COLUMNS are always skipped.
+    """
+    table_name = getattr(obj, '__tablename__', None)
+    audited_models = current_app.config.get('AUDITED_MODELS') or {}
+    if table_name not in audited_models:
+        return None
+
+    ignored = set(current_app.config.get('AUDIT_IGNORED_COLUMNS') or ())
+    columns = [attr.key for attr in inspect(obj).mapper.column_attrs if attr.key not in ignored]
+    allowed = audited_models[table_name]
+    if allowed is not None:
+        columns = [key for key in columns if key in allowed]
+    return columns
+
+
+def get_request_context():
+    """(user_id, ip_address, user_agent) of the current request, if any"""
+    if not has_request_context():
+        return None, None, None
+
+    user_id = None
+    try:
+        from flask_jwt_extended import get_jwt_identity
+        identity = get_jwt_identity()
+        if isinstance(identity, dict):
+            identity = identity.get('id')
+        user_id = int(identity) if identity is not None else None
+    except Exception:
+        # No verified JWT for this request (e.g. login or public callbacks)
+        user_id = None
+
+    return user_id, request.remote_addr, request.headers.get('User-Agent')
+
+
+def collect_changes(session, flush_context, instances):
+    """before_flush: record old/new values of audited objects while history is still available"""
+    if not has_app_context():
+        return
+
+    # Each flush starts over: rows collected by a flush that failed were never written
+    pending = session.info[PENDING_KEY] = []
+
+    for obj in session.new:
+        columns = get_audited_columns(obj)
+        if columns is not None:
+            pending.append(('CREATE', obj, columns, None))
+
+    for obj in session.dirty:
+        columns = get_audited_columns(obj)
+        if columns is None or not session.is_modified(obj, include_collections=False):
+            continue
+        state = inspect(obj)
+        old_values = {}
+        new_values = {}
+        for key in columns:
+            history = state.attrs[key].history
+            if not history.has_changes():
+                continue
+            old_values[key] = to_audit_value(history.deleted[0]) if history.deleted else None
+            new_values[key] = to_audit_value(history.added[0]) if history.added else None
+        if new_values:
+            pending.append(('UPDATE', obj, old_values, new_values))
+
+    for obj in session.deleted:
+        columns = get_audited_columns(obj)
+        if columns is not None:
+            loaded = inspect(obj).dict
+            old_values = {key: to_audit_value(loaded.get(key)) for key in columns}
+            pending.append(('DELETE', obj, old_values, None))
+
+
+def write_changes(session, flush_context):
+    """after_flush: insert all collected audit rows with one statement in the flush's transaction"""
+    pending = session.info.pop(PENDING_KEY, None)
+    if not pending:
+        return
+
+    from models import AuditLog
+
+    user_id, ip_address, user_agent = get_request_context()
+    created_at = datetime.now()
+
+    rows = []
+    for action, obj, first, second in pending:
+        if action == 'CREATE':
+            # Primary keys and defaults are only known once the INSERT ran; read
+            # loaded values only so no SELECT is emitted in the middle of a flush
+            loaded = inspect(obj).dict
+            old_values, new_values = None, {key: to_audit_value(loaded.get(key)) for key in first}
+        else:
+            old_values, new_values = first, second
+        rows.append({
+            'user_id': user_id,
+            'action': action,
+            'table_name': obj.__tablename__,
+            'record_id': inspect(obj).dict.get('id'),
+            'old_values': old_values,
+            'new_values': new_values,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'created_at': created_at
+        })
+
+    session.connection().execute(AuditLog.__table__.insert(), rows)
+
+
+def discard_changes(session, previous_transaction=None):
+    """Drop collected changes once the outermost transaction rolls back"""
+    # Savepoint and failed-flush rollbacks leave the outer transaction in place
+    if not session.in_transaction():
+        session.info.pop(PENDING_KEY, None)
+
+
+def init_audit_capture(session):
+    """Register the audit listeners on a session (or scoped_session / sessionmaker)"""
+    if not event.contains(session, 'before_flush', collect_changes):
+        event.listen(session, 'before_flush', collect_changes)
+        event.listen(session, 'after_flush', write_changes)
+        event.listen(session, 'after_soft_rollback', discard_changes)
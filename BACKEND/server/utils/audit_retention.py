@@ -0,0 +1,218 @@
+from datetime import datetime
+from flask import current_app
+from extensions import db
+from models import AuditLog
+import gzip
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'index.jsonl'
+
+# Upper bound for a caller-supplied batch_size; larger batches defeat the point of batching
+MAX_PURGE_BATCH_SIZE = 50000
+
+
+def get_archive_folder():
+    """Directory holding the archived audit files, created on demand"""
+    folder = current_app.config['AUDIT_ARCHIVE_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def serialize_audit_row(row):
+    """JSON-ready dict of an audit_logs row"""
+    return {
+        'id': row.id,
+        'user_id': row.user_id,
+        'action': row.action,
+        'table_name': row.table_name,
+        'record_id': row.record_id,
+        'old_values': row.old_values,
+        'new_values': row.new_values,
+        'ip_address': row.ip_address,
+        'user_agent': row.user_agent,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    }
+
+
+def archive_rows(rows):
+    """
+    Append rows to gzip-compressed monthly JSONL files and record them in the index.
+
+    Each call appends a new gzip member to audit-YYYY-MM.jsonl.gz (readers see
+    one continuous stream) and one index line per month describing the id and
+    date range written.
+
+    Returns:
+        list: Index entries written
+    """
+    folder = get_archive_folder()
+
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(row.created_at.strftime('%Y-%m'), []).append(row)
+
+    entries = []
+    for month, month_rows in sorted(by_month.items()):
+        filename = f'audit-{month}.jsonl.gz'
+        payload = ''.join(json.dumps(serialize_audit_row(row)) + '\n' for row in month_rows)
+        with open(os.path.join(folder, filename), 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as archive:
+                archive.write(payload.encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+        entries.append({
+            'file': filename,
+            'month': month,
+            'count': len(month_rows),
+            'first_id': month_rows[0].id,
+            'last_id': month_rows[-1].id,
+            'min_created_at': min(row.created_at for row in month_rows).isoformat(),
+            'max_created_at': max(row.created_at for row in month_rows).isoformat(),
+            'archived_at': datetime.now().isoformat()
+        })
+
+    with open(os.path.join(folder, INDEX_FILENAME), 'a', encoding='utf-8') as index:
+        for entry in entries:
+            index.write(json.dumps(entry) + '\n')
+        index.flush()
+        os.fsync(index.fileno())
+
+    return entries
+
+
+def purge_audit_logs(cutoff, archive=True, batch_size=None):
+    """
+    Delete audit logs older than cutoff in bounded batches.
+
+    Each batch of at most batch_size rows (oldest ids first) is archived
+    first, then deleted by id and committed, so locks and WAL per transaction
+    stay small no matter how many rows are due. A batch is only deleted after
+    its archive file has been written and synced.
+
+    Args:
+        cutoff (datetime): Rows created before this moment are removed
+        archive (bool): Write rows to the compressed archive before deleting
+        batch_size (int): Rows per batch, 1 to MAX_PURGE_BATCH_SIZE
+            (defaults to AUDIT_RETENTION_BATCH_SIZE)
+
+    Returns:
+        dict: Number of rows deleted and batches run, plus the archive files touched
+
+    Raises:
+        ValueError: If batch_size is not a whole number in range
+    """
+    if batch_size is None:
+        batch_size = current_app.config['AUDIT_RETENTION_BATCH_SIZE']
+    if isinstance(batch_size, bool) or not isinstance(batch_size, int) or not 1 <= batch_size <= MAX_PURGE_BATCH_SIZE:
+        raise ValueError(f'batch_size must be a whole number from 1 to {MAX_PURGE_BATCH_SIZE}')
+    table = AuditLog.__table__
+
+    deleted = 0
+    batches = 0
+    files = set()
+
+    while True:
+        rows = db.session.execute(
+            db.select(table)
+            .where(table.c.created_at < cutoff)
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        if archive:
+            files.update(entry['file'] for entry in archive_rows(rows))
+
+        ids = [row.id for row in rows]
+        deleted += db.session.execute(table.delete().where(table.c.id.in_(ids))).rowcount
+        db.session.commit()
+        batches += 1
+
+    if deleted:
+        logger.info(f"Purged {deleted} audit logs older than {cutoff.isoformat()} in {batches} batches")
+
+    return {
+        'deleted_count': deleted,
+        'batches': batches,
+        'archived': archive,
+        'archive_files': sorted(files)
+    }
+
+
+def read_archive_index():
+    """All entries of the archive index, oldest first"""
+    path = os.path.join(get_archive_folder(), INDEX_FILENAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as index:
+        return [json.loads(line) for line in index if line.strip()]
+
+
+def search_audit_archive(start_date=None, end_date=None, user_id=None, action=None,
+                         table_name=None, record_id=None, limit=100):
+    """
+    Search archived audit logs.
+
+    The index is used to open only the monthly files whose date range overlaps
+    the requested window; matching rows are streamed from the gzip files.
+
+    Args:
+        start_date (datetime): Include rows created at or after this moment
+        end_date (datetime): Include rows created before this moment
+        limit (int): Maximum number of rows returned
+
+    Returns:
+        dict: Matching logs and the files that were scanned
+    """
+    files = []
+    for entry in read_archive_index():
+        if start_date and entry['max_created_at'] < start_date.isoformat():
+            continue
+        if end_date and entry['min_created_at'] >= end_date.isoformat():
+            continue
+        if entry['file'] not in files:
+            files.append(entry['file'])
+
+    folder = get_archive_folder()
+    logs = []
+    seen = set()
+    truncated = False
+
+    for filename in sorted(files):
+        with gzip.open(os.path.join(folder, filename), 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                log = json.loads(line)
+                # A batch can be archived twice if deletion failed after archiving
+                if log['id'] in seen:
+                    continue
+                if start_date and log['created_at'] < start_date.isoformat():
+                    continue
+                if end_date and log['created_at'] >= end_date.isoformat():
+                    continue
+                if user_id is not None and log['user_id'] != user_id:
+                    continue
+                if action and action not in (log['action'] or ''):
+                    continue
+                if table_name and log['table_name'] != table_name:
+                    continue
+                if record_id is not None and log['record_id'] != record_id:
+                    continue
+                if len(logs) >= limit:
+                    truncated = True
+                    break
+                seen.add(log['id'])
+                logs.append(log)
+        if truncated:
+            break
+
+    return {
+        'logs': logs,
+        'files_scanned': sorted(files),
+        'truncated': truncated
+    }
@@ -0,0 +1,183 @@
+from datetime import datetime
+import atexit
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+# Every queued row carries the same keys so batches can be inserted with executemany
+AUDIT_COLUMNS = ('user_id', 'action', 'table_name', 'record_id', 'old_values', 'new_values', 'ip_address', 'user_agent')
+
+
+class AuditWriter:
+    """
+    Buffered audit log pipeline.
+
+    Requests only enqueue audit rows; a background thread drains the queue and
+    bulk-inserts AuditLog rows in batches on its own connection, so auditing
+    never commits (or waits on) the caller's unit of work. The queue is
+    bounded and AUDIT_OVERFLOW_POLICY decides what happens when it is full:
+
+        drop_oldest  discard the oldest queued event to make room (default)
+        drop_newest  discard the new event
+        block        wait up to AUDIT_ENQUEUE_TIMEOUT seconds, then drop it
+
+    Pending events are flushed at interpreter exit. Set AUDIT_ASYNC_ENABLED to
+    False (e.g. in tests or one-off scripts) to write each event immediately.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._batches = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AUDIT_ASYNC_ENABLED', True)
+        app.config.setdefault('AUDIT_QUEUE_MAX_SIZE', 10000)
+        app.config.setdefault('AUDIT_BATCH_SIZE', 200)
+        app.config.setdefault('AUDIT_FLUSH_INTERVAL', 1.0)
+        app.config.setdefault('AUDIT_OVERFLOW_POLICY', 'drop_oldest')
+        app.config.setdefault('AUDIT_ENQUEUE_TIMEOUT', 0.5)
+
+        if app.config['AUDIT_OVERFLOW_POLICY'] not in OVERFLOW_POLICIES:
+            raise ValueError(f"AUDIT_OVERFLOW_POLICY must be one of {', '.join(OVERFLOW_POLICIES)}")
+
+        self.app = app
+        self._queue = queue.Queue(maxsize=app.config['AUDIT_QUEUE_MAX_SIZE'])
+        app.extensions['audit_writer'] = self
+        atexit.register(self.shutdown)
+
+    def enqueue(self, **values):
+        """
+        Queue one audit row (keyword arguments are AuditLog columns).
+
+        Returns:
+            bool: True if the event was queued or written, False if it was dropped
+        """
+        values = dict({column: values.get(column) for column in AUDIT_COLUMNS},
+                      created_at=values.get('created_at') or datetime.now())
+
+        if not self.app.config['AUDIT_ASYNC_ENABLED']:
+            return self._write([values])
+
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait(values)
+            return True
+        except queue.Full:
+            pass
+
+        policy = self.app.config['AUDIT_OVERFLOW_POLICY']
+        if policy == 'block':
+            try:
+                self._queue.put(values, timeout=self.app.config['AUDIT_ENQUEUE_TIMEOUT'])
+                return True
+            except queue.Full:
+                pass
+        elif policy == 'drop_oldest':
+            try:
+                self._queue.get_nowait()
+                self._dropped += 1
+                self._queue.put_nowait(values)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+
+        self._dropped += 1
+        logger.warning('Audit queue full, dropping audit event')
+        return False
+
+    def flush(self):
+        """Write everything currently queued from the calling thread"""
+        if self._queue is None:
+            return
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                break
+            self._write(batch)
+
+    def shutdown(self, timeout=5.0):
+        """Stop the background thread and flush pending events"""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        """Counters exposed by /audit/stats"""
+        return {
+            'async_enabled': bool(self.app and self.app.config['AUDIT_ASYNC_ENABLED']),
+            'running': bool(self._thread and self._thread.is_alive() and self._pid == os.getpid()),
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'queue_max_size': self._queue.maxsize if self._queue is not None else 0,
+            'overflow_policy': self.app.config['AUDIT_OVERFLOW_POLICY'] if self.app else None,
+            'written': self._written,
+            'dropped': self._dropped,
+            'failed': self._failed,
+            'batches': self._batches
+        }
+
+    def _ensure_started(self):
+        """Start the writer thread lazily, and again in forked worker processes"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                # Events queued in the parent belong to the parent's writer
+                self._queue = queue.Queue(maxsize=self.app.config['AUDIT_QUEUE_MAX_SIZE'])
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._drain(block=True)
+            if batch:
+                self._write(batch)
+
+    def _drain(self, block):
+        """Collect up to AUDIT_BATCH_SIZE events, waiting up to AUDIT_FLUSH_INTERVAL for the first"""
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.app.config['AUDIT_FLUSH_INTERVAL']))
+            while len(batch) < self.app.config['AUDIT_BATCH_SIZE']:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch):
+        """Insert a batch of audit rows in one statement on a dedicated connection"""
+        from extensions import db
+        from models import AuditLog
+
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(AuditLog.__table__.insert(), batch)
+            self._written += len(batch)
+            self._batches += 1
+            return True
+        except Exception:
+            self._failed += len(batch)
+            logger.exception(f'Failed to write {len(batch)} audit events')
+            return False
@@ -0,0 +1,229 @@
+from concurrent.futures import ThreadPoolExecutor
+from extensions import db
+from models import Product, ProductImage
+from utils.images import store_image_stream
+import logging
+import os
+import re
+import threading
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# "5012345678900.jpg", "5012345678900_back.jpg" and "42-front.png" all name their product by the leading key
+ARCHIVE_KEY_RE = re.compile(r'^([^_\-\s]+)')
+
+# Keeps IN lists well under database parameter limits
+QUERY_CHUNK_SIZE = 500
+
+
+def archive_product_key(member_name):
+    """Barcode or product id a file in the archive is named after"""
+    stem = os.path.splitext(os.path.basename(member_name))[0]
+    m = ARCHIVE_KEY_RE.match(stem)
+    return m.group(1) if m else None
+
+
+def resolve_archive_products(keys):
+    """
+    Map archive keys to products with one barcode query and one id query.
+
+    A key matching a barcode wins over the same key read as a product id.
+
+    Returns:
+        dict: key -> (product_id, product_name)
+    """
+    keys = list(set(keys))
+    resolved = {}
+    for start in range(0, len(keys), QUERY_CHUNK_SIZE):
+        chunk = keys[start:start + QUERY_CHUNK_SIZE]
+        for product_id, name, barcode in db.session.query(Product.id, Product.name, Product.barcode).filter(
+            Product.barcode.in_(chunk)
+        ):
+            resolved[barcode] = (product_id, name)
+
+    ids = {int(key): key for key in keys if key not in resolved and key.isdigit()}
+    id_list = list(ids)
+    for start in range(0, len(id_list), QUERY_CHUNK_SIZE):
+        for product_id, name in db.session.query(Product.id, Product.name).filter(
+            Product.id.in_(id_list[start:start + QUERY_CHUNK_SIZE])
+        ):
+            resolved[ids[product_id]] = (product_id, name)
+    return resolved
+
+
+class ArchiveExtractor:
+    """Stores archive members from worker threads, each with its own handle on the zip file"""
+
+    def __init__(self, archive_path, upload_folder, max_file_size):
+        self.archive_path = archive_path
+        self.upload_folder = upload_folder
+        self.max_file_size = max_file_size
+        self._local = threading.local()
+        self._archives = []
+        self._lock = threading.Lock()
+
+    def _archive(self):
+        archive = getattr(self._local, 'archive', None)
+        if archive is None:
+            archive = self._local.archive = zipfile.ZipFile(self.archive_path)
+            with self._lock:
+                self._archives.append(archive)
+        return archive
+
+    def store(self, member):
+        """(image_url, content_hash, None) or (None, None, error message)"""
+        try:
+            with self._archive().open(member) as stream:
+                image_url, content_hash = store_image_stream(
+                    stream,
+                    member.filename.rsplit('.', 1)[1],
+                    self.upload_folder,
+                    max_bytes=self.max_file_size,
+                    validate=True
+                )
+            return image_url, content_hash, None
+        except ValueError as e:
+            return None, None, str(e)
+        except Exception as e:
+            logger.warning(f'Failed to extract {member.filename}: {e}')
+            return None, None, 'File could not be extracted'
+
+    def close(self):
+        for archive in self._archives:
+            archive.close()
+
+
+def import_image_archive(archive_path, upload_folder, allowed_extensions, max_images_per_product,
+                         max_files=2000, max_file_size=10 * 1024 * 1024, workers=4, stored_files=None):
+    """
+    Attach the images in a zip archive to the products they are named after.
+
+    Files are named by barcode or product id (anything after a '_', '-' or
+    space is ignored). Products are resolved with two IN queries, members are
+    decompressed, validated and stored by content hash on a thread pool
+    straight from the archive, and all new rows are added with one bulk
+    insert. A product's first image becomes its primary.
+
+    Args:
+        archive_path: Zip file on disk
+        upload_folder: Absolute uploads directory
+        allowed_extensions: Accepted image extensions
+        max_images_per_product: Files beyond a product's limit are rejected
+        stored_files: Optional list that receives (image_url, content_hash) for
+            every file written, so the caller can release them if the
+            transaction fails or the file was rejected
+
+    Returns:
+        tuple: (per-file results in archive order, new image ids). Nothing is committed.
+
+    Raises:
+        ValueError: If the file is not a zip archive or has too many files
+    """
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            members = [member for member in archive.infolist() if not member.is_dir()]
+    except zipfile.BadZipFile:
+        raise ValueError('File is not a valid zip archive')
+
+    if len(members) > max_files:
+        raise ValueError(f'Archive has {len(members)} files; at most {max_files} are allowed')
+
+    results = []
+    candidates = []
+    for member in members:
+        basename = os.path.basename(member.filename)
+        result = {'filename': member.filename}
+        results.append(result)
+
+        # macOS resource forks and hidden files ride along in many archives
+        if basename.startswith('.') or member.filename.startswith('__MACOSX/'):
+            result['status'] = 'skipped'
+        elif '.' not in basename or basename.rsplit('.', 1)[1].lower() not in allowed_extensions:
+            result.update(status='error', error='File type not allowed')
+        elif member.file_size > max_file_size:
+            result.update(status='error', error=f'File is larger than {max_file_size} bytes')
+        elif member.flag_bits & 0x1:
+            result.update(status='error', error='Encrypted files are not supported')
+        else:
+            result['key'] = archive_product_key(basename)
+            candidates.append((member, result))
+
+    products = resolve_archive_products(result['key'] for member, result in candidates if result['key'])
+    to_store = []
+    for member, result in candidates:
+        key = result.pop('key')
+        if not key:
+            result.update(status='error', error='File name must start with a barcode or product id')
+        elif key not in products:
+            result.update(status='error', error=f'No product with barcode or id {key}')
+        else:
+            result['product_id'] = products[key][0]
+            to_store.append((member, result))
+
+    product_names = dict(products.values())
+    product_ids = {result['product_id'] for member, result in to_store}
+    image_counts = {}
+    primary_products = set()
+    existing_hashes = set()
+    product_id_list = list(product_ids)
+    for start in range(0, len(product_id_list), QUERY_CHUNK_SIZE):
+        chunk = product_id_list[start:start + QUERY_CHUNK_SIZE]
+        for product_id, content_hash, is_primary in db.session.query(
+            ProductImage.product_id, ProductImage.content_hash, ProductImage.is_primary
+        ).filter(ProductImage.product_id.in_(chunk)):
+            image_counts[product_id] = image_counts.get(product_id, 0) + 1
+            if is_primary:
+                primary_products.add(product_id)
+            if content_hash:
+                existing_hashes.add((product_id, content_hash))
+
+    extractor = ArchiveExtractor(archive_path, upload_folder, max_file_size)
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk-images') as executor:
+            stored = list(executor.map(extractor.store, [member for member, result in to_store]))
+    finally:
+        extractor.close()
+
+    if stored_files is not None:
+        stored_files.extend((image_url, content_hash) for image_url, content_hash, error in stored if image_url)
+
+    rows = []
+    row_results = []
+    for (member, result), (image_url, content_hash, error) in zip(to_store, stored):
+        product_id = result['product_id']
+        if error:
+            result.update(status='error', error=error)
+            continue
+        if (product_id, content_hash) in existing_hashes:
+            result['status'] = 'duplicate'
+            continue
+        if image_counts.get(product_id, 0) >= max_images_per_product:
+            result.update(status='error', error=f'Maximum {max_images_per_product} images per product reached')
+            continue
+
+        existing_hashes.add((product_id, content_hash))
+        image_counts[product_id] = image_counts.get(product_id, 0) + 1
+        is_primary = product_id not in primary_products
+        primary_products.add(product_id)
+        rows.append({
+            'product_id': product_id,
+            'image_url': image_url,
+            'content_hash': content_hash,
+            'is_primary': is_primary,
+            'alt_text': product_names[product_id]
+        })
+        result.update(status='created', image_url=image_url, is_primary=is_primary)
+        row_results.append(result)
+
+    image_ids = []
+    if rows:
+        image_ids = list(db.session.scalars(
+            db.insert(ProductImage).returning(ProductImage.image_id, sort_by_parameter_order=True),
+            rows
+        ))
+        for result, image_id in zip(row_results, image_ids):
+            result['image_id'] = image_id
+
+    return results, image_ids
+
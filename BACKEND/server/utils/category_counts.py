@@ -0,0 +1,139 @@
+from flask import current_app
+from sqlalchemy import event, inspect
+from extensions import db
+from models import Product
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'category_counts_changed'
+
+_lock = threading.Lock()
+_counts = None
+_known_ids = None
+_loaded_at = 0.0
+_generation = 0
+
+
+def query_category_product_counts(category_ids=None):
+    """
+    Product counts per category from one grouped query.
+
+    Returns:
+        dict: category_id -> {'total': int, 'active': int}
+    """
+    query = db.session.query(
+        Product.category_id,
+        db.func.count(Product.id),
+        db.func.sum(db.case((Product.is_active == True, 1), else_=0))
+    ).filter(Product.category_id.isnot(None))
+    if category_ids is not None:
+        if not category_ids:
+            return {}
+        query = query.filter(Product.category_id.in_(category_ids))
+
+    return {
+        category_id: {'total': total, 'active': int(active or 0)}
+        for category_id, total, active in query.group_by(Product.category_id).all()
+    }
+
+
+def get_category_product_counts(category_ids=None):
+    """
+    Product counts per category, cached in process.
+
+    Without category_ids every category is counted. With category_ids (a
+    listing page) only the ids the cache does not cover yet are queried and
+    merged in, and just those categories are returned.
+
+    The cache is dropped when a transaction that adds, removes, re-categorizes
+    or (de)activates products commits, and expires after
+    CATEGORY_COUNTS_CACHE_TTL seconds to pick up writes made by other
+    workers. A TTL of 0 disables caching.
+    """
+    global _counts, _known_ids, _loaded_at
+
+    ttl = current_app.config.get('CATEGORY_COUNTS_CACHE_TTL', 60)
+    if not ttl:
+        return query_category_product_counts(category_ids)
+
+    with _lock:
+        if _counts is not None and time.monotonic() - _loaded_at >= ttl:
+            _counts = _known_ids = None
+        counts, known_ids, generation = _counts, _known_ids, _generation
+
+    # known_ids None with counts set means the cache covers every category
+    if category_ids is None:
+        if counts is not None and known_ids is None:
+            return counts
+        load_ids = None
+    else:
+        wanted = set(category_ids)
+        if counts is not None and (known_ids is None or wanted <= known_ids):
+            return {category_id: counts[category_id] for category_id in wanted if category_id in counts}
+        load_ids = wanted - known_ids if counts is not None else wanted
+
+    loaded = query_category_product_counts(None if load_ids is None else list(load_ids))
+
+    with _lock:
+        # Counts read before a concurrent invalidation may be stale; don't cache them
+        if _generation == generation:
+            if load_ids is None:
+                _counts, _known_ids = loaded, None
+                _loaded_at = time.monotonic()
+            elif _counts is None:
+                _counts, _known_ids = loaded, set(load_ids)
+                _loaded_at = time.monotonic()
+            else:
+                _counts = {**_counts, **loaded}
+                if _known_ids is not None:
+                    _known_ids = _known_ids | load_ids
+
+    if load_ids is None:
+        return loaded
+    counts = {**(counts or {}), **loaded}
+    return {category_id: counts[category_id] for category_id in wanted if category_id in counts}
+
+
+def invalidate_category_counts():
+    global _counts, _known_ids, _generation
+    with _lock:
+        _counts = _known_ids = None
+        _generation += 1
+
+
+def collect_category_changes(session, flush_context, instances):
+    """before_flush: note whether this transaction changes any category's product counts"""
+    if session.info.get(PENDING_KEY):
+        return
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Product):
+            session.info[PENDING_KEY] = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, Product):
+            state = inspect(obj)
+            if state.attrs.category_id.history.has_changes() or state.attrs.is_active.history.has_changes():
+                session.info[PENDING_KEY] = True
+                return
+
+
+def invalidate_after_commit(session):
+    if session.info.pop(PENDING_KEY, False):
+        invalidate_category_counts()
+
+
+def discard_category_changes(session, previous_transaction=None):
+    # Savepoint and failed-flush rollbacks leave the outer transaction's changes in place
+    if not session.in_transaction():
+        session.info.pop(PENDING_KEY, None)
+
+
+def init_category_counts(session):
+    """Register the cache invalidation listeners on a session (or scoped_session / sessionmaker)"""
+    if not event.contains(session, 'before_flush', collect_category_changes):
+        event.listen(session, 'before_flush', collect_category_changes)
+        event.listen(session, 'after_commit', invalidate_after_commit)
+        event.listen(session, 'after_soft_rollback', discard_category_changes)
@@ -0,0 +1,243 @@
+from difflib import SequenceMatcher
+from flask import current_app
+from extensions import db
+from models import Customer, Sale
+from utils.daraja_client import normalize_phone_number
+from utils.customer_stats import recompute_customer_totals
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6'
+}
+
+
+def soundex(word):
+    """American Soundex code of a single word (e.g. 'Robert' -> 'R163')"""
+    word = ''.join(c for c in word.lower() if c.isalpha())
+    if not word:
+        return ''
+
+    code = word[0].upper()
+    previous = SOUNDEX_CODES.get(word[0], '')
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+        # 'h' and 'w' do not separate letters with the same code
+        if char not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def normalize_name(name):
+    """Lowercase name with punctuation and repeated whitespace removed"""
+    return ' '.join(re.sub(r'[^a-z\s]', ' ', (name or '').lower()).split())
+
+
+def name_blocking_key(name):
+    """Soundex of the first and last name tokens, e.g. 'Jon Kamau' -> 'J500-K500'"""
+    tokens = normalize_name(name).split()
+    if not tokens:
+        return None
+    return f"{soundex(tokens[0])}-{soundex(tokens[-1])}"
+
+
+class DisjointSet:
+    """Union-find over customer ids used to merge overlapping blocks into groups"""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        self.parent.setdefault(item, item)
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first, second):
+        first_root, second_root = self.find(first), self.find(second)
+        if first_root != second_root:
+            self.parent[max(first_root, second_root)] = min(first_root, second_root)
+
+
+def find_duplicate_candidates(max_block_size=50, name_similarity=0.85):
+    """
+    Find groups of active customers that are probably the same person.
+
+    Customers are bucketed by blocking keys (normalized phone, lowercase email
+    and a Soundex key of the name) so only records sharing a key are compared,
+    avoiding an O(n^2) scan. A shared phone or email links records directly;
+    within a name block, records are linked when their names are similar
+    enough. Name blocks larger than max_block_size are skipped as too generic.
+
+    Returns:
+        list: Candidate groups, largest first, each with the matched keys and
+              a suggested primary record (the oldest)
+    """
+    phone_blocks = {}
+    email_blocks = {}
+    name_blocks = {}
+    customers = {}
+
+    rows = db.session.query(
+        Customer.id,
+        Customer.name,
+        Customer.email,
+        Customer.phone,
+        Customer.total_purchases,
+        Customer.created_at
+    ).filter(Customer.is_active == True).order_by(Customer.id).yield_per(1000)
+
+    for row in rows:
+        customers[row.id] = row
+
+        phone_key = normalize_phone_number(row.phone) if row.phone else None
+        if phone_key:
+            phone_blocks.setdefault(phone_key, []).append(row.id)
+
+        if row.email:
+            email_blocks.setdefault(row.email.strip().lower(), []).append(row.id)
+
+        name_key = name_blocking_key(row.name)
+        if name_key:
+            name_blocks.setdefault(name_key, []).append(row.id)
+
+    groups = DisjointSet()
+    reasons = {}
+
+    def link(ids, reason):
+        for other_id in ids[1:]:
+            groups.union(ids[0], other_id)
+        for customer_id in ids:
+            reasons.setdefault(customer_id, set()).add(reason)
+
+    for ids in phone_blocks.values():
+        if len(ids) > 1:
+            link(ids, 'phone')
+
+    for ids in email_blocks.values():
+        if len(ids) > 1:
+            link(ids, 'email')
+
+    skipped_blocks = 0
+    for ids in name_blocks.values():
+        if len(ids) < 2:
+            continue
+        if len(ids) > max_block_size:
+            skipped_blocks += 1
+            continue
+        names = {customer_id: normalize_name(customers[customer_id].name) for customer_id in ids}
+        for index, first_id in enumerate(ids):
+            for second_id in ids[index + 1:]:
+                ratio = SequenceMatcher(None, names[first_id], names[second_id]).ratio()
+                if ratio >= name_similarity:
+                    link([first_id, second_id], 'name')
+
+    if skipped_blocks:
+        logger.info(f"Skipped {skipped_blocks} name blocks larger than {max_block_size}")
+
+    members_by_root = {}
+    for customer_id in reasons:
+        members_by_root.setdefault(groups.find(customer_id), []).append(customer_id)
+
+    candidates = []
+    for member_ids in members_by_root.values():
+        if len(member_ids) < 2:
+            continue
+        member_ids.sort()
+        candidates.append({
+            'suggested_primary_id': member_ids[0],
+            'matched_on': sorted(set().union(*(reasons[customer_id] for customer_id in member_ids))),
+            'customers': [
+                {
+                    'id': customer_id,
+                    'name': customers[customer_id].name,
+                    'email': customers[customer_id].email,
+                    'phone': customers[customer_id].phone,
+                    'total_purchases': float(customers[customer_id].total_purchases or 0),
+                    'created_at': customers[customer_id].created_at.isoformat() if customers[customer_id].created_at else None
+                } for customer_id in member_ids
+            ]
+        })
+
+    candidates.sort(key=lambda group: len(group['customers']), reverse=True)
+    return candidates
+
+
+def merge_customers(primary_id, duplicate_ids):
+    """
+    Merge duplicate customer records into a primary record.
+
+    All sales of the duplicates are reassigned with a single UPDATE, contact
+    details missing on the primary are taken from the duplicates, the
+    duplicates are deactivated and the primary's totals are recomputed from
+    its countable sales. The caller is responsible for committing.
+
+    Returns:
+        dict: Summary of the merge
+    """
+    duplicate_ids = sorted(set(duplicate_ids) - {primary_id})
+    if not duplicate_ids:
+        raise ValueError('At least one duplicate_id different from primary_id is required')
+
+    primary = db.session.get(Customer, primary_id)
+    if not primary:
+        raise ValueError(f'Customer {primary_id} not found')
+
+    duplicates = Customer.query.filter(Customer.id.in_(duplicate_ids)).order_by(Customer.id).all()
+    missing = set(duplicate_ids) - {customer.id for customer in duplicates}
+    if missing:
+        raise ValueError(f'Customers not found: {sorted(missing)}')
+
+    sales_moved = db.session.execute(
+        db.update(Sale)
+        .where(Sale.customer_id.in_(duplicate_ids))
+        .values(customer_id=primary_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    # Unique columns have to be released by the duplicate before the primary takes them
+    inherited = {}
+    for duplicate in duplicates:
+        if not primary.email and duplicate.email and 'email' not in inherited:
+            inherited['email'] = duplicate.email
+            duplicate.email = None
+        if not primary.phone and duplicate.phone and 'phone' not in inherited:
+            inherited['phone'] = duplicate.phone
+            duplicate.phone = None
+        if not primary.address and duplicate.address and 'address' not in inherited:
+            inherited['address'] = duplicate.address
+        if not primary.date_of_birth and duplicate.date_of_birth and 'date_of_birth' not in inherited:
+            inherited['date_of_birth'] = duplicate.date_of_birth
+
+        duplicate.is_active = False
+        duplicate.total_purchases = 0
+        duplicate.last_purchase_date = None
+    db.session.flush()
+
+    for field, value in inherited.items():
+        setattr(primary, field, value)
+    db.session.flush()
+
+    recompute_customer_totals([primary_id])
+    db.session.expire(primary)
+
+    current_app.logger.info(f"Merged customers {duplicate_ids} into {primary_id} ({sales_moved} sales moved)")
+
+    return {
+        'primary_id': primary_id,
+        'merged_ids': duplicate_ids,
+        'sales_reassigned': sales_moved,
+        'inherited_fields': sorted(inherited)
+    }
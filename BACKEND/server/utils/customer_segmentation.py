@@ -0,0 +1,133 @@
+from datetime import datetime, timezone
+from flask import current_app
+from extensions import db
+from models import Customer, Sale, CustomerCategory
+from utils.customer_stats import countable_sales_filter
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_segment_thresholds():
+    """Read the RFM thresholds from the app config"""
+    return {
+        'vip_min_spend': current_app.config['CUSTOMER_VIP_MIN_SPEND'],
+        'vip_min_orders': current_app.config['CUSTOMER_VIP_MIN_ORDERS'],
+        'vip_max_recency_days': current_app.config['CUSTOMER_VIP_MAX_RECENCY_DAYS'],
+        'regular_min_orders': current_app.config['CUSTOMER_REGULAR_MIN_ORDERS']
+    }
+
+
+def days_since(moment, now):
+    """Whole days between a (possibly naive) timestamp and now"""
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (now - moment).days
+
+
+def classify_customer(recency_days, frequency, monetary, thresholds):
+    """
+    Assign a CustomerCategory from RFM values.
+
+    VIP customers spend and buy often enough and have bought recently;
+    anyone with a few purchases is Regular; everyone else is New.
+    """
+    if (frequency >= thresholds['vip_min_orders']
+            and monetary >= thresholds['vip_min_spend']
+            and recency_days is not None
+            and recency_days <= thresholds['vip_max_recency_days']):
+        return CustomerCategory.VIP
+    if frequency >= thresholds['regular_min_orders']:
+        return CustomerCategory.REGULAR
+    return CustomerCategory.NEW
+
+
+def segment_customers(dry_run=True, chunk_size=None, sample_size=100):
+    """
+    Recompute CustomerCategory for every customer from their sales.
+
+    RFM values come from a single grouped pass over countable sales (failed
+    M-Pesa payments are ignored) joined to customers.
+    Changed categories are written back with chunked bulk updates, committing
+    after each chunk so locks stay short on large tables.
+
+    Args:
+        dry_run (bool): Only report the changes that would be made
+        chunk_size (int): Rows per bulk update (defaults to CUSTOMER_SEGMENT_CHUNK_SIZE)
+        sample_size (int): Maximum number of individual changes included in the report
+
+    Returns:
+        dict: Summary with per-transition counts and a sample of the diff
+    """
+    thresholds = get_segment_thresholds()
+    chunk_size = chunk_size or current_app.config['CUSTOMER_SEGMENT_CHUNK_SIZE']
+    now = datetime.now(timezone.utc)
+
+    sales_stats = db.session.query(
+        Sale.customer_id.label('customer_id'),
+        db.func.max(Sale.sale_date).label('last_sale_date'),
+        db.func.count(Sale.id).label('frequency'),
+        db.func.sum(Sale.total_amount).label('monetary')
+    ).filter(
+        Sale.customer_id.isnot(None),
+        countable_sales_filter()
+    ).group_by(Sale.customer_id).subquery()
+
+    rows = db.session.query(
+        Customer.id,
+        Customer.name,
+        Customer.category,
+        sales_stats.c.last_sale_date,
+        sales_stats.c.frequency,
+        sales_stats.c.monetary
+    ).outerjoin(
+        sales_stats, sales_stats.c.customer_id == Customer.id
+    ).order_by(Customer.id).yield_per(chunk_size)
+
+    scanned = 0
+    changes = []
+    transitions = {}
+    sample = []
+
+    for row in rows:
+        scanned += 1
+        recency_days = days_since(row.last_sale_date, now)
+        frequency = row.frequency or 0
+        monetary = float(row.monetary or 0)
+
+        new_category = classify_customer(recency_days, frequency, monetary, thresholds)
+        if new_category == row.category:
+            continue
+
+        old_value = row.category.value if row.category else None
+        transition = f"{old_value} -> {new_category.value}"
+        transitions[transition] = transitions.get(transition, 0) + 1
+        changes.append({'id': row.id, 'category': new_category})
+
+        if len(sample) < sample_size:
+            sample.append({
+                'customer_id': row.id,
+                'name': row.name,
+                'old_category': old_value,
+                'new_category': new_category.value,
+                'recency_days': recency_days,
+                'frequency': frequency,
+                'monetary': monetary
+            })
+
+    if not dry_run:
+        for start in range(0, len(changes), chunk_size):
+            db.session.execute(db.update(Customer), changes[start:start + chunk_size])
+            db.session.commit()
+        logger.info(f"Customer segmentation updated {len(changes)} of {scanned} customers")
+
+    return {
+        'dry_run': dry_run,
+        'thresholds': thresholds,
+        'customers_scanned': scanned,
+        'customers_changed': len(changes),
+        'transitions': transitions,
+        'changes': sample
+    }
@@ -0,0 +1,152 @@
+from extensions import db
+from models import Customer, Sale, MpesaTransaction, MpesaTransactionStatus
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def countable_sales_filter():
+    """
+    SQL condition selecting sales that count towards customer totals.
+
+    A sale is excluded when it was paid through M-Pesa and none of its
+    transactions is completed or still pending (the payment failed, was
+    cancelled or expired). Sales without an M-Pesa transaction always count.
+    """
+    has_transaction = db.exists().where(MpesaTransaction.sale_id == Sale.id)
+    has_live_transaction = db.exists().where(
+        MpesaTransaction.sale_id == Sale.id,
+        MpesaTransaction.status.in_([MpesaTransactionStatus.COMPLETED, MpesaTransactionStatus.PENDING])
+    )
+    return db.or_(~has_transaction, has_live_transaction)
+
+
+def customer_sales_totals():
+    """Subquery of (customer_id, total_purchases, last_purchase_date, sales_count) over countable sales"""
+    return db.select(
+        Sale.customer_id.label('customer_id'),
+        db.func.sum(Sale.total_amount).label('total_purchases'),
+        db.func.max(Sale.sale_date).label('last_purchase_date'),
+        db.func.count(Sale.id).label('sales_count')
+    ).where(
+        Sale.customer_id.isnot(None),
+        countable_sales_filter()
+    ).group_by(Sale.customer_id).subquery('customer_totals')
+
+
+def recompute_customer_totals(customer_ids):
+    """Recompute total_purchases and last_purchase_date from countable sales for the given customers"""
+    sales_total = db.select(
+        db.func.coalesce(db.func.sum(Sale.total_amount), 0)
+    ).where(Sale.customer_id == Customer.id, countable_sales_filter()).scalar_subquery()
+    last_sale = db.select(
+        db.func.max(Sale.sale_date)
+    ).where(Sale.customer_id == Customer.id, countable_sales_filter()).scalar_subquery()
+
+    db.session.execute(
+        db.update(Customer)
+        .where(Customer.id.in_(customer_ids))
+        .values(total_purchases=sales_total, last_purchase_date=last_sale)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def reconcile_customer_totals(dry_run=True, sample_size=100):
+    """
+    Recompute total_purchases and last_purchase_date for all customers.
+
+    The expected values come from one grouped pass over countable sales.
+    Drifted customers are written with a single UPDATE ... FROM the grouped
+    subquery, and customers without countable sales are reset with a second
+    statement, so the cost does not grow with a Python loop over customers.
+
+    Args:
+        dry_run (bool): Only report the drift without writing
+        sample_size (int): Maximum number of drifted customers included in the report
+
+    Returns:
+        dict: Drift summary (counts, total amount drift and a sample)
+    """
+    totals = customer_sales_totals()
+    expected_total = db.func.coalesce(totals.c.total_purchases, 0)
+
+    total_drifted = Customer.total_purchases != expected_total
+    date_drifted = Customer.last_purchase_date.is_distinct_from(totals.c.last_purchase_date)
+
+    drift_rows = db.session.execute(
+        db.select(
+            Customer.id,
+            Customer.name,
+            Customer.total_purchases,
+            Customer.last_purchase_date,
+            expected_total.label('expected_total'),
+            totals.c.last_purchase_date.label('expected_last_purchase_date')
+        ).outerjoin(
+            totals, totals.c.customer_id == Customer.id
+        ).where(
+            db.or_(total_drifted, date_drifted)
+        ).order_by(Customer.id).execution_options(yield_per=1000)
+    )
+
+    drifted = 0
+    amount_drifted = 0
+    total_amount_drift = 0.0
+    date_only_drifted = 0
+    sample = []
+
+    for row in drift_rows:
+        drifted += 1
+        difference = float(row.total_purchases or 0) - float(row.expected_total or 0)
+        if abs(difference) >= 0.005:
+            amount_drifted += 1
+            total_amount_drift += difference
+        else:
+            date_only_drifted += 1
+
+        if len(sample) < sample_size:
+            sample.append({
+                'customer_id': row.id,
+                'name': row.name,
+                'stored_total': float(row.total_purchases or 0),
+                'expected_total': float(row.expected_total or 0),
+                'difference': round(difference, 2),
+                'stored_last_purchase_date': row.last_purchase_date.isoformat() if row.last_purchase_date else None,
+                'expected_last_purchase_date': row.expected_last_purchase_date.isoformat() if row.expected_last_purchase_date else None
+            })
+
+    updated = 0
+    if not dry_run and drifted:
+        updated += db.session.execute(
+            db.update(Customer)
+            .where(Customer.id == totals.c.customer_id)
+            .where(db.or_(
+                Customer.total_purchases != totals.c.total_purchases,
+                Customer.last_purchase_date.is_distinct_from(totals.c.last_purchase_date)
+            ))
+            .values(
+                total_purchases=totals.c.total_purchases,
+                last_purchase_date=totals.c.last_purchase_date
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+        updated += db.session.execute(
+            db.update(Customer)
+            .where(Customer.id.notin_(db.select(totals.c.customer_id)))
+            .where(db.or_(Customer.total_purchases != 0, Customer.last_purchase_date.isnot(None)))
+            .values(total_purchases=0, last_purchase_date=None)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+        db.session.commit()
+        logger.info(f"Customer totals reconciliation updated {updated} customers")
+
+    return {
+        'dry_run': dry_run,
+        'customers_drifted': drifted,
+        'customers_with_amount_drift': amount_drifted,
+        'customers_with_date_drift_only': date_only_drifted,
+        'total_amount_drift': round(total_amount_drift, 2),
+        'customers_updated': updated,
+        'drift': sample
+    }
@@ -1,17 +1,157 @@
 import base64
+import hashlib
+import json
+import os
+import random
 import requests
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from datetime import datetime
 from flask import current_app
 import logging
 
+try:
+    import fcntl
+except ImportError:  # Windows: the shared token file is used without locking
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
+# Daraja tokens are issued for an hour
+DEFAULT_TOKEN_LIFETIME = 3599
 
+# Gateway errors and throttling; worth another try for calls that are safe to repeat
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
+# 'delivery' of initiate_stk_push errors where Daraja gave no usable answer
+DELIVERY_NOT_SENT = 'not_sent'  # The request never left this server; sending again is safe
+DELIVERY_UNKNOWN = 'unknown'  # Daraja may have received it (read timeout, reset, unreadable reply, 5xx)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_metrics = {'requests': 0, 'retries': 0, 'errors': 0, 'elapsed_ms': 0.0}
 
-def get_mpesa_access_token():
 
-    """Generates an access token required for authenticating M-Pesa API calls."""
+def get_http_session():
+    """
+    Shared keep-alive session for Daraja calls.
+
+    Connections to Safaricom are pooled (MPESA_POOL_MAXSIZE per host), so
+    consecutive calls skip the TCP and TLS handshakes. A forked worker gets
+    its own session rather than sharing the parent's sockets.
+    """
+    global _session, _session_pid
+
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                maxsize = current_app.config.get('MPESA_POOL_MAXSIZE', 10)
+                session = requests.Session()
+                # Retries are handled by daraja_request, which knows which calls are safe to repeat
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=maxsize, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def daraja_request(method, url, idempotent=False, **kwargs):
+    """
+    Send a request to Daraja through the pooled session.
+
+    Uses (MPESA_CONNECT_TIMEOUT, MPESA_READ_TIMEOUT) unless a timeout is
+    given. Idempotent calls are retried up to MPESA_MAX_RETRIES times on
+    connection errors, timeouts and 429/5xx responses, with exponential
+    backoff from MPESA_RETRY_BACKOFF seconds. Other calls (an STK push
+    would prompt the customer twice) are retried only when the connection
+    could not be opened (refused, unresolvable or timed out while
+    connecting), since the request was then never sent.
+
+    Raises:
+        requests.exceptions.RequestException: When the last attempt fails
+    """
+    config = current_app.config
+    kwargs.setdefault('timeout', (config.get('MPESA_CONNECT_TIMEOUT', 5), config.get('MPESA_READ_TIMEOUT', 30)))
+    max_retries = config.get('MPESA_MAX_RETRIES', 2)
+    backoff = config.get('MPESA_RETRY_BACKOFF', 0.5)
+    session = get_http_session()
+
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+            retry = idempotent and response.status_code in RETRY_STATUSES
+            failure = None
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            retry = idempotent or request_not_sent(e)
+            failure = e
+        finally:
+            record_http_metric('requests', 1)
+            record_http_metric('elapsed_ms', (time.monotonic() - started) * 1000)
+
+        if not retry or attempt >= max_retries:
+            if failure is not None:
+                record_http_metric('errors', 1)
+                raise failure
+            return response
+
+        attempt += 1
+        record_http_metric('retries', 1)
+        delay = backoff * (2 ** (attempt - 1))
+        logger.warning(f"Daraja {method} {url} failed ({failure or response.status_code}), retry {attempt} in {delay:.1f}s")
+        time.sleep(delay + random.uniform(0, delay / 2))
+
+
+def request_not_sent(error):
+    """True if a requests error happened while connecting, before any of the request was sent"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or isinstance(error, requests.exceptions.SSLError):
+        return False
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying failure
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+
+
+def record_http_metric(name, value):
+    with _metrics_lock:
+        _metrics[name] += value
+
+
+def http_stats():
+    """Request counters and connection reuse of the pooled Daraja session in this process"""
+    with _metrics_lock:
+        stats = dict(_metrics)
+
+    connections = 0
+    pooled_requests = 0
+    if _session is not None and _session_pid == os.getpid():
+        for adapter in set(_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    pooled_requests += pool.num_requests
+
+    stats['elapsed_ms'] = round(stats['elapsed_ms'], 1)
+    stats['average_ms'] = round(stats['elapsed_ms'] / stats['requests'], 1) if stats['requests'] else None
+    stats['connections_opened'] = connections
+    stats['connections_reused'] = max(0, pooled_requests - connections)
+    stats['reuse_ratio'] = round((pooled_requests - connections) / pooled_requests, 3) if pooled_requests else None
+    return stats
+
+
+
+
+def fetch_mpesa_access_token():
+
+    """Requests a new access token from the Daraja OAuth endpoint; returns (token, expires_in seconds)."""
 
     url = current_app.config.get('DARAJA_AUTH_URL')
     consumer_key = current_app.config.get('MPESA_CONSUMER_KEY')
@@ -34,7 +174,7 @@ def get_mpesa_access_token():
     
     try:
 
-        response = requests.get(url, headers=headers, timeout=30)
+        response = daraja_request('GET', url, idempotent=True, headers=headers)
         logger.info(f"M-Pesa auth response status: {response.status_code}")
         logger.info(f"M-Pesa auth response headers: {dict(response.headers)}")
         
@@ -50,14 +190,17 @@ def get_mpesa_access_token():
         
         try:
             response_data = response.json()
-            logger.info(f"M-Pesa auth response: {response_data}")
         except Exception as json_error:
             logger.error(f"Failed to parse JSON response: {response.text[:500]}")
             raise Exception(f"Invalid JSON response from M-Pesa API: {str(json_error)}")
 
         if "access_token" in response_data:
             logger.info("M-Pesa access token obtained successfully")
-            return response_data["access_token"]
+            try:
+                expires_in = int(response_data.get("expires_in", DEFAULT_TOKEN_LIFETIME))
+            except (TypeError, ValueError):
+                expires_in = DEFAULT_TOKEN_LIFETIME
+            return response_data["access_token"], expires_in
         else:
             error_msg = response_data.get('error_description', 'Unknown error')
             logger.error(f"Error obtaining access token: {error_msg}")
@@ -69,7 +212,133 @@ def get_mpesa_access_token():
     except Exception as e:
         logger.error(f"Error fetching M-pesa access token: {str(e)}")
         raise Exception(f"Error fetching M-pesa access token: {str(e)}")
-    
+
+
+class AccessTokenCache:
+    """
+    Process-wide cache of the Daraja OAuth token.
+
+    Tokens are reused until MPESA_TOKEN_REFRESH_MARGIN seconds before they
+    expire. Inside that window one caller refreshes while the others keep
+    using the still-valid token; once it has expired, callers wait on a lock
+    so only one of them goes to the auth endpoint.
+
+    With MPESA_TOKEN_CACHE_FILE set, the token is also shared with other
+    worker processes through that file: it is written atomically and
+    refreshes are serialized with an flock on '<file>.lock', so a pool of
+    workers fetches one token between them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._owner = None
+        self._rejected = None
+        self.hits = 0
+        self.refreshes = 0
+
+    def get(self):
+        config = current_app.config
+        owner = hashlib.sha256(str(config.get('MPESA_CONSUMER_KEY')).encode()).hexdigest()
+        margin = config.get('MPESA_TOKEN_REFRESH_MARGIN', 300)
+
+        token, expires_at = self._token, self._expires_at
+        if self._owner == owner and token:
+            now = time.time()
+            if now < expires_at - margin:
+                self.hits += 1
+                return token
+            # Still valid: whoever gets the lock refreshes, everyone else carries on
+            if now < expires_at and not self._lock.acquire(blocking=False):
+                self.hits += 1
+                return token
+            elif now >= expires_at:
+                self._lock.acquire()
+        else:
+            self._lock.acquire()
+
+        try:
+            # Another thread may have refreshed while we waited
+            if self._owner == owner and self._token and time.time() < self._expires_at - margin:
+                self.hits += 1
+                return self._token
+
+            cache_file = config.get('MPESA_TOKEN_CACHE_FILE')
+            if cache_file:
+                token, expires_at = self._refresh_shared(cache_file, owner, margin)
+            else:
+                token, expires_at = self._fetch()
+
+            self._token, self._expires_at, self._owner = token, expires_at, owner
+            return token
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        """Forget the token (e.g. after Daraja rejects it); the shared file is overwritten on the next refresh"""
+        with self._lock:
+            self._rejected = self._token
+            self._token = None
+            self._expires_at = 0.0
+
+    def stats(self):
+        return {
+            'cached': self._token is not None,
+            'expires_in': max(0, int(self._expires_at - time.time())) if self._token else 0,
+            'hits': self.hits,
+            'refreshes': self.refreshes
+        }
+
+    def _fetch(self):
+        token, expires_in = fetch_mpesa_access_token()
+        self.refreshes += 1
+        return token, time.time() + expires_in
+
+    def _refresh_shared(self, cache_file, owner, margin):
+        with open(f'{cache_file}.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                cached = read_token_file(cache_file)
+                # Another worker's fresh token is reused, unless it is the one Daraja just rejected
+                if (cached and cached.get('owner') == owner and cached.get('access_token') != self._rejected
+                        and time.time() < cached.get('expires_at', 0) - margin):
+                    self.hits += 1
+                    return cached['access_token'], cached['expires_at']
+
+                token, expires_at = self._fetch()
+                write_token_file(cache_file, {'owner': owner, 'access_token': token, 'expires_at': expires_at})
+                return token, expires_at
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_token_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_token_file(path, data):
+    """Write the token file atomically, readable by its owner only"""
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+access_token_cache = AccessTokenCache()
+
+
+def get_mpesa_access_token():
+    """Returns a valid access token for M-Pesa API calls, fetching a new one only when needed (see AccessTokenCache)."""
+    return access_token_cache.get()
+
 
 #######################################################################################################################################################################################################################    
 def generate_mpesa_password(timestamp):
@@ -105,7 +374,19 @@ def sanitize_phone_number(phone):
         return '254' + phone
     
     logger.warning(f"Invalid phone number format: {phone}")
-    return None    
+    return None
+
+
+def normalize_phone_number(phone):
+    """
+    Convert phone number to E.164 format (+2547XXXXXXXX).
+    Uses the same rules as sanitize_phone_number; this is the form stored in
+    Customer.phone_normalized and used for exact-match customer lookup.
+    """
+    sanitized = sanitize_phone_number(phone)
+    if not sanitized:
+        return None
+    return '+' + sanitized
 
 ###########################################################################################################################################################################################################
 
@@ -120,15 +401,22 @@ def initiate_stk_push(phone_number, amount, order_id, description='Furniture Pay
         description (str): Transaction description
         
     Returns:
-        tuple: (response_data, status_code)
+        tuple: (response_data, status_code). Errors other than a rejection
+        by Daraja carry 'delivery': DELIVERY_NOT_SENT or DELIVERY_UNKNOWN, so
+        callers can tell a push that is safe to resend from one that may
+        already have prompted the customer (a 5xx answer is DELIVERY_UNKNOWN).
     """
     logger.info(f"Starting STK push for order {order_id}, amount {amount}, phone {phone_number}")
 
     try:
-        access_token = get_mpesa_access_token()
+        try:
+            access_token = get_mpesa_access_token()
+        except Exception as e:
+            logger.error(f"Failed to authenticate with M-Pesa: {str(e)}")
+            access_token = None
         if not access_token:
             logger.error("Failed to authenticate with M-Pesa")
-            return {"error": "Failed to authenticate with M-Pesa"}, 500
+            return {"error": "Failed to authenticate with M-Pesa", "delivery": DELIVERY_NOT_SENT}, 500
 
         # Validate and format phone number
         sanitized_phone = sanitize_phone_number(phone_number)
@@ -174,12 +462,16 @@ def initiate_stk_push(phone_number, amount, order_id, description='Furniture Pay
         logger.info(f"Making STK push request to: {stk_push_url}")
         logger.info(f"STK push payload: {payload}")
         
-        response = requests.post(
+        response = daraja_request(
+            'POST',
             stk_push_url,
+            idempotent=False,
             json=payload,
-            headers=headers,
-            timeout=30
+            headers=headers
         )
+        # A token revoked before its expiry is dropped so the next call fetches a new one
+        if response.status_code == 401:
+            access_token_cache.invalidate()
         logger.info(f"STK push response status: {response.status_code}")
         logger.info(f"STK push response headers: {dict(response.headers)}")
         
@@ -188,7 +480,10 @@ def initiate_stk_push(phone_number, amount, order_id, description='Furniture Pay
         if 'application/json' not in content_type:
             logger.error(f"Expected JSON response but got: {content_type}")
             logger.error(f"Response text: {response.text[:500]}")  # Log first 500 chars
-            return {"error": f"M-Pesa API returned non-JSON response. Status: {response.status_code}"}, 500
+            return {
+                "error": f"M-Pesa API returned non-JSON response. Status: {response.status_code}",
+                "delivery": DELIVERY_UNKNOWN
+            }, 500
         
         try:
             response_data = response.json()
@@ -199,28 +494,32 @@ def initiate_stk_push(phone_number, amount, order_id, description='Furniture Pay
                 logger.info("STK push request accepted by M-Pesa")
                 return response_data, 200
             else:
-                error_msg = response_data.get('ResponseDescription', 'Unknown error')
+                error_msg = response_data.get('ResponseDescription') or response_data.get('errorMessage', 'Unknown error')
                 logger.error(f"STK push failed: {error_msg}")
+                if response.status_code >= 500:
+                    # Daraja may have started the push before failing; it must not be resent
+                    return {"error": f"STK push failed: {error_msg}", "delivery": DELIVERY_UNKNOWN}, response.status_code
                 return {"error": f"STK push failed: {error_msg}"}, 400
                 
         except Exception as json_error:
             logger.error(f"Failed to parse JSON response: {response.text[:500]}")
-            return {"error": f"Invalid JSON response from M-Pesa API: {str(json_error)}"}, 500
+            return {"error": f"Invalid JSON response from M-Pesa API: {str(json_error)}", "delivery": DELIVERY_UNKNOWN}, 500
         
     except requests.exceptions.RequestException as e:
         logger.error(f"STK Push network error: {str(e)}")
+        delivery = DELIVERY_NOT_SENT if request_not_sent(e) else DELIVERY_UNKNOWN
         if hasattr(e, 'response') and e.response is not None:
             try:
                 error_data = e.response.json()
                 return error_data, e.response.status_code
             except:
                 logger.error(f"Failed to parse error response: {e.response.text[:500]}")
-                return {"error": f"Network error: {str(e)}"}, 500
+                return {"error": f"Network error: {str(e)}", "delivery": delivery}, 500
         else:
-            return {"error": f"Network error: {str(e)}"}, 500
+            return {"error": f"Network error: {str(e)}", "delivery": delivery}, 500
     except Exception as e:
         logger.error(f"Unexpected error in STK Push: {str(e)}")
-        return {"error": "Internal server error"}, 500   
+        return {"error": "Internal server error", "delivery": DELIVERY_UNKNOWN}, 500   
 
 ###########################################################################################################################################################
 
@@ -253,12 +552,16 @@ def register_c2b_urls():
         logger.info(f"Registering C2B URLs at: {c2b_register_url}")
         logger.info(f"C2B registration payload: {payload}")
         
-        response = requests.post(
+        response = daraja_request(
+            'POST',
             c2b_register_url,
+            idempotent=True,
             json=payload,
-            headers=headers,
-            timeout=30
+            headers=headers
         )
+        # A token revoked before its expiry is dropped so the next call fetches a new one
+        if response.status_code == 401:
+            access_token_cache.invalidate()
         
         logger.info(f"C2B registration response status: {response.status_code}")
         logger.info(f"C2B registration response: {response.text}")
@@ -340,12 +643,16 @@ def simulate_c2b_payment(phone_number, amount, account_reference="", command_id=
         logger.info(f"Simulating C2B payment at: {c2b_simulate_url}")
         logger.info(f"C2B simulation payload: {payload}")
         
-        response = requests.post(
+        response = daraja_request(
+            'POST',
             c2b_simulate_url,
+            idempotent=False,
             json=payload,
-            headers=headers,
-            timeout=30
+            headers=headers
         )
+        # A token revoked before its expiry is dropped so the next call fetches a new one
+        if response.status_code == 401:
+            access_token_cache.invalidate()
         
         logger.info(f"C2B simulation response status: {response.status_code}")
         logger.info(f"C2B simulation response: {response.text}")
@@ -410,12 +717,16 @@ def query_transaction_status(checkout_request_id):
         logger.info(f"Querying transaction status at: {query_url}")
         logger.info(f"Transaction query payload: {payload}")
         
-        response = requests.post(
+        response = daraja_request(
+            'POST',
             query_url,
+            idempotent=True,
             json=payload,
-            headers=headers,
-            timeout=30
+            headers=headers
         )
+        # A token revoked before its expiry is dropped so the next call fetches a new one
+        if response.status_code == 401:
+            access_token_cache.invalidate()
         
         logger.info(f"Transaction query response status: {response.status_code}")
         logger.info(f"Transaction query response: {response.text}")
@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import logging
+import os
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it images are served as uploaded
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SUFFIX = '_thumb.webp'
+WEBP_SUFFIX = '.webp'
+
+
+def rendition_paths(image_url):
+    """Relative (thumbnail, webp) paths stored next to an original such as 'uploads/x.jpg'"""
+    stem = os.path.splitext(image_url)[0]
+    return f'{stem}{THUMBNAIL_SUFFIX}', f'{stem}{WEBP_SUFFIX}'
+
+
+def generate_renditions(source_path, thumbnail_path, webp_path, thumbnail_size=300, webp_max_size=1200, quality=80):
+    """
+    Write a fixed-size square thumbnail and a bounded-size WebP copy of an image.
+
+    The thumbnail is padded rather than cropped so whole bottles stay visible.
+    Both files are written to a temporary name first and renamed into place.
+    """
+    with Image.open(source_path) as source:
+        image = ImageOps.exif_transpose(source)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in source.info else 'RGB')
+
+        thumbnail = ImageOps.pad(
+            image,
+            (thumbnail_size, thumbnail_size),
+            method=Image.LANCZOS,
+            color=(255, 255, 255, 0) if image.mode == 'RGBA' else (255, 255, 255)
+        )
+        save_atomically(thumbnail, thumbnail_path, quality)
+
+        webp = image.copy()
+        webp.thumbnail((webp_max_size, webp_max_size), Image.LANCZOS)
+        save_atomically(webp, webp_path, quality)
+
+
+def save_atomically(image, path, quality):
+    # Unique per writer: identical uploads may render the same file concurrently
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    image.save(temp_path, 'WEBP', quality=quality, method=4)
+    os.replace(temp_path, path)
+
+
+class ImagePipeline:
+    """
+    Background generation of thumbnail and WebP renditions for product images.
+
+    Uploads are committed with the original file only; submit(image_id) then
+    queues the image on a thread pool of IMAGE_PIPELINE_WORKERS workers. Each
+    job renders the files next to the original and records thumbnail_url and
+    webp_url on the ProductImage row, so payloads switch to the small files
+    as soon as they exist and fall back to the original until then.
+
+    Requires Pillow; without it (or with IMAGE_PIPELINE_ENABLED off) submit()
+    does nothing.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._processed = 0
+        self._failed = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_PIPELINE_ENABLED', True)
+        app.config.setdefault('IMAGE_PIPELINE_WORKERS', 2)
+        app.config.setdefault('IMAGE_THUMBNAIL_SIZE', 300)
+        app.config.setdefault('IMAGE_WEBP_MAX_SIZE', 1200)
+        app.config.setdefault('IMAGE_WEBP_QUALITY', 80)
+
+        self.app = app
+        app.extensions['image_pipeline'] = self
+        atexit.register(self.shutdown)
+
+    @property
+    def enabled(self):
+        return Image is not None and self.app is not None and self.app.config['IMAGE_PIPELINE_ENABLED']
+
+    def submit(self, image_id):
+        """Queue renditions for a committed ProductImage; returns the Future or None"""
+        if not self.enabled:
+            if Image is None:
+                logger.warning('Pillow is not installed, skipping image renditions')
+            return None
+        return self._get_executor().submit(self._process, image_id)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'pillow_available': Image is not None,
+            'processed': self._processed,
+            'failed': self._failed
+        }
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _get_executor(self):
+        # A forked worker inherits the parent's executor without its threads
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.app.config['IMAGE_PIPELINE_WORKERS'],
+                        thread_name_prefix='image-pipeline'
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _process(self, image_id):
+        from extensions import db
+        from models import ProductImage
+
+        config = self.app.config
+        with self.app.app_context():
+            try:
+                image = db.session.get(ProductImage, image_id)
+                if image is None:
+                    return None
+
+                upload_root = os.path.dirname(config['UPLOAD_FOLDER'])
+                thumbnail_url, webp_url = rendition_paths(image.image_url)
+                thumbnail_path = os.path.join(upload_root, thumbnail_url)
+                webp_path = os.path.join(upload_root, webp_url)
+
+                # Content-addressed uploads share renditions with every copy of the same file
+                if not (image.content_hash and os.path.exists(thumbnail_path) and os.path.exists(webp_path)):
+                    generate_renditions(
+                        os.path.join(upload_root, image.image_url),
+                        thumbnail_path,
+                        webp_path,
+                        thumbnail_size=config['IMAGE_THUMBNAIL_SIZE'],
+                        webp_max_size=config['IMAGE_WEBP_MAX_SIZE'],
+                        quality=config['IMAGE_WEBP_QUALITY']
+                    )
+
+                image.thumbnail_url = thumbnail_url
+                image.webp_url = webp_url
+                db.session.commit()
+                self._processed += 1
+                return thumbnail_url, webp_url
+            except Exception:
+                db.session.rollback()
+                self._failed += 1
+                logger.exception(f'Failed to generate renditions for product image {image_id}')
+                return None
@@ -1,37 +1,232 @@
+import hashlib
 import os
-from werkzeug.utils import secure_filename
+import re
+import tempfile
+import time
 from flask import current_app
 
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow images are validated by their signature only
+    Image = None
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# <sha256>.<ext>, <sha256>.webp and <sha256>_thumb.webp
+CONTENT_ADDRESSED_RE = re.compile(r'^[0-9a-f]{64}(_thumb)?\.[a-z0-9]+$')
+
+IMAGE_SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a')
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.',1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 
-def generate_unique_filename(filename, product_id):
-    """Generate a unique filename using the product ID."""
-    basename = secure_filename(filename.rsplit('.',1)[0])
-    extension = filename.rsplit('.',1)[1].lower()
-    return f"product_{product_id}_{basename}.{extension}"
-
 ###########################################################################################################################################
 # Blog media 
 
 
 
 def save_product_image(file, product_id):
-    """Save the uploaded image and return the relative path."""
-    if not file or not allowed_file(file.filename):
-        return None
+    """
+    Store an uploaded image under the SHA-256 of its content.
 
-    filename = generate_unique_filename(file.filename, product_id)
-    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    Identical uploads (for any product) share one file, and a changed image
+    always gets a new name, so the stored files never change and can be
+    cached forever.
+
+    Returns:
+        tuple: (relative path like 'uploads/<sha256>.<ext>', sha256 hex digest),
+        or (None, None) on failure
+    """
+    if not file or not allowed_file(file.filename):
+        return None, None
 
     try:
-        file.save(file_path)
-        return f"uploads/{filename}"
+        return store_image_stream(file.stream, file.filename.rsplit('.',1)[1], current_app.config['UPLOAD_FOLDER'])
     except Exception as e:
         current_app.logger.error(f"Error saving product image: {str(e)}")
-        return None
-    
+        return None, None
+
+
+def store_image_stream(stream, extension, upload_folder, max_bytes=None, validate=False):
+    """
+    Write a binary stream into upload_folder as <sha256>.<ext>.
+
+    The stream is copied to a temporary file while hashing and renamed into
+    place, so it is never held in memory. Safe to call from worker threads
+    (no application context needed).
+
+    Args:
+        stream: Readable binary file object
+        extension: File extension without the dot ('jpeg' is stored as 'jpg')
+        upload_folder: Absolute uploads directory
+        max_bytes: Reject streams larger than this
+        validate: Reject files that are not readable images
+
+    Returns:
+        tuple: (relative path like 'uploads/<sha256>.<ext>', sha256 hex digest)
+
+    Raises:
+        ValueError: If the stream is too large or not a valid image
+    """
+    extension = extension.lower()
+    if extension == 'jpeg':
+        extension = 'jpg'
+
+    digest = hashlib.sha256()
+    size = 0
+    temp_file = tempfile.NamedTemporaryFile(dir=upload_folder, prefix='.upload-', delete=False)
+    try:
+        with temp_file:
+            for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise ValueError(f'File is larger than {max_bytes} bytes')
+                digest.update(chunk)
+                temp_file.write(chunk)
+
+        if validate and not validate_image_file(temp_file.name):
+            raise ValueError('File is not a valid image')
+
+        content_hash = digest.hexdigest()
+        filename = f"{content_hash}.{extension}"
+        # Same name means same bytes, so replacing an existing copy is harmless
+        os.replace(temp_file.name, os.path.join(upload_folder, filename))
+        return f"uploads/{filename}", content_hash
+    except BaseException:
+        if os.path.exists(temp_file.name):
+            os.unlink(temp_file.name)
+        raise
+
+
+def validate_image_file(path):
+    """True if path starts with a PNG/JPEG/GIF signature and (when Pillow is installed) decodes"""
+    try:
+        with open(path, 'rb') as f:
+            if not f.read(16).startswith(IMAGE_SIGNATURES):
+                return False
+        if Image is not None:
+            with Image.open(path) as image:
+                image.verify()
+        return True
+    except Exception:
+        return False
+
+
+def is_content_addressed(filename):
+    """True for files stored by save_product_image (and their renditions), whose bytes never change"""
+    return CONTENT_ADDRESSED_RE.match(os.path.basename(filename)) is not None
+
+
+def release_image_files(image_url, content_hash=None):
+    """
+    Delete an image file and its renditions once no ProductImage references it.
+
+    Call after the referencing row has been deleted and committed; rows
+    sharing the file keep it. For content-addressed names that includes rows
+    with the same content_hash; a legacy product_<id>_* file is only ever
+    referenced by its own image_url, even when --checksum recorded the hash
+    of identical bytes stored under another name.
+
+    An upload of the same bytes may have (re)written the file without having
+    committed its row yet, so files written less than IMAGE_RELEASE_GRACE
+    seconds before the reference check are kept; sweep_unreferenced_images()
+    removes them later if they are still unreferenced.
+
+    Returns:
+        bool: True if the files were deleted
+    """
+    from extensions import db
+    from models import ProductImage
+
+    checked_at = time.time()
+    condition = ProductImage.image_url == image_url
+    if content_hash and is_content_addressed(image_url):
+        condition = db.or_(ProductImage.content_hash == content_hash, condition)
+    if db.session.query(ProductImage.query.filter(condition).exists()).scalar():
+        return False
+
+    try:
+        modified_at = os.path.getmtime(os.path.join(current_app.config['UPLOAD_FOLDER'], os.path.basename(image_url)))
+    except OSError:
+        modified_at = None
+    if modified_at is not None and modified_at > checked_at - current_app.config['IMAGE_RELEASE_GRACE']:
+        current_app.logger.info(f"Image file written recently, kept until the next sweep: {image_url}")
+        return False
+
+    return delete_image_files(image_url)
+
+
+def sweep_unreferenced_images(older_than=None, dry_run=False):
+    """
+    Delete content-addressed files that no ProductImage references.
+
+    Collects what release_image_files() had to keep during its grace period,
+    files from uploads whose row was never committed and stale '.upload-'
+    temporary files. Only files older than older_than seconds (default
+    IMAGE_RELEASE_GRACE) are considered, so uploads still in flight are safe.
+    Legacy product_<id>_* files are never touched.
+
+    Returns:
+        list: Relative paths of the deleted (or, with dry_run, deletable) originals
+    """
+    from extensions import db
+    from models import ProductImage
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    if older_than is None:
+        older_than = current_app.config['IMAGE_RELEASE_GRACE']
+    cutoff = time.time() - older_than
+
+    def is_old(name):
+        try:
+            return os.path.getmtime(os.path.join(upload_folder, name)) < cutoff
+        except OSError:
+            return False
+
+    # Originals keyed by stem; renditions count only through their original
+    candidates = {}
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if entry.name.startswith('.upload-'):
+                if not dry_run and is_old(entry.name):
+                    os.unlink(entry.path)
+                continue
+            if is_content_addressed(entry.name):
+                stem, extension = os.path.splitext(entry.name)
+                if not stem.endswith('_thumb') and extension != '.webp' and is_old(entry.name):
+                    candidates[stem] = f"uploads/{entry.name}"
+
+    # Reference check after the scan: an upload committed in between keeps its file
+    referenced = set()
+    urls = list(candidates.values())
+    for start in range(0, len(urls), 500):
+        referenced.update(image_url for (image_url,) in db.session.query(ProductImage.image_url).filter(
+            ProductImage.image_url.in_(urls[start:start + 500])
+        ))
+
+    swept = []
+    for image_url in urls:
+        # Re-checked right before the unlink: an identical upload rewrites the file
+        if image_url in referenced or not is_old(os.path.basename(image_url)):
+            continue
+        if dry_run or delete_image_files(image_url):
+            swept.append(image_url)
+    return swept
+
+
+def delete_image_files(image_url):
+    """Delete an original and whichever of its renditions exist"""
+    from utils.image_pipeline import rendition_paths
+
+    deleted = delete_image_file(image_url)
+    for rendition_url in rendition_paths(image_url):
+        if os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], os.path.basename(rendition_url))):
+            delete_image_file(rendition_url)
+    return deleted
+
 import os
 from werkzeug.utils import secure_filename
 from flask import current_app
@@ -0,0 +1,432 @@
+from datetime import datetime, timedelta, timezone
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Daraja results of an STK push that mean the customer did not pay: cancelled, timed out
+CANCELLED_RESULT_CODES = {'1032', '1037'}
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def mpesa_status_payload(transaction):
+    """Payment state of an STK push transaction, as polled by the till and published on the bus"""
+    entries = transaction.outbox_entries
+    entry = max(entries, key=lambda e: e.id) if entries else None
+    return {
+        'sale_id': transaction.sale_id,
+        'mpesa_transaction_id': transaction.id,
+        'transaction_id': transaction.transaction_id,
+        'status': transaction.status.value,
+        'stk_push': {
+            'status': entry.status.value,
+            'attempts': entry.attempts,
+            'last_error': entry.last_error,
+            'processed_at': entry.processed_at.isoformat() if entry.processed_at else None
+        } if entry else None,
+        'checkout_request_id': transaction.checkout_request_id,
+        'mpesa_receipt_number': transaction.mpesa_receipt_number,
+        'result_code': transaction.result_code,
+        'result_desc': transaction.result_desc
+    }
+
+
+def enqueue_stk_push(mpesa_transaction):
+    """Add the outbox row for a pending STK push to the current transaction"""
+    from extensions import db
+    from models import MpesaOutbox, MpesaOutboxStatus
+
+    entry = MpesaOutbox(mpesa_transaction=mpesa_transaction, status=MpesaOutboxStatus.PENDING, attempts=0)
+    db.session.add(entry)
+    return entry
+
+
+def match_unknown_stk_push(stk_callback):
+    """
+    Pending transaction of an STK push whose send outcome was unknown, for a
+    callback whose CheckoutRequestID is not on record.
+
+    Only successful callbacks carry the amount and phone number to match on;
+    a unique match gets the callback's request ids and its outbox row is
+    marked SENT. Returns None when nothing (or more than one) matches.
+    """
+    from extensions import db
+    from models import MpesaOutbox, MpesaOutboxStatus, MpesaTransaction, MpesaTransactionStatus
+    from utils.daraja_client import sanitize_phone_number
+
+    metadata = {
+        item.get('Name'): item.get('Value')
+        for item in stk_callback.get('CallbackMetadata', {}).get('Item', [])
+    }
+    if metadata.get('Amount') is None or metadata.get('PhoneNumber') is None:
+        return None
+
+    candidates = db.session.execute(
+        db.select(MpesaOutbox, MpesaTransaction)
+        .join(MpesaOutbox.mpesa_transaction)
+        .where(
+            MpesaOutbox.status == MpesaOutboxStatus.UNKNOWN,
+            MpesaTransaction.status == MpesaTransactionStatus.PENDING,
+            MpesaTransaction.checkout_request_id.is_(None)
+        )
+    ).all()
+    # The push sends the amount rounded to whole shillings and the phone as 2547XXXXXXXX
+    matches = [
+        (entry, transaction) for entry, transaction in candidates
+        if int(round(float(transaction.amount))) == int(round(float(metadata['Amount'])))
+        and sanitize_phone_number(transaction.phone_number) == str(metadata['PhoneNumber'])
+    ]
+    if len(matches) != 1:
+        if matches:
+            logger.warning(f"{len(matches)} unknown STK pushes match callback {stk_callback.get('CheckoutRequestID')}")
+        return None
+
+    entry, transaction = matches[0]
+    transaction.checkout_request_id = stk_callback.get('CheckoutRequestID')
+    transaction.merchant_request_id = stk_callback.get('MerchantRequestID')
+    entry.status = MpesaOutboxStatus.SENT
+    entry.processed_at = utcnow()
+    return transaction
+
+
+class MpesaOutboxDispatcher:
+    """
+    Background sender for STK pushes recorded in the mpesa_outbox table.
+
+    A checkout commits the sale, its pending MpesaTransaction and an outbox
+    row in one transaction and calls wake(); the request never waits on
+    Daraja. Each process runs one dispatcher thread that claims due rows one
+    at a time (SELECT ... FOR UPDATE SKIP LOCKED, then a conditional UPDATE
+    from PENDING to SENDING, so a row is only ever claimed once), commits,
+    and only then calls Daraja with no transaction or connection held.
+
+    An STK push is sent again only when it provably never reached Daraja
+    (the connection could not be opened), with exponential backoff up to
+    MPESA_OUTBOX_MAX_ATTEMPTS. Rejections fail the transaction at once.
+    Anything else (a 5xx answer, a read timeout, an unreadable reply, a
+    worker that died mid-send and left its row SENDING past
+    MPESA_OUTBOX_LEASE) may already have prompted the customer, so the row
+    becomes UNKNOWN and is never resent: a successful callback is matched to
+    it by phone and amount, and after MPESA_OUTBOX_SETTLE_AFTER seconds it
+    is settled with a status query when its CheckoutRequestID is known, or
+    expired. Every outcome is published on the notification bus as an
+    'mpesa_status' event for the cashier.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._sent = 0
+        self._retried = 0
+        self._failed = 0
+        self._unknown = 0
+        self._expired = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MPESA_OUTBOX_ENABLED', True)
+        app.config.setdefault('MPESA_OUTBOX_POLL_INTERVAL', 5)
+        app.config.setdefault('MPESA_OUTBOX_BATCH_SIZE', 10)
+        app.config.setdefault('MPESA_OUTBOX_MAX_ATTEMPTS', 3)
+        app.config.setdefault('MPESA_OUTBOX_RETRY_BACKOFF', 5)
+        app.config.setdefault('MPESA_OUTBOX_LEASE', 120)
+        app.config.setdefault('MPESA_OUTBOX_SETTLE_AFTER', 300)
+
+        self.app = app
+        app.extensions['mpesa_outbox'] = self
+        # Started lazily so a forking server starts one thread per worker, not one in the master
+        app.before_request(self._ensure_thread)
+        atexit.register(self.shutdown)
+
+    def wake(self):
+        """Have the dispatcher look for due rows now (call after committing a new outbox row)"""
+        self._ensure_thread()
+        self._wake.set()
+
+    def stats(self):
+        return {
+            'enabled': self.app.config['MPESA_OUTBOX_ENABLED'],
+            'running': bool(self._thread and self._thread.is_alive() and self._pid == os.getpid()),
+            'sent': self._sent,
+            'retried': self._retried,
+            'failed': self._failed,
+            'unknown': self._unknown,
+            'expired': self._expired
+        }
+
+    def shutdown(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+
+    def _ensure_thread(self):
+        if not self.app.config['MPESA_OUTBOX_ENABLED'] or self._stop.is_set():
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='mpesa-outbox', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        from extensions import db
+
+        config = self.app.config
+        while not self._stop.is_set():
+            self._wake.clear()
+            processed = 0
+            try:
+                with self.app.app_context():
+                    try:
+                        processed = self.dispatch_pending()
+                    finally:
+                        db.session.remove()
+            except Exception:
+                logger.exception('M-Pesa outbox dispatch failed')
+
+            # A full batch means more may be due; otherwise sleep until woken or the next poll
+            if processed < config['MPESA_OUTBOX_BATCH_SIZE']:
+                self._wake.wait(config['MPESA_OUTBOX_POLL_INTERVAL'])
+
+    def dispatch_pending(self):
+        """Send up to one batch of due rows, one claim at a time; returns the number sent (needs an app context)"""
+        self.recover_abandoned()
+        self.settle_unknown()
+
+        sent = 0
+        while sent < self.app.config['MPESA_OUTBOX_BATCH_SIZE'] and not self._stop.is_set():
+            entry_id = self.claim_next()
+            if entry_id is None:
+                break
+            self.send(entry_id)
+            sent += 1
+        return sent
+
+    def claim_next(self):
+        """Move the oldest due row from PENDING to SENDING; returns its id, or None when none is due"""
+        from extensions import db
+        from models import MpesaOutbox, MpesaOutboxStatus
+
+        lease = timedelta(seconds=self.app.config['MPESA_OUTBOX_LEASE'])
+        while True:
+            entry_id = db.session.execute(
+                db.select(MpesaOutbox.id)
+                .where(MpesaOutbox.status == MpesaOutboxStatus.PENDING, MpesaOutbox.available_at <= db.func.now())
+                .order_by(MpesaOutbox.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).scalar()
+            if entry_id is None:
+                db.session.commit()
+                return None
+
+            # Only one worker's UPDATE matches, also where SKIP LOCKED is not supported
+            claimed = db.session.execute(
+                db.update(MpesaOutbox)
+                .where(MpesaOutbox.id == entry_id, MpesaOutbox.status == MpesaOutboxStatus.PENDING)
+                .values(
+                    status=MpesaOutboxStatus.SENDING,
+                    attempts=MpesaOutbox.attempts + 1,
+                    available_at=utcnow() + lease
+                )
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return entry_id
+
+    def send(self, entry_id):
+        """Send one claimed (SENDING) STK push and record the outcome"""
+        from extensions import db, notification_bus
+        from models import MpesaOutbox, MpesaOutboxStatus, MpesaTransactionStatus
+        from utils.daraja_client import DELIVERY_NOT_SENT, DELIVERY_UNKNOWN, initiate_stk_push
+
+        config = self.app.config
+        entry = db.session.get(MpesaOutbox, entry_id, populate_existing=True)
+        transaction = entry.mpesa_transaction
+
+        if transaction.status != MpesaTransactionStatus.PENDING:
+            entry.status = MpesaOutboxStatus.FAILED
+            entry.last_error = f'Transaction is {transaction.status.value}'
+            entry.processed_at = utcnow()
+            db.session.commit()
+            return
+
+        request_args = {
+            'phone_number': transaction.phone_number,
+            'amount': float(transaction.amount),
+            'order_id': transaction.id,
+            'description': transaction.transaction_desc or f'Payment {transaction.account_reference}'
+        }
+        # Nothing is held open while Daraja answers
+        db.session.commit()
+
+        try:
+            response_data, status_code = initiate_stk_push(**request_args)
+        except Exception as e:
+            response_data, status_code = {'error': str(e), 'delivery': DELIVERY_UNKNOWN}, 500
+
+        entry = db.session.get(MpesaOutbox, entry_id, with_for_update=True, populate_existing=True)
+        transaction = entry.mpesa_transaction
+        now = utcnow()
+        delivery = response_data.get('delivery')
+
+        if entry.status not in (MpesaOutboxStatus.SENDING, MpesaOutboxStatus.UNKNOWN):
+            # Nothing but this send moves a SENDING row on, short of a manual fix
+            logger.warning(f'M-Pesa outbox row {entry_id} is {entry.status.value}; send outcome not recorded')
+            db.session.commit()
+            return
+
+        if status_code == 200:
+            transaction.checkout_request_id = response_data.get('CheckoutRequestID')
+            transaction.merchant_request_id = response_data.get('MerchantRequestID')
+            transaction.mpesa_data = response_data
+            entry.status = MpesaOutboxStatus.SENT
+            entry.last_error = None
+            entry.processed_at = now
+            self._sent += 1
+        elif delivery == DELIVERY_UNKNOWN:
+            # Daraja may already have prompted the customer; sending again could charge them twice
+            entry.status = MpesaOutboxStatus.UNKNOWN
+            entry.last_error = response_data.get('error', 'STK push outcome unknown')
+            entry.available_at = now + timedelta(seconds=config['MPESA_OUTBOX_SETTLE_AFTER'])
+            self._unknown += 1
+            logger.warning(f'STK push for M-Pesa transaction {transaction.id} has an unknown outcome: {entry.last_error}')
+        elif delivery == DELIVERY_NOT_SENT and entry.attempts < config['MPESA_OUTBOX_MAX_ATTEMPTS']:
+            entry.status = MpesaOutboxStatus.PENDING
+            entry.last_error = response_data.get('error', f'HTTP {status_code}')
+            entry.available_at = now + timedelta(seconds=config['MPESA_OUTBOX_RETRY_BACKOFF'] * 2 ** (entry.attempts - 1))
+            self._retried += 1
+        else:
+            error = response_data.get('error', 'STK Push failed')
+            transaction.status = MpesaTransactionStatus.FAILED
+            transaction.result_desc = error
+            transaction.mpesa_data = response_data
+            entry.status = MpesaOutboxStatus.FAILED
+            entry.last_error = error
+            entry.processed_at = now
+            self._failed += 1
+            logger.warning(f'STK push for M-Pesa transaction {transaction.id} failed: {error}')
+
+        notification_bus.publish_after_commit(
+            db.session, 'mpesa_status', mpesa_status_payload(transaction), user_id=transaction.user_id
+        )
+        db.session.commit()
+
+    def recover_abandoned(self):
+        """Mark rows left SENDING past their lease (the worker died mid-send) as UNKNOWN"""
+        from extensions import db, notification_bus
+        from models import MpesaOutbox, MpesaOutboxStatus
+
+        entries = db.session.execute(
+            db.select(MpesaOutbox)
+            .where(MpesaOutbox.status == MpesaOutboxStatus.SENDING, MpesaOutbox.available_at <= db.func.now())
+            .order_by(MpesaOutbox.id)
+            .limit(self.app.config['MPESA_OUTBOX_BATCH_SIZE'])
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+
+        settle_at = utcnow() + timedelta(seconds=self.app.config['MPESA_OUTBOX_SETTLE_AFTER'])
+        for entry in entries:
+            entry.status = MpesaOutboxStatus.UNKNOWN
+            entry.last_error = 'Dispatcher stopped while sending; outcome unknown'
+            entry.available_at = settle_at
+            self._unknown += 1
+            logger.warning(f'M-Pesa outbox row {entry.id} was abandoned mid-send; waiting for its callback')
+            notification_bus.publish_after_commit(
+                db.session, 'mpesa_status', mpesa_status_payload(entry.mpesa_transaction),
+                user_id=entry.mpesa_transaction.user_id
+            )
+        db.session.commit()
+
+    def settle_unknown(self):
+        """Resolve UNKNOWN rows whose callback did not arrive within MPESA_OUTBOX_SETTLE_AFTER seconds"""
+        from extensions import db
+        from models import MpesaOutbox, MpesaOutboxStatus
+
+        config = self.app.config
+        entries = db.session.execute(
+            db.select(MpesaOutbox)
+            .where(MpesaOutbox.status == MpesaOutboxStatus.UNKNOWN, MpesaOutbox.available_at <= db.func.now())
+            .order_by(MpesaOutbox.id)
+            .limit(config['MPESA_OUTBOX_BATCH_SIZE'])
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+
+        # Pushed back so other workers leave them alone while this one settles them
+        settle_at = utcnow() + timedelta(seconds=config['MPESA_OUTBOX_SETTLE_AFTER'])
+        for entry in entries:
+            entry.available_at = settle_at
+        entry_ids = [entry.id for entry in entries]
+        db.session.commit()
+
+        for entry_id in entry_ids:
+            self.settle(entry_id)
+
+    def settle(self, entry_id):
+        """Query Daraja for one UNKNOWN row when its CheckoutRequestID is known, otherwise expire it"""
+        from extensions import db, notification_bus
+        from models import MpesaOutbox, MpesaOutboxStatus, MpesaTransactionStatus
+        from utils.daraja_client import query_transaction_status
+
+        entry = db.session.get(MpesaOutbox, entry_id, populate_existing=True)
+        transaction = entry.mpesa_transaction
+        checkout_request_id = transaction.checkout_request_id
+
+        response_data, status_code = None, None
+        if transaction.status == MpesaTransactionStatus.PENDING and checkout_request_id:
+            db.session.commit()
+            response_data, status_code = query_transaction_status(checkout_request_id)
+            entry = db.session.get(MpesaOutbox, entry_id, with_for_update=True, populate_existing=True)
+            transaction = entry.mpesa_transaction
+
+        if entry.status != MpesaOutboxStatus.UNKNOWN:
+            db.session.commit()
+            return
+
+        now = utcnow()
+        result_code = response_data.get('ResultCode') if status_code == 200 else None
+        if transaction.status != MpesaTransactionStatus.PENDING:
+            # Settled by its callback meanwhile, so the push did reach the customer
+            entry.status = MpesaOutboxStatus.SENT
+        elif result_code is not None:
+            transaction.result_code = str(result_code)
+            transaction.result_desc = response_data.get('ResultDesc')
+            transaction.mpesa_data = response_data
+            if str(result_code) == '0':
+                transaction.status = MpesaTransactionStatus.COMPLETED
+                transaction.completed_at = now
+            elif str(result_code) in CANCELLED_RESULT_CODES:
+                transaction.status = MpesaTransactionStatus.CANCELLED
+            else:
+                transaction.status = MpesaTransactionStatus.FAILED
+            entry.status = MpesaOutboxStatus.SENT
+        else:
+            # No callback and nothing to query by: the prompt has long timed out on the phone
+            transaction.status = MpesaTransactionStatus.EXPIRED
+            transaction.result_desc = 'STK push outcome unknown and no payment callback received'
+            entry.status = MpesaOutboxStatus.FAILED
+            entry.last_error = transaction.result_desc
+            self._expired += 1
+            logger.warning(f'Expired M-Pesa transaction {transaction.id} after an STK push with unknown outcome')
+        entry.processed_at = now
+
+        notification_bus.publish_after_commit(
+            db.session, 'mpesa_status', mpesa_status_payload(transaction), user_id=transaction.user_id
+        )
+        db.session.commit()
@@ -0,0 +1,217 @@
+from sqlalchemy import event
+import json
+import logging
+import os
+import queue
+import select
+import threading
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('memory', 'postgres')
+PENDING_KEY = 'notification_bus_pending'
+
+
+class Subscription:
+    """Events delivered to one connected client (one SSE stream)"""
+
+    def __init__(self, bus, user_id, max_size):
+        self.bus = bus
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=max_size)
+        self.overflowed = False
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # A slow client missed events; it is told to refetch instead
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Next event, or None when nothing arrived within timeout seconds"""
+        if self.overflowed:
+            self.overflowed = False
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            return {'event': 'resync', 'data': {}}
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NotificationBus:
+    """
+    Publish/subscribe hub feeding the notification SSE streams.
+
+    With the 'memory' backend events only reach clients connected to the same
+    process. With the 'postgres' backend events are sent with pg_notify and
+    each process runs one LISTEN thread that fans them out to its local
+    subscribers, so multi-worker deployments see every event.
+
+    Messages are dicts {'event': name, 'data': payload, 'user_id': id or None};
+    user_id None reaches every connected user.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listener_pid = None
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('NOTIFICATION_BUS_BACKEND', 'memory')
+        app.config.setdefault('NOTIFICATION_BUS_CHANNEL', 'notifications')
+        app.config.setdefault('NOTIFICATION_SUBSCRIBER_QUEUE_SIZE', 100)
+
+        if app.config['NOTIFICATION_BUS_BACKEND'] not in BACKENDS:
+            raise ValueError(f"NOTIFICATION_BUS_BACKEND must be one of {', '.join(BACKENDS)}")
+
+        self.app = app
+        app.extensions['notification_bus'] = self
+
+    @property
+    def backend(self):
+        return self.app.config['NOTIFICATION_BUS_BACKEND']
+
+    def subscribe(self, user_id):
+        """Register a subscriber for user_id; use as a context manager to unsubscribe"""
+        subscription = Subscription(self, user_id, self.app.config['NOTIFICATION_SUBSCRIBER_QUEUE_SIZE'])
+        with self._lock:
+            self._subscribers.add(subscription)
+        if self.backend == 'postgres':
+            self._ensure_listener()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event_name, data, user_id=None):
+        """Send an event now (use publish_after_commit from inside a transaction)"""
+        self._send([{'event': event_name, 'data': data, 'user_id': user_id}])
+
+    def publish_after_commit(self, session, event_name, data, user_id=None):
+        """Queue an event on session; it is published only if the transaction commits"""
+        session.info.setdefault(PENDING_KEY, []).append((event_name, data, user_id))
+
+    def register_session_events(self, session):
+        """Hook publish_after_commit into a session (or scoped_session / sessionmaker)"""
+        if not event.contains(session, 'after_commit', self._after_commit):
+            event.listen(session, 'after_commit', self._after_commit)
+            event.listen(session, 'after_soft_rollback', self._after_rollback)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.backend,
+                'subscribers': len(self._subscribers),
+                'listener_running': bool(self._listener and self._listener.is_alive())
+            }
+
+    def _after_commit(self, session):
+        messages = [
+            {'event': event_name, 'data': data, 'user_id': user_id}
+            for event_name, data, user_id in session.info.pop(PENDING_KEY, [])
+        ]
+        if not messages:
+            return
+        try:
+            # One round trip for everything the transaction queued (e.g. a bulk fan-out)
+            self._send(messages)
+            return
+        except Exception:
+            if len(messages) == 1:
+                logger.exception(f"Failed to publish {messages[0]['event']} event")
+                return
+            logger.exception(f'Failed to publish {len(messages)} events together, retrying one by one')
+        # One bad event (e.g. over pg_notify's payload limit) must not cost the others
+        for message in messages:
+            try:
+                self._send([message])
+            except Exception:
+                logger.exception(f"Failed to publish {message['event']} event")
+
+    def _after_rollback(self, session, previous_transaction):
+        # Savepoint and failed-flush rollbacks leave the outer transaction (and its events) alive
+        if not session.in_transaction():
+            session.info.pop(PENDING_KEY, None)
+
+    def _send(self, messages):
+        if self.backend == 'postgres':
+            self._notify(messages)
+        else:
+            for message in messages:
+                self._dispatch(message)
+
+    def _dispatch(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        target = message['user_id']
+        for subscription in subscribers:
+            if target is None or target == subscription.user_id:
+                subscription.deliver(message)
+
+    def _notify(self, messages):
+        """pg_notify every message on one connection, in one transaction"""
+        from extensions import db
+
+        channel = self.app.config['NOTIFICATION_BUS_CHANNEL']
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(
+                    db.text('SELECT pg_notify(:channel, :payload)'),
+                    [{'channel': channel, 'payload': json.dumps(message)} for message in messages]
+                )
+
+    def _ensure_listener(self):
+        """Start the LISTEN thread once per process"""
+        if self._listener_pid == os.getpid() and self._listener is not None and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid() and self._listener is not None and self._listener.is_alive():
+                return
+            self._listener_pid = os.getpid()
+            self._listener = threading.Thread(target=self._listen, name='notification-listener', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        from extensions import db
+
+        channel = self.app.config['NOTIFICATION_BUS_CHANNEL']
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    pooled = db.engine.raw_connection()
+                # The LISTEN connection lives for the thread's lifetime, keep it out of the pool
+                pooled.detach()
+                connection = pooled.driver_connection
+                try:
+                    connection.autocommit = True
+                    connection.cursor().execute(f'LISTEN "{channel}"')
+                    while not self._stop.is_set():
+                        if select.select([connection], [], [], 5) == ([], [], []):
+                            continue
+                        connection.poll()
+                        while connection.notifies:
+                            notify = connection.notifies.pop(0)
+                            self._dispatch(json.loads(notify.payload))
+                finally:
+                    connection.close()
+            except Exception:
+                logger.exception('Notification listener failed, reconnecting')
+                self._stop.wait(5)
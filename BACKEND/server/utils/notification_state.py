@@ -0,0 +1,183 @@
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import Notification, NotificationRead, UserNotificationState
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def visible_to(user_id):
+    """Notifications addressed to the user or system-wide"""
+    return db.or_(Notification.user_id == user_id, Notification.user_id.is_(None))
+
+
+def unread_filter(user_id, watermark):
+    """
+    SQL condition selecting notifications the user has not read.
+
+    Anything at or below the user's watermark is read. Above it, targeted
+    notifications use their own is_read flag and system-wide ones are unread
+    until the user has a receipt in notification_reads.
+    """
+    has_receipt = db.exists().where(
+        NotificationRead.notification_id == Notification.id,
+        NotificationRead.user_id == user_id
+    )
+    # System-wide notifications flagged is_read before per-user receipts
+    # existed stay read for everyone; new reads never set the shared flag
+    return db.and_(
+        Notification.id > watermark,
+        Notification.is_read == False,
+        db.or_(
+            Notification.user_id == user_id,
+            db.and_(Notification.user_id.is_(None), ~has_receipt)
+        )
+    )
+
+
+def compute_unread_count(user_id, watermark=0):
+    """Count unread notifications from scratch (used to seed or repair the counter)"""
+    return Notification.query.filter(unread_filter(user_id, watermark)).count()
+
+
+def get_state(user_id):
+    """
+    The user's notification state, created with a computed count on first use.
+
+    Concurrent first requests may race on the insert; the loser re-reads the
+    row the winner created.
+    """
+    state = db.session.get(UserNotificationState, user_id)
+    if state is not None:
+        return state
+
+    state = UserNotificationState(
+        user_id=user_id,
+        unread_count=compute_unread_count(user_id),
+        last_read_notification_id=0
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(state)
+    except IntegrityError:
+        state = db.session.get(UserNotificationState, user_id)
+    return state
+
+
+def get_unread_count(user_id):
+    """Unread notifications of the user, read from the maintained counter"""
+    return get_state(user_id).unread_count
+
+
+def get_read_ids(user_id, notifications):
+    """Ids among notifications that the user has read, for rendering a page"""
+    watermark = get_state(user_id).last_read_notification_id
+    broadcast_ids = [n.id for n in notifications if n.user_id is None and n.id > watermark]
+
+    receipts = set()
+    if broadcast_ids:
+        receipts = {
+            row.notification_id for row in NotificationRead.query.filter(
+                NotificationRead.user_id == user_id,
+                NotificationRead.notification_id.in_(broadcast_ids)
+            )
+        }
+
+    read_ids = set()
+    for notification in notifications:
+        if notification.id <= watermark or notification.id in receipts or notification.is_read:
+            read_ids.add(notification.id)
+    return read_ids
+
+
+def record_notification_created(notification):
+    """Bump unread counters for the recipients of a new notification"""
+    query = db.update(UserNotificationState).values(
+        unread_count=UserNotificationState.unread_count + 1
+    )
+    if notification.user_id is not None:
+        query = query.where(UserNotificationState.user_id == notification.user_id)
+    db.session.execute(query.execution_options(synchronize_session=False))
+
+
+def record_notifications_created_for(user_ids):
+    """Bump unread counters of several users at once (bulk fan-out)"""
+    if not user_ids:
+        return
+    db.session.execute(
+        db.update(UserNotificationState)
+        .where(UserNotificationState.user_id.in_(user_ids))
+        .values(unread_count=UserNotificationState.unread_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def record_notification_deleted(notification):
+    """Decrement counters of users for whom the deleted notification was unread"""
+    if notification.is_read:
+        return
+
+    query = db.update(UserNotificationState).where(
+        UserNotificationState.last_read_notification_id < notification.id
+    ).values(unread_count=db.case(
+        (UserNotificationState.unread_count > 0, UserNotificationState.unread_count - 1),
+        else_=0
+    ))
+
+    if notification.user_id is not None:
+        query = query.where(UserNotificationState.user_id == notification.user_id)
+    else:
+        query = query.where(UserNotificationState.user_id.notin_(
+            db.select(NotificationRead.user_id).where(NotificationRead.notification_id == notification.id)
+        ))
+    db.session.execute(query.execution_options(synchronize_session=False))
+
+
+def mark_read(user_id, notification):
+    """
+    Mark one notification read for the user.
+
+    Returns:
+        bool: True if it was unread before
+    """
+    state = get_state(user_id)
+    if notification.id <= state.last_read_notification_id:
+        return False
+
+    if notification.is_read:
+        return False
+
+    if notification.user_id is None:
+        if db.session.get(NotificationRead, (notification.id, user_id)):
+            return False
+        db.session.add(NotificationRead(notification_id=notification.id, user_id=user_id))
+    else:
+        notification.is_read = True
+
+    state.unread_count = db.case(
+        (UserNotificationState.unread_count > 0, UserNotificationState.unread_count - 1),
+        else_=0
+    )
+    return True
+
+
+def mark_all_read(user_id):
+    """
+    Mark everything the user can see as read by moving the watermark.
+
+    Returns:
+        int: Number of notifications that were unread
+    """
+    state = get_state(user_id)
+    marked = state.unread_count
+    latest_id = db.session.query(db.func.max(Notification.id)).scalar() or 0
+
+    state.last_read_notification_id = max(state.last_read_notification_id, latest_id)
+    state.unread_count = 0
+
+    # Receipts below the watermark are implied by it
+    NotificationRead.query.filter(
+        NotificationRead.user_id == user_id,
+        NotificationRead.notification_id <= state.last_read_notification_id
+    ).delete(synchronize_session=False)
+    return marked
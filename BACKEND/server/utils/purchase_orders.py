@@ -0,0 +1,273 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from extensions import db
+from models import (
+    PurchaseOrder, PurchaseOrderLine, PurchaseOrderStatus, Product, Supplier,
+    InventoryTransaction, TransactionType
+)
+from utils.stock_alerts import queue_stock_check
+import logging
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = (PurchaseOrderStatus.ORDERED, PurchaseOrderStatus.PARTIALLY_RECEIVED)
+
+
+def parse_quantity(value, label):
+    """Positive integer quantity, or ValueError naming the offending field"""
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        quantity = None
+    if isinstance(value, bool) or quantity is None or quantity != float(value) or quantity <= 0:
+        raise ValueError(f'{label} must be a positive integer')
+    return quantity
+
+
+def lock_purchase_order(purchase_order_id):
+    """Load a purchase order with a row lock so concurrent receipts are serialized"""
+    return db.session.execute(
+        db.select(PurchaseOrder)
+        .where(PurchaseOrder.id == purchase_order_id)
+        .with_for_update()
+    ).scalar_one_or_none()
+
+
+def adjust_open_po_quantities(deltas):
+    """
+    Apply {product_id: delta} to Product.open_po_quantity with one executemany.
+
+    The counter never goes below zero.
+    """
+    rows = [{'b_id': product_id, 'b_delta': delta} for product_id, delta in sorted(deltas.items()) if delta]
+    if not rows:
+        return
+
+    products = Product.__table__
+    new_quantity = products.c.open_po_quantity + db.bindparam('b_delta')
+    db.session.execute(
+        products.update()
+        .where(products.c.id == db.bindparam('b_id'))
+        .values(open_po_quantity=db.case((new_quantity > 0, new_quantity), else_=0)),
+        rows
+    )
+    expire_products(deltas.keys(), ['open_po_quantity'])
+
+
+def expire_products(product_ids, attributes):
+    """Expire loaded Product objects changed behind the ORM's back by bulk statements"""
+    product_ids = set(product_ids)
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, Product) and obj.id in product_ids:
+            db.session.expire(obj, attributes)
+
+
+def create_purchase_order(supplier_id, lines, created_by=None, expected_date=None, notes=None, submit=False):
+    """
+    Create a purchase order with its lines (products are loaded with one query).
+
+    Args:
+        supplier_id: Supplier the order is placed with
+        lines: List of {'product_id', 'quantity', 'unit_cost' (optional, defaults to product cost)}
+        submit: Place the order right away instead of leaving it as a draft
+
+    Returns:
+        PurchaseOrder: The new order (flushed, not committed)
+
+    Raises:
+        ValueError: If the supplier, products or quantities are invalid
+    """
+    supplier = db.session.get(Supplier, supplier_id)
+    if not supplier:
+        raise ValueError('Invalid supplier_id')
+    if not supplier.is_active:
+        raise ValueError('Supplier is not active')
+    if not lines:
+        raise ValueError('At least one line is required')
+
+    product_ids = [line.get('product_id') for line in lines]
+    if len(set(product_ids)) != len(product_ids):
+        raise ValueError('Each product may appear only once per purchase order')
+
+    products = {
+        product.id: product
+        for product in Product.query.filter(Product.id.in_(product_ids)).all()
+    }
+
+    purchase_order = PurchaseOrder(
+        supplier_id=supplier.id,
+        status=PurchaseOrderStatus.DRAFT,
+        expected_date=expected_date,
+        notes=notes,
+        created_by=created_by
+    )
+
+    total_cost = Decimal('0')
+    for index, line in enumerate(lines):
+        product = products.get(line.get('product_id'))
+        if not product:
+            raise ValueError(f'Invalid product_id on line {index + 1}')
+        quantity = parse_quantity(line.get('quantity'), f'Quantity on line {index + 1}')
+        try:
+            unit_cost = Decimal(str(line['unit_cost'])) if line.get('unit_cost') is not None else product.cost
+        except InvalidOperation:
+            raise ValueError(f'Unit cost on line {index + 1} must be a number')
+        if unit_cost < 0:
+            raise ValueError(f'Unit cost on line {index + 1} cannot be negative')
+
+        purchase_order.lines.append(PurchaseOrderLine(
+            product_id=product.id,
+            quantity_ordered=quantity,
+            quantity_received=0,
+            unit_cost=unit_cost
+        ))
+        total_cost += unit_cost * quantity
+
+    purchase_order.total_cost = total_cost
+    db.session.add(purchase_order)
+    db.session.flush()
+    purchase_order.order_number = f"PO-{datetime.utcnow():%Y%m%d}-{purchase_order.id:05d}"
+
+    if submit:
+        submit_purchase_order(purchase_order)
+    return purchase_order
+
+
+def submit_purchase_order(purchase_order):
+    """Place a draft order; its quantities start counting as on order"""
+    if purchase_order.status != PurchaseOrderStatus.DRAFT:
+        raise ValueError(f'Only draft purchase orders can be submitted (status: {purchase_order.status.value})')
+
+    adjust_open_po_quantities({line.product_id: line.quantity_ordered for line in purchase_order.lines})
+    purchase_order.status = PurchaseOrderStatus.ORDERED
+    purchase_order.ordered_at = datetime.utcnow()
+
+
+def resolve_receipt_quantities(purchase_order, received):
+    """
+    Map line id -> quantity to receive.
+
+    received is a list of {'line_id' or 'product_id', 'quantity'}; None
+    receives everything still outstanding.
+    """
+    if received is None:
+        return {
+            line.id: line.quantity_outstanding
+            for line in purchase_order.lines if line.quantity_outstanding > 0
+        }
+
+    lines_by_id = {line.id: line for line in purchase_order.lines}
+    lines_by_product = {line.product_id: line for line in purchase_order.lines}
+
+    quantities = {}
+    for index, item in enumerate(received):
+        line = lines_by_id.get(item.get('line_id')) if item.get('line_id') else lines_by_product.get(item.get('product_id'))
+        if not line:
+            raise ValueError(f'Receipt {index + 1} does not match a line of this purchase order')
+        quantities[line.id] = quantities.get(line.id, 0) + parse_quantity(item.get('quantity'), f'Quantity on receipt {index + 1}')
+
+    for line_id, quantity in quantities.items():
+        line = lines_by_id[line_id]
+        if quantity > line.quantity_outstanding:
+            raise ValueError(
+                f'Cannot receive {quantity} of product {line.product_id}; '
+                f'only {line.quantity_outstanding} outstanding'
+            )
+    return quantities
+
+
+def receive_purchase_order(purchase_order, received=None, received_by=None, notes=None):
+    """
+    Post a full or partial receipt in the current transaction.
+
+    Product rows are locked in id order and read once, stock and open PO
+    quantities are updated with one executemany, and the inventory ledger
+    rows are written with one bulk insert.
+
+    Returns:
+        list: {'line_id', 'product_id', 'quantity', 'previous_stock', 'new_stock'} per received line
+
+    Raises:
+        ValueError: If the order is not open or quantities are invalid
+    """
+    if purchase_order.status not in OPEN_STATUSES:
+        raise ValueError(f'Purchase order cannot be received (status: {purchase_order.status.value})')
+
+    quantities = resolve_receipt_quantities(purchase_order, received)
+    if not quantities:
+        raise ValueError('Nothing left to receive on this purchase order')
+
+    lines_by_id = {line.id: line for line in purchase_order.lines}
+    product_quantities = {lines_by_id[line_id].product_id: quantity for line_id, quantity in quantities.items()}
+    product_ids = sorted(product_quantities)
+
+    # Lock in a stable order so concurrent receipts and sales queue instead of deadlocking
+    current_stock = dict(db.session.execute(
+        db.select(Product.id, Product.stock)
+        .where(Product.id.in_(product_ids))
+        .order_by(Product.id)
+        .with_for_update()
+    ).all())
+
+    products = Product.__table__
+    quantity_param = db.bindparam('b_quantity')
+    remaining_on_order = products.c.open_po_quantity - quantity_param
+    db.session.execute(
+        products.update()
+        .where(products.c.id == db.bindparam('b_id'))
+        .values(
+            stock=products.c.stock + quantity_param,
+            open_po_quantity=db.case((remaining_on_order > 0, remaining_on_order), else_=0)
+        ),
+        [{'b_id': product_id, 'b_quantity': product_quantities[product_id]} for product_id in product_ids]
+    )
+    expire_products(product_ids, ['stock', 'open_po_quantity'])
+
+    note = notes or f'Received on {purchase_order.order_number}'
+    receipts = []
+    ledger_rows = []
+    for line_id, quantity in quantities.items():
+        line = lines_by_id[line_id]
+        previous_stock = current_stock[line.product_id]
+        receipts.append({
+            'line_id': line.id,
+            'product_id': line.product_id,
+            'quantity': quantity,
+            'previous_stock': previous_stock,
+            'new_stock': previous_stock + quantity
+        })
+        ledger_rows.append({
+            'product_id': line.product_id,
+            'transaction_type': TransactionType.RESTOCK,
+            'quantity_change': quantity,
+            'previous_stock': previous_stock,
+            'new_stock': previous_stock + quantity,
+            'reference_id': purchase_order.id,
+            'notes': note,
+            'created_by': received_by
+        })
+        line.quantity_received += quantity
+
+    db.session.execute(InventoryTransaction.__table__.insert(), ledger_rows)
+
+    if all(line.quantity_outstanding == 0 for line in purchase_order.lines):
+        purchase_order.status = PurchaseOrderStatus.RECEIVED
+        purchase_order.received_at = datetime.utcnow()
+    else:
+        purchase_order.status = PurchaseOrderStatus.PARTIALLY_RECEIVED
+
+    # Stock changed through bulk statements, so alert state is refreshed explicitly
+    queue_stock_check(product_ids)
+    return receipts
+
+
+def cancel_purchase_order(purchase_order):
+    """Cancel an order; whatever was still outstanding stops counting as on order"""
+    if purchase_order.status in (PurchaseOrderStatus.RECEIVED, PurchaseOrderStatus.CANCELLED):
+        raise ValueError(f'Purchase order cannot be cancelled (status: {purchase_order.status.value})')
+
+    if purchase_order.status in OPEN_STATUSES:
+        adjust_open_po_quantities({
+            line.product_id: -line.quantity_outstanding for line in purchase_order.lines
+        })
+    purchase_order.status = PurchaseOrderStatus.CANCELLED
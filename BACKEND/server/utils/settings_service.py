@@ -0,0 +1,155 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SETTING_DATA_TYPES = ('string', 'number', 'boolean', 'json')
+
+
+def parse_setting_value(value, data_type):
+    """Convert a stored setting string into its typed value"""
+    if data_type == 'json':
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+    if data_type == 'number':
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    if data_type == 'boolean':
+        return value.lower() in ('true', '1', 'yes', 'on')
+    return value
+
+
+def serialize_setting_value(value, data_type):
+    """
+    Convert a typed value into the string stored in SystemSettings.value.
+
+    Raises:
+        ValueError: If the value does not match data_type
+    """
+    if data_type == 'json':
+        if not isinstance(value, (dict, list)):
+            raise ValueError('must be a valid JSON object or array')
+        return json.dumps(value)
+    if data_type == 'boolean':
+        return str(bool(value)).lower()
+    if data_type == 'number':
+        try:
+            return str(float(value))
+        except (ValueError, TypeError):
+            raise ValueError('must be a valid number')
+    return str(value)
+
+
+def serialize_setting(setting):
+    """API representation of a SystemSettings row with its typed value"""
+    return {
+        'id': setting.id,
+        'key': setting.key,
+        'value': parse_setting_value(setting.value, setting.data_type),
+        'description': setting.description,
+        'data_type': setting.data_type,
+        'is_public': setting.is_public,
+        'updated_at': setting.updated_at.isoformat() if setting.updated_at else None
+    }
+
+
+def bump_settings_version(session=None):
+    """Increment the settings version in the caller's transaction (call before commit)"""
+    from extensions import db
+    from models import SettingsVersion
+
+    session = session or db.session
+    updated = session.execute(
+        db.update(SettingsVersion)
+        .where(SettingsVersion.id == 1)
+        .values(version=SettingsVersion.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        session.add(SettingsVersion(id=1, version=2))
+
+
+class SettingsCache:
+    """
+    Process-wide cache of all system settings with typed values.
+
+    Settings are loaded once; get() and all() are dictionary lookups. At most
+    every SETTINGS_CACHE_CHECK_INTERVAL seconds a reader checks the one-row
+    settings_version table and reloads everything if another worker (or
+    process) bumped it. Writers call bump_settings_version() inside their
+    transaction and invalidate() after commit.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._settings = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SETTINGS_CACHE_CHECK_INTERVAL', 5)
+        self.app = app
+        app.extensions['settings_cache'] = self
+
+    def get(self, key, default=None):
+        """Typed value of a setting, or default if it does not exist"""
+        setting = self._fresh().get(key)
+        return setting['value'] if setting else default
+
+    def get_setting(self, key):
+        """Full serialized setting (id, value, description, ...) or None"""
+        setting = self._fresh().get(key)
+        return dict(setting) if setting else None
+
+    def all(self, public_only=False):
+        """All settings ordered by key"""
+        settings = self._fresh()
+        return [
+            dict(settings[key]) for key in sorted(settings)
+            if not public_only or settings[key]['is_public']
+        ]
+
+    def invalidate(self):
+        """Force a reload on the next read"""
+        with self._lock:
+            self._version = None
+            self._checked_at = 0.0
+
+    def _fresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.app.config['SETTINGS_CACHE_CHECK_INTERVAL']:
+            return self._settings
+
+        with self._lock:
+            if self._version is not None and now - self._checked_at < self.app.config['SETTINGS_CACHE_CHECK_INTERVAL']:
+                return self._settings
+            self._reload_if_changed()
+            self._checked_at = time.monotonic()
+        return self._settings
+
+    def _reload_if_changed(self):
+        """Compare the version stamp and reload on change, on a connection separate from the request session"""
+        from extensions import db
+        from models import SettingsVersion, SystemSettings
+
+        with db.engine.connect() as connection:
+            version = connection.execute(
+                db.select(SettingsVersion.version).where(SettingsVersion.id == 1)
+            ).scalar() or 0
+            if version == self._version:
+                return
+
+            rows = connection.execute(db.select(SystemSettings.__table__)).all()
+
+        self._settings = {row.key: serialize_setting(row) for row in rows}
+        self._version = version
+        logger.info(f"Loaded {len(self._settings)} settings (version {version})")
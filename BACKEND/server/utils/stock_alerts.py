@@ -0,0 +1,180 @@
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from extensions import db, notification_bus
+from models import Product, Notification, NotificationType, LowStockAlertState
+from utils.notification_state import record_notification_created
+import logging
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'stock_alert_product_ids'
+CHANGED_KEY = 'stock_alert_products'
+
+# Stock levels from best to worst; an alert is sent whenever a product gets worse
+LEVELS = ('ok', 'low', 'out')
+
+
+def stock_level(stock, min_stock_level):
+    """Alert level for a stock quantity (same thresholds as Product.status)"""
+    if stock <= 0:
+        return 'out'
+    if stock <= min_stock_level:
+        return 'low'
+    return 'ok'
+
+
+def queue_stock_check(product_ids, session=None):
+    """
+    Queue products for evaluation when the current transaction commits.
+
+    ORM changes to Product.stock / min_stock_level are picked up
+    automatically; code that changes stock with bulk UPDATE statements must
+    call this with the affected ids.
+    """
+    session = session or db.session
+    session.info.setdefault(PENDING_KEY, set()).update(product_ids)
+
+
+def collect_stock_changes(session, flush_context, instances):
+    """before_flush: remember products whose stock or threshold changed"""
+    changed = set()
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Product):
+            continue
+        state = inspect(obj)
+        if obj in session.new or state.attrs.stock.history.has_changes() or state.attrs.min_stock_level.history.has_changes():
+            changed.add(obj)
+    if changed:
+        session.info.setdefault(CHANGED_KEY, set()).update(changed)
+
+
+def resolve_pending_ids(session):
+    """Ids queued explicitly plus ids of products changed through the ORM"""
+    product_ids = set(session.info.pop(PENDING_KEY, set()))
+    for product in session.info.pop(CHANGED_KEY, set()):
+        if product.id is not None:
+            product_ids.add(product.id)
+    return product_ids
+
+
+def transition_state(product_id, current_level, new_level):
+    """
+    Move a product's alert state from current_level to new_level.
+
+    The conditional UPDATE (or the INSERT for a first alert) only succeeds
+    for one of several concurrent transactions, so a crossing alerts once.
+
+    Returns:
+        bool: True if this transaction made the transition
+    """
+    if current_level is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(LowStockAlertState(product_id=product_id, level=new_level))
+            return True
+        except IntegrityError:
+            current_level = 'ok'
+
+    result = db.session.execute(
+        db.update(LowStockAlertState)
+        .where(LowStockAlertState.product_id == product_id, LowStockAlertState.level == current_level)
+        .values(level=new_level)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def evaluate_stock_alerts(session):
+    """before_commit: compare queued products with their alert state and alert on each worsening"""
+    if not has_app_context() or not current_app.config.get('LOW_STOCK_ALERTS_ENABLED', True):
+        session.info.pop(PENDING_KEY, None)
+        session.info.pop(CHANGED_KEY, None)
+        return
+
+    # Make sure the changes of the final flush are collected too
+    session.flush()
+    product_ids = resolve_pending_ids(session)
+    if not product_ids:
+        return
+
+    try:
+        with session.begin_nested():
+            rows = session.execute(
+                db.select(
+                    Product.id,
+                    Product.name,
+                    Product.stock,
+                    Product.min_stock_level,
+                    Product.open_po_quantity,
+                    LowStockAlertState.level
+                ).outerjoin(
+                    LowStockAlertState, LowStockAlertState.product_id == Product.id
+                ).where(Product.id.in_(product_ids), Product.is_active == True)
+            ).all()
+
+            alerts = []
+            for row in rows:
+                new_level = stock_level(row.stock, row.min_stock_level)
+                current_level = row.level
+                if new_level == (current_level or 'ok'):
+                    continue
+                if not transition_state(row.id, current_level, new_level):
+                    continue
+                if LEVELS.index(new_level) > LEVELS.index(current_level or 'ok'):
+                    alerts.append((row, new_level))
+
+            notifications = []
+            open_po_quantities = {row.id: row.open_po_quantity for row, level in alerts}
+            for row, level in alerts:
+                title = f"Out of stock: {row.name}" if level == 'out' else f"Low stock: {row.name}"
+                message = f"{row.name} has {row.stock} units left (minimum {row.min_stock_level})."
+                if row.open_po_quantity:
+                    message += f" {row.open_po_quantity} units are already on order."
+                notification = Notification(
+                    user_id=None,
+                    title=title,
+                    message=message,
+                    notification_type=NotificationType.WARNING
+                )
+                session.add(notification)
+                notifications.append((row.id, notification))
+            session.flush()
+
+            if notifications:
+                session.execute(
+                    db.update(LowStockAlertState),
+                    [{'product_id': product_id, 'notification_id': n.id} for product_id, n in notifications]
+                )
+
+            for product_id, notification in notifications:
+                record_notification_created(notification)
+                notification_bus.publish_after_commit(session, 'notification', {
+                    'id': notification.id,
+                    'user_id': None,
+                    'title': notification.title,
+                    'message': notification.message,
+                    'notification_type': notification.notification_type.value,
+                    'action_url': None,
+                    'product_id': product_id,
+                    'open_po_quantity': open_po_quantities[product_id]
+                })
+    except Exception:
+        # Alerts must never block the stock change itself
+        logger.exception('Failed to evaluate low stock alerts')
+
+
+def discard_stock_changes(session, previous_transaction=None):
+    # Savepoint and failed-flush rollbacks leave the outer transaction's changes in place
+    if session.in_transaction():
+        return
+    session.info.pop(PENDING_KEY, None)
+    session.info.pop(CHANGED_KEY, None)
+
+
+def init_stock_alerts(session):
+    """Register the stock alert listeners on a session (or scoped_session / sessionmaker)"""
+    if not event.contains(session, 'before_flush', collect_stock_changes):
+        event.listen(session, 'before_flush', collect_stock_changes)
+        event.listen(session, 'before_commit', evaluate_stock_alerts)
+        event.listen(session, 'after_soft_rollback', discard_stock_changes)
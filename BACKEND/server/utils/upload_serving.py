@@ -0,0 +1,103 @@
+from flask import abort, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+from utils.images import is_content_addressed
+import logging
+import mimetypes
+import os
+
+logger = logging.getLogger(__name__)
+
+SERVE_MODES = ('flask', 'x-accel', 'x-sendfile')
+
+# One year, the longest lifetime caches honour
+IMMUTABLE_MAX_AGE = 31536000
+
+
+def upload_cache_policy(filename):
+    """(max_age, immutable) for an uploaded file"""
+    if is_content_addressed(filename):
+        return IMMUTABLE_MAX_AGE, True
+    return current_app.config.get('UPLOAD_CACHE_MAX_AGE', 3600), False
+
+
+def file_etag(path, filename, stat):
+    """Strong ETag: the name for content-addressed files, mtime and size otherwise"""
+    if is_content_addressed(filename):
+        return os.path.basename(filename)
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def offload_response(path, filename, stat, mode):
+    """
+    Empty response telling the front web server to send the file itself.
+
+    Conditional requests are still answered here (from a stat call), and a
+    304 carries no offload header, so a revalidation never reaches the file
+    at all; range requests are handled by the front server.
+    """
+    response = current_app.response_class(
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    )
+    if mode == 'x-accel':
+        prefix = current_app.config.get('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + filename.lstrip('/')
+    else:
+        response.headers['X-Sendfile'] = path
+
+    response.last_modified = int(stat.st_mtime)
+    response.set_etag(file_etag(path, filename, stat))
+    response = response.make_conditional(request)
+    # nginx and Apache follow the offload header whatever the status, so only a 200 may carry it
+    if response.status_code != 200:
+        response.headers.pop('X-Accel-Redirect', None)
+        response.headers.pop('X-Sendfile', None)
+    return response
+
+
+def send_upload(filename):
+    """
+    Serve a file from UPLOAD_FOLDER with caching headers and conditional support.
+
+    UPLOAD_SERVE_MODE selects who streams the bytes:
+
+        flask       Werkzeug sends the file, honouring If-None-Match,
+                    If-Modified-Since and Range (default)
+        x-accel     nginx sends it via X-Accel-Redirect to UPLOAD_ACCEL_PREFIX,
+                    which must be an internal location aliased to UPLOAD_FOLDER
+        x-sendfile  Apache/lighttpd send it via X-Sendfile
+
+    Content-addressed files are cached for a year as immutable; other files
+    for UPLOAD_CACHE_MAX_AGE seconds and then revalidated.
+    """
+    mode = current_app.config.get('UPLOAD_SERVE_MODE', 'flask')
+    if mode not in SERVE_MODES:
+        raise ValueError(f"UPLOAD_SERVE_MODE must be one of {', '.join(SERVE_MODES)}")
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    path = safe_join(upload_folder, filename)
+    if path is None:
+        abort(404)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+
+    max_age, immutable = upload_cache_policy(filename)
+
+    if mode == 'flask':
+        response = send_from_directory(
+            upload_folder,
+            filename,
+            etag=file_etag(path, filename, stat),
+            max_age=max_age
+        )
+    else:
+        response = offload_response(path, filename, stat, mode)
+        response.cache_control.max_age = max_age
+
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    return response